@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Benchmark AsyncGitRepository under load: latency of <rev>:<path> reads
+arriving faster than one thread can serve them.
+
+Builds a synthetic history (see bench_gc) and packs it, so reads inflate
+delta chains.  Then --requests reads of random files at random commits
+arrive at random, --rate per second on average, each one a task of its
+own as a web handler would be.  They are served through
+AsyncGitRepository and, for comparison, by calling object_read directly
+in the tasks, which blocks the event loop.  Latency is counted from when
+a request was due to arrive, so time spent waiting on a blocked loop
+counts.  Reports p50/p99 latency and throughput, and how long the loop
+stalls, i.e. what every other task of the service waits; every run
+starts with a cold cache.
+
+    python3 bench/bench_async.py --requests 1000 --rate 100
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_gc import build
+from object.commit.commit_walk import commit_walk
+from object.object_utils import object_find, object_read
+from object.pack.pack_write import pack_repack
+from object.refs.refs_utils import ref_resolve
+from repository.async_repository import AsyncGitRepository
+from repository.git_repository import GitRepository
+from repository.repo_utils import repo_create
+
+
+def read_path_blocking(repo, rev, path):
+    tree = object_read(repo, object_find(repo, rev, b'tree'))
+    return object_read(repo, tree.find(path).sha)
+
+async def request(read, due, rev, path, latencies):
+    await asyncio.sleep(due - time.perf_counter())
+    await read(rev, path)
+    latencies.append(time.perf_counter() - due)
+
+async def heartbeat(lags, done):
+    """How late a 1 ms timer fires: what every other task on the loop
+waits, on top of its own work."""
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+async def load(read, work):
+    latencies = list()
+    lags = list()
+    done = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, done))
+    start = time.perf_counter()
+    await asyncio.gather(*(request(read, start + at, rev, path, latencies)
+                           for at, rev, path in work))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await beat
+    return elapsed, sorted(latencies), sorted(lags)
+
+def percentile(values, p):
+    return values[min(len(values) - 1, len(values) * p // 100)] * 1000
+
+def report(label, elapsed, latencies, lags):
+    print(f"{label:>10}: p50 {percentile(latencies, 50):8.2f} ms, "
+          f"p99 {percentile(latencies, 99):8.2f} ms, "
+          f"{len(latencies) / elapsed:6.0f} reads/s; "
+          f"loop stalls p50 {percentile(lags, 50):6.2f} ms, p99 {percentile(lags, 99):6.2f} ms")
+
+async def run(path, work, workers):
+    repo = GitRepository(path)
+    async def blocking(rev, path):
+        return read_path_blocking(repo, rev, path)
+    report("blocking", *await load(blocking, work))
+
+    async with AsyncGitRepository(GitRepository(path), workers) as arepo:
+        report("async", *await load(arepo.read_path, work))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commits", type=int, default=50)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=30000, help="Lines per file")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=100, help="Requests per second")
+    parser.add_argument("--workers", type=int, help="Size of the thread pool")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "repo")
+        repo_create(path)
+        repo = GitRepository(path)
+        build(repo, args.commits, args.files, args.lines)
+        pack_repack(repo)
+        commits = list(commit_walk(repo, [ref_resolve(repo, "HEAD")]))
+
+        rng = random.Random(42)
+        work = list()
+        at = 0
+        for _ in range(args.requests):
+            at += rng.expovariate(args.rate)
+            work.append((at, rng.choice(commits), f"f{rng.randrange(args.files):04}.txt"))
+        asyncio.run(run(path, work, args.workers))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Benchmark reachability bitmaps against a plain traversal.
+
+Builds a synthetic history of --commits commits over --files files (see
+bench_gc), repacks it with bitmaps, then times two queries both ways:
+every object reachable from the tip, and the objects reachable from the
+tip but not from the commit --behind commits before it.  Both ways must
+find the same objects.
+
+    python3 bench/bench_bitmap.py --commits 1000 --files 200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_gc import build
+from object.commit.commit_walk import commit_walk
+from object.pack.pack_bitmap import bitmap_open, bitmap_reachable
+from object.pack.pack_write import pack_repack
+from object.refs.refs_utils import ref_resolve
+from repository.git_repository import GitRepository
+from repository.repo_utils import repo_create
+
+
+def query(repo, bitmap, tips, exclude, rounds):
+    """Best time of rounds runs, and the SHAs found."""
+    best = None
+    for _ in range(rounds):
+        # Start cold: nothing inflated, no bitmap decoded
+        repo = GitRepository(repo.worktree)
+        if bitmap:
+            bitmap = bitmap_open(repo)
+        start = time.perf_counter()
+        bits, seen = bitmap_reachable(repo, bitmap, tips, exclude)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    found = set(seen)
+    if bitmap:
+        found.update(bitmap.shas(bits))
+    return best, found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commits", type=int, default=500)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--lines", type=int, default=50, help="Lines per file")
+    parser.add_argument("--behind", type=int, default=10,
+                        help="How far back the excluded commit is")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "repo")
+        repo_create(path)
+        repo = GitRepository(path)
+        build(repo, args.commits, args.files, args.lines)
+
+        start = time.perf_counter()
+        objects, _, _ = pack_repack(repo)
+        bitmap = bitmap_open(repo)
+        print(f"gc: {objects} objects, {len(bitmap.entries)} bitmaps, "
+              f"{time.perf_counter() - start:.2f}s")
+
+        tip = ref_resolve(repo, "HEAD")
+        old = list(commit_walk(repo, [tip]))[min(args.behind, args.commits - 1)]
+        for label, exclude in (("everything", []), (f"tip ^tip~{args.behind}", [old])):
+            walk, found = query(repo, None, [tip], exclude, args.rounds)
+            fast, found_bitmap = query(repo, bitmap, [tip], exclude, args.rounds)
+            if found != found_bitmap:
+                raise Exception(f"{label}: bitmap found {len(found_bitmap)} objects, walk {len(found)}")
+            print(f"{label:>16}: {len(found):7} objects, walk {walk * 1000:8.1f} ms, "
+                  f"bitmap {fast * 1000:7.1f} ms ({walk / fast:.0f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Benchmark `giit clone`: a full fetch and checkout, with no network.
+
+Builds a synthetic history of --commits commits over --files files (see
+bench_gc) and repacks it, then clones it: through upload-pack run as a
+child process (a local path), and over smart HTTP from a server in this
+process on a free local port.  When git is installed, git clones the
+same ways from giit's upload-pack and server, and giit clones from
+git's upload-pack.  Reports the objects received, the pack size and the
+throughput of each.
+
+    python3 bench/bench_clone.py --commits 1000 --files 200
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_gc import build
+from object.pack.pack_write import pack_repack
+from remote.remote_http import remote_http_server
+from remote.remote_utils import GIIT, remote_clone
+from repository.git_repository import GitRepository
+from repository.repo_utils import repo_create
+
+
+def pack_size(path):
+    size = 0
+    pack = os.path.join(path, ".git", "objects", "pack")
+    for name in os.listdir(pack):
+        if name.endswith(".pack"):
+            size += os.path.getsize(os.path.join(pack, name))
+    return size
+
+def report(label, path, objects, elapsed):
+    size = pack_size(path) / (1 << 20)
+    print(f"{label:>24}: {objects if objects is not None else '':>7} objects, {size:7.2f} MiB"
+          f" in {elapsed:6.2f}s, {size / elapsed:6.2f} MiB/s")
+
+def giit_clone(label, url, path, upload_pack = None):
+    start = time.perf_counter()
+    _, objects, _ = remote_clone(url, path, upload_pack)
+    report(label, path, objects, time.perf_counter() - start)
+
+def git_clone(label, url, path):
+    command = ["git", "clone", "-q", "--no-local", url, path]
+    if not url.startswith("http"):
+        command[2:2] = ["-u", f"{sys.executable} {GIIT} upload-pack"]
+    start = time.perf_counter()
+    subprocess.run(command, check=True)
+    report(label, path, None, time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commits", type=int, default=200)
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--lines", type=int, default=500, help="Lines per file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source")
+        repo_create(source)
+        repo = GitRepository(source)
+        build(repo, args.commits, args.files, args.lines)
+        objects, deltas, _ = pack_repack(repo)
+        print(f"{'source':>24}: {objects:7} objects, {pack_size(source) / (1 << 20):7.2f} MiB,"
+              f" {deltas} deltas")
+
+        server = remote_http_server(source, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://%s:%d/" % server.server_address
+        try:
+            giit_clone("giit clone (path)", source, os.path.join(tmp, "path"))
+            giit_clone("giit clone (http)", url, os.path.join(tmp, "http"))
+            if shutil.which("git"):
+                giit_clone("giit clone (git server)", source, os.path.join(tmp, "gitserver"),
+                           "git upload-pack")
+                git_clone("git clone (path)", "file://" + source, os.path.join(tmp, "gitpath"))
+                git_clone("git clone (http)", url, os.path.join(tmp, "githttp"))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Benchmark writing the trees of a commit, with and without cached trees.
+
+Builds an index of --files entries spread over directories --depth deep,
+--fanout wide at each level, all pointing to one blob.  Then times
+writing every tree from scratch, as a commit did before the index kept
+its TREE extension, against changing one deep file and rewriting only
+the trees on its path.  Both must give the same root tree.
+
+    python3 bench/bench_commit.py --files 300000 --depth 4 --fanout 10
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from index.git_index import GitIndex, GitIndexEntry
+from index.index_utils import index_tree_update
+from object.blob.blob_object import GitBlob
+from object.object_utils import object_write
+from repository.git_repository import GitRepository
+from repository.repo_utils import repo_create
+
+
+def build(repo, files, depth, fanout):
+    sha = object_write(GitBlob(b'Hello\n'), repo)
+    names = list()
+    for i in range(files):
+        parts = list()
+        n = i
+        for level in range(depth):
+            parts.append(f"d{level}{n % fanout}")
+            n //= fanout
+        parts.append(f"f{i}")
+        names.append("/".join(parts))
+    names.sort()
+    return GitIndex(entries=[GitIndexEntry(sha=sha, name=name) for name in names])
+
+def loose_objects(repo):
+    return sum(len(files) for root, dirs, files in os.walk(repo.gitdir + "/objects"))
+
+def timed(repo, index):
+    """(seconds, objects written, root tree) of one index_tree_update()."""
+    before = loose_objects(repo)
+    start = time.perf_counter()
+    sha = index_tree_update(repo, index)
+    return time.perf_counter() - start, loose_objects(repo) - before, sha
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fanout", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        repo_create(tmp)
+        repo = GitRepository(tmp)
+        index = build(repo, args.files, args.depth, args.fanout)
+        full, written, _ = timed(repo, index)
+        print(f"{'first commit':>16}: {full * 1000:9.1f} ms, {written:6} trees written")
+
+        # One new blob for one deep file
+        entry = index.entries[len(index.entries) // 2]
+        changed = GitIndexEntry(sha=object_write(GitBlob(b'Changed\n'), repo), name=entry.name)
+        index.add(changed)
+        fast, written, sha = timed(repo, index)
+        print(f"{'one file, cached':>16}: {fast * 1000:9.1f} ms, {written:6} trees written")
+
+        index.tree = None
+        # Every tree is hashed again, though all but the new ones exist
+        slow, _, sha_full = timed(repo, index)
+        if sha != sha_full:
+            raise Exception(f"Cached trees give {sha}, a full rebuild {sha_full}")
+        print(f"{'one file, full':>16}: {slow * 1000:9.1f} ms ({slow / fast:.0f}x slower)")
+
+if __name__ == "__main__":
+    main()
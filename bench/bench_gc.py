@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Benchmark `giit gc`: pack size and repack time.
+
+Builds a synthetic history of --commits commits over --files text files,
+each commit editing a few lines of a few files, all as loose objects.
+Then repacks copies of it with one delta search process, with the
+default pool, and with `git repack -a -d` when git is installed, and
+reports the size on disk and the time taken for each.
+
+    python3 bench/bench_gc.py --commits 300 --files 100
+"""
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from object.blob.blob_object import GitBlob
+from object.commit.commit_object import GitCommit
+from object.object_utils import object_write
+from object.pack.pack_write import pack_repack
+from object.refs.refs_utils import ref_write
+from object.tree.tree_object import GitTree
+from object.tree.tree_utils import GitTreeLeaf
+from repository.git_repository import GitRepository
+from repository.repo_utils import repo_create
+
+
+def build(repo, commits, files, lines):
+    rng = random.Random(42)
+    contents = [[f"file {i} line {j}: {rng.getrandbits(64):x}\n" for j in range(lines)]
+                for i in range(files)]
+    parent = None
+    for c in range(commits):
+        for i in rng.sample(range(files), min(3, files)):
+            for _ in range(3):
+                contents[i][rng.randrange(lines)] = f"commit {c}: {rng.getrandbits(64):x}\n"
+
+        tree = GitTree()
+        for i, lines_ in enumerate(contents):
+            blob = GitBlob("".join(lines_).encode("ascii"))
+            tree.items.append(GitTreeLeaf(b'100644', f"f{i:04}.txt", object_write(blob, repo)))
+        commit = GitCommit()
+        commit.kvlm = dict()
+        commit.kvlm[b'tree'] = object_write(tree, repo).encode("ascii")
+        if parent:
+            commit.kvlm[b'parent'] = parent.encode("ascii")
+        date = 1700000000 + c * 60
+        commit.kvlm[b'author'] = b'Giit <giit@example.com> %d +0000' % date
+        commit.kvlm[b'committer'] = b'Giit <giit@example.com> %d +0000' % date
+        commit.kvlm[None] = b'Commit %d\n' % c
+        parent = object_write(commit, repo)
+    ref_write(repo, "refs/heads/master", parent)
+
+def disk_usage(path):
+    """(files, bytes) under the objects directory of path."""
+    count = size = 0
+    for root, dirs, files in os.walk(os.path.join(path, ".git", "objects")):
+        for f in files:
+            count += 1
+            size += os.path.getsize(os.path.join(root, f))
+    return count, size
+
+def report(label, path, elapsed):
+    count, size = disk_usage(path)
+    print(f"{label:>16}: {count:6} files, {size / (1 << 20):8.2f} MiB"
+          + (f", {elapsed:.2f}s" if elapsed is not None else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commits", type=int, default=200)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--lines", type=int, default=200, help="Lines per file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source")
+        repo_create(source)
+        build(GitRepository(source), args.commits, args.files, args.lines)
+        report("loose", source, None)
+
+        for jobs in (1, None):
+            path = os.path.join(tmp, f"jobs{jobs}")
+            shutil.copytree(source, path)
+            start = time.perf_counter()
+            objects, deltas, name = pack_repack(GitRepository(path), jobs = jobs)
+            report(f"giit gc -j {jobs or os.cpu_count()}", path, time.perf_counter() - start)
+        print(f"{'':>16}  {objects} objects, {deltas} deltas")
+
+        if shutil.which("git"):
+            path = os.path.join(tmp, "git")
+            shutil.copytree(source, path)
+            start = time.perf_counter()
+            subprocess.run(["git", "repack", "-a", "-d", "-q"], cwd=path, check=True)
+            subprocess.run(["git", "prune-packed"], cwd=path, check=True)
+            report("git repack", path, time.perf_counter() - start)
+
+if __name__ == "__main__":
+    main()
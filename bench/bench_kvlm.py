@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Microbenchmark kvlm_parse and kvlm_serialize.
+
+Reports commits parsed per second for a typical commit, for an octopus
+merge with many parents and a long gpgsig block, and for the lazy mode
+that only extracts tree and parent.
+
+Then walks a history of --commits signed commits, with no commit-graph,
+and reads what a walk needs of each commit twice: through commit_info,
+which walks use and which parses lazily, and by parsing every commit in
+full, as commit_info used to.
+
+    python3 bench/bench_kvlm.py --seconds 1 --commits 20000
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from object.commit.commit_graph import commit_date, commit_info
+from object.commit.commit_utils import kvlm_parse, kvlm_serialize
+from object.commit.commit_walk import commit_walk
+from object.object_utils import object_hash, object_read_raw
+from repository.git_repository import GitRepository
+from repository.repo_utils import repo_create
+
+
+def commit(parents, sig_lines):
+    ret = [b'tree 29ff16c9c14e2652b22f8b78bb08a5a07930c147\n']
+    for i in range(parents):
+        ret.append(b'parent %040x\n' % i)
+    ret.append(b'author Giit <giit@example.com> 1527025023 +0200\n')
+    ret.append(b'committer Giit <giit@example.com> 1527025044 +0200\n')
+    if sig_lines:
+        ret.append(b'gpgsig -----BEGIN PGP SIGNATURE-----\n')
+        for i in range(sig_lines):
+            ret.append(b' iQIzBAABCAAdFiEExwXquOM8bWb4Q2zVGxM2FxoLkGQFAlsEjZQACgkQGxM2FxoL\n')
+        ret.append(b' -----END PGP SIGNATURE-----\n')
+    ret.append(b'\nCreate first draft\n\nWith a longer description of the change.\n')
+    return b''.join(ret)
+
+def history(repo, commits, sig_lines):
+    """Write a linear history of signed commits; returns the tip."""
+    parent = None
+    for c in range(commits):
+        raw = commit(1 if parent else 0, sig_lines)
+        if parent:
+            raw = raw.replace(b'parent %040x' % 0, b'parent ' + parent.encode("ascii"))
+        raw = raw.replace(b'1527025044', b'%d' % (1527025044 + c))
+        parent = object_hash(io.BytesIO(raw), b'commit', repo)
+    return parent
+
+def info_full(repo, sha):
+    """commit_info as it was before it parsed lazily: the whole commit."""
+    kvlm = kvlm_parse(object_read_raw(repo, sha)[1])
+    parent = kvlm.get(b'parent')
+    return kvlm[b'tree'], [parent] if parent else [], commit_date(kvlm)
+
+def walk(commits):
+    with tempfile.TemporaryDirectory() as tmp:
+        repo_create(tmp)
+        repo = GitRepository(tmp)
+        tip = history(repo, commits, 14)
+        # Inflated objects stay cached, so only parsing is compared
+        shas = list(commit_walk(repo, [tip]))
+        assert len(shas) == commits
+
+        start = time.perf_counter()
+        for sha in shas:
+            info_full(repo, sha)
+        full = time.perf_counter() - start
+        repo.commits.clear()
+        start = time.perf_counter()
+        for sha in shas:
+            commit_info(repo, sha)
+        lazy = time.perf_counter() - start
+        print(f"{'walk, ' + str(commits) + ' commits':24} {'':>15} full {commits / full:>10,.0f}/s  "
+              f"commit_info {commits / lazy:>10,.0f}/s")
+
+def rate(f, seconds):
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(100):
+            f()
+        count += 100
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return count / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=1.0, help="Time spent on each case")
+    parser.add_argument("--commits", type=int, default=5000, help="Length of the walked history")
+    args = parser.parse_args()
+
+    cases = [
+        ("typical commit", commit(1, 0)),
+        ("signed commit", commit(1, 14)),
+        ("octopus, 5000 parents", commit(5000, 0)),
+        ("gpgsig, 20000 lines", commit(1, 20000)),
+    ]
+    for name, raw in cases:
+        kvlm = kvlm_parse(raw)
+        assert kvlm_serialize(kvlm) == raw
+        full = rate(lambda: kvlm_parse(raw), args.seconds)
+        lazy = rate(lambda: kvlm_parse(raw, keys={b'tree', b'parent'}), args.seconds)
+        ser = rate(lambda: kvlm_serialize(kvlm), args.seconds)
+        print(f"{name:24} {len(raw):>9} bytes: parse {full:>10,.0f}/s  "
+              f"lazy {lazy:>10,.0f}/s  serialize {ser:>10,.0f}/s")
+    walk(args.commits)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Benchmark giit startup: the wall time of short commands.
+
+Runs `giit rev-parse HEAD` and `giit show-ref`, each --runs times in a
+fresh process, in --repo or in a temporary repository with one commit,
+and compares them with a bare `python -c pass`.  Whatever is above that
+is import and argument parsing time.  Bytecode is compiled first, as it
+would be in an installed copy.
+
+    python3 bench/bench_startup.py --runs 50
+"""
+
+import argparse
+import compileall
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from object.blob.blob_object import GitBlob
+from object.commit.commit_object import GitCommit
+from object.object_utils import object_write
+from object.refs.refs_utils import ref_write
+from object.tree.tree_object import GitTree
+from object.tree.tree_utils import GitTreeLeaf
+from repository.git_repository import GitRepository
+from repository.repo_utils import repo_create
+
+
+def build(path):
+    repo_create(path)
+    repo = GitRepository(path)
+    tree = GitTree()
+    tree.items.append(GitTreeLeaf(b'100644', "README", object_write(GitBlob(b'Hello\n'), repo)))
+    commit = GitCommit()
+    commit.kvlm = dict()
+    commit.kvlm[b'tree'] = object_write(tree, repo).encode("ascii")
+    commit.kvlm[b'author'] = b'Giit <giit@example.com> 1700000000 +0000'
+    commit.kvlm[b'committer'] = b'Giit <giit@example.com> 1700000000 +0000'
+    commit.kvlm[None] = b'Initial commit\n'
+    ref_write(repo, "refs/heads/master", object_write(commit, repo))
+
+def measure(argv, cwd, runs):
+    """(min, mean) wall time of argv, in milliseconds."""
+    times = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000, sum(times) / len(times) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--repo", help="Existing repository to run in")
+    args = parser.parse_args()
+
+    compileall.compile_dir(ROOT, quiet=1)
+    giit = [sys.executable, os.path.join(ROOT, "giit")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.repo
+        if path is None:
+            path = os.path.join(tmp, "repo")
+            build(path)
+
+        base = measure([sys.executable, "-c", "pass"], path, args.runs)
+        print(f"{'python -c pass':>18}: min {base[0]:6.1f} ms, mean {base[1]:6.1f} ms")
+        for command in (["rev-parse", "HEAD"], ["show-ref"]):
+            low, mean = measure(giit + command, path, args.runs)
+            print(f"{' '.join(command):>18}: min {low:6.1f} ms, mean {mean:6.1f} ms"
+                  f" (+{low - base[0]:.1f} ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Benchmark the worktree scan behind `giit status`.
+
+Builds a synthetic repository of --files files spread over nested
+directories, stages them, then times worktree_scan() and reports files
+per second, for one thread and for the default pool.
+
+    python3 bench/bench_status.py --files 100000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from index.index_utils import index_read
+from libgiit import add
+from repository.repo_utils import repo_create
+from worktree.worktree_utils import worktree_scan
+
+
+def build(path, files, width):
+    for i in range(files):
+        d = os.path.join(path, f"d{i % width}", f"e{(i // width) % width}")
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, f"f{i}"), "w") as f:
+            f.write(f"file {i}\n")
+
+def run(repo, index, jobs, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        changed, deleted, untracked = worktree_scan(repo, index, jobs = jobs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(changed), len(untracked)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--width", type=int, default=32, help="Directories per level")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        repo = repo_create(path)
+        build(path, args.files, args.width)
+        add(repo, [path])
+        # Let the files stop being "racily clean" compared to the index
+        time.sleep(0.01)
+        os.utime(os.path.join(repo.gitdir, "index"))
+        index = index_read(repo)
+
+        for jobs in (1, None):
+            elapsed, changed, untracked = run(repo, index, jobs, args.rounds)
+            print(f"jobs={jobs or 'default'}: {args.files} files in {elapsed:.3f}s, "
+                  f"{args.files / elapsed:,.0f} files/s ({changed} changed, {untracked} untracked)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+from bisect import bisect_left
+
+
+class GitIndexEntry (object):
+    """One entry of .git/index: a path, the SHA of its blob, and the stat()
+data the file had when it was last hashed.
+
+There is one of these per tracked file, so __slots__ keeps them small."""
+
+    __slots__ = ("ctime", "mtime", "dev", "ino", "mode", "uid", "gid",
+                 "fsize", "sha", "flag_assume_valid", "flag_stage", "name")
+
+    def __init__(self, ctime=(0, 0), mtime=(0, 0), dev=0, ino=0, mode=0o100644,
+                 uid=0, gid=0, fsize=0, sha=None, flag_assume_valid=False,
+                 flag_stage=0, name=None):
+        # The last time a file's metadata changed.  This is a pair
+        # (timestamp in seconds, nanoseconds)
+        self.ctime = ctime
+        # The last time a file's data changed.  Same pair.
+        self.mtime = mtime
+        # The ID of device containing this file
+        self.dev = dev
+        # The file's inode number
+        self.ino = ino
+        # The full mode: object type (regular file, symlink, gitlink) in
+        # the high bits, permissions in the low ones
+        self.mode = mode
+        # User and group ID of the owner
+        self.uid = uid
+        self.gid = gid
+        # Size of this object, in bytes
+        self.fsize = fsize
+        # The object's SHA, as a hex string
+        self.sha = sha
+        self.flag_assume_valid = flag_assume_valid
+        # Merge stage, 0 outside of a conflict
+        self.flag_stage = flag_stage
+        # Path relative to the worktree, with / separators
+        self.name = name
+
+
+class GitCacheTree (object):
+    """One directory of the cached trees of an index (git's TREE extension):
+the SHA of the tree the index entries under it make, and how many entries
+that is, so a directory whose tree is known is skipped in one step.
+
+entries is -1 when the directory changed since its tree was written: sha
+is then None.  subtrees maps the names of subdirectories to theirs."""
+
+    __slots__ = ("entries", "sha", "subtrees")
+
+    def __init__(self, entries=-1, sha=None):
+        self.entries = entries
+        self.sha = sha
+        self.subtrees = dict()
+
+    def invalidate(self, name):
+        """Forget the trees of every directory on the way to path name."""
+        node = self
+        for part in name.split("/")[:-1]:
+            node.entries = -1
+            node.sha = None
+            node = node.subtrees.get(part)
+            if node is None:
+                return
+        node.entries = -1
+        node.sha = None
+
+
+class GitIndex (object):
+    """The staging area: entries sorted by name, as git stores them.
+
+tree, if not None, is the GitCacheTree of the root directory.  Entries
+must be changed through add() and remove(), or followed by invalidate(),
+so it doesn't go stale."""
+
+    version = None
+    entries = None
+    tree = None
+
+    def __init__(self, version=2, entries=None, tree=None):
+        self.version = version
+        self.entries = entries if entries is not None else list()
+        self.tree = tree
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def position(self, name):
+        """Where name is, or would be inserted, in entries."""
+        return bisect_left(self.entries, name, key=lambda e: e.name)
+
+    def find(self, name):
+        pos = self.position(name)
+        if pos < len(self.entries) and self.entries[pos].name == name:
+            return self.entries[pos]
+        return None
+
+    def add(self, entry):
+        """Insert entry, replacing any entry with the same name."""
+        pos = self.position(entry.name)
+        if pos < len(self.entries) and self.entries[pos].name == entry.name:
+            old = self.entries[pos]
+            self.entries[pos] = entry
+            # Refreshing the stat data of an entry doesn't change trees
+            if old.sha == entry.sha and old.mode == entry.mode:
+                return
+        else:
+            self.entries.insert(pos, entry)
+        self.invalidate(entry.name)
+
+    def remove(self, name):
+        pos = self.position(name)
+        if pos < len(self.entries) and self.entries[pos].name == name:
+            self.invalidate(name)
+            return self.entries.pop(pos)
+        return None
+
+    def invalidate(self, name):
+        """Forget the cached trees of the directories holding name."""
+        if self.tree is not None:
+            self.tree.invalidate(name)
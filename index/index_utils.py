@@ -0,0 +1,264 @@
+"""Read and write .git/index, the DIRC version 2 format.
+
+    - header: b'DIRC', version (uint32), number of entries (uint32)
+    - entries, sorted by name, each made of:
+        ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size (10 uint32)
+        SHA (20 bytes)
+        flags (uint16): assume-valid (1 bit), extended (1 bit),
+                        stage (2 bits), name length (12 bits)
+        name, then 1 to 8 NUL bytes so the entry length is a multiple of 8
+    - extensions: signature (4 bytes), size (uint32), data
+    - SHA-1 of everything above
+
+The only extension we keep is TREE, the cached trees (see GitCacheTree).
+It is one record per directory, the root first, each followed by those of
+its subdirectories:
+    path component, NUL, number of entries covered (-1 if invalid), space,
+    number of subdirectories, newline, then the tree SHA (20 bytes) unless
+    invalid
+"""
+
+import hashlib
+import os
+import stat
+import struct
+from index.git_index import GitCacheTree, GitIndex, GitIndexEntry
+from object.object_utils import object_hash, object_write, object_write_stream
+from object.tree.tree_object import GitTree
+from object.tree.tree_utils import GitTreeLeaf
+from repository.repo_utils import repo_file
+
+
+INDEX_HEADER = struct.Struct(">4sII")
+INDEX_ENTRY = struct.Struct(">10I20sH")
+
+
+def index_read(repo):
+    """Read the repository's index.  A missing index is an empty one."""
+    path = repo_file(repo, "index")
+
+    if not os.path.exists(path):
+        return GitIndex()
+
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    if hashlib.sha1(raw[:-20]).digest() != raw[-20:]:
+        raise Exception("Index checksum mismatch")
+
+    signature, version, count = INDEX_HEADER.unpack_from(raw, 0)
+    if signature != b'DIRC':
+        raise Exception("Not an index file: " + path)
+    if version != 2:
+        raise Exception("Unsupported index version: " + str(version))
+
+    entries = list()
+    pos = INDEX_HEADER.size
+    for i in range(count):
+        (ctime_s, ctime_ns, mtime_s, mtime_ns, dev, ino, mode, uid, gid,
+         fsize, sha, flags) = INDEX_ENTRY.unpack_from(raw, pos)
+
+        if flags & 0x4000:
+            raise Exception("Extended index flags are not supported in version 2")
+
+        # Names shorter than 0xFFF bytes store their length in the flags;
+        # longer ones are NUL-terminated.
+        name_length = flags & 0xFFF
+        start = pos + INDEX_ENTRY.size
+        if name_length < 0xFFF:
+            end = start + name_length
+        else:
+            end = raw.index(b'\x00', start + 0xFFF)
+
+        entries.append(GitIndexEntry(ctime=(ctime_s, ctime_ns),
+                                     mtime=(mtime_s, mtime_ns),
+                                     dev=dev, ino=ino, mode=mode,
+                                     uid=uid, gid=gid, fsize=fsize,
+                                     sha=sha.hex(),
+                                     flag_assume_valid=bool(flags & 0x8000),
+                                     flag_stage=(flags >> 12) & 3,
+                                     name=raw[start:end].decode("utf8")))
+
+        # Skip the NUL padding
+        pos += (end - pos + 8) & ~7
+
+    # Other extensions (resolve-undo, untracked cache...) are dropped:
+    # git rebuilds them
+    tree = None
+    while pos < len(raw) - 20:
+        signature, size = struct.unpack_from(">4sI", raw, pos)
+        if signature == b'TREE':
+            tree = index_tree_parse(raw, pos + 8)[1]
+        elif not b'A' <= signature[0:1] <= b'Z':
+            raise Exception("Unsupported index extension: " + signature.decode("ascii", "replace"))
+        pos += 8 + size
+
+    return GitIndex(version, entries, tree)
+
+def index_tree_parse(raw, pos):
+    """The TREE record at pos in raw, with its subdirectories', as (name,
+GitCacheTree, position after them)."""
+    nul = raw.index(b'\x00', pos)
+    name = raw[pos:nul].decode("utf8")
+    nl = raw.index(b'\n', nul)
+    entries, subtrees = raw[nul + 1:nl].split(b' ')
+
+    node = GitCacheTree(int(entries))
+    pos = nl + 1
+    if node.entries >= 0:
+        node.sha = raw[pos:pos + 20].hex()
+        pos += 20
+    for i in range(int(subtrees)):
+        child, sub, pos = index_tree_parse(raw, pos)
+        node.subtrees[child] = sub
+    return name, node, pos
+
+def index_write(repo, index):
+    """Write index to .git/index.
+
+Like git, we write to index.lock then rename it over the old index, so a
+crash never leaves a truncated index behind."""
+    out = list()
+    out.append(INDEX_HEADER.pack(b'DIRC', 2, len(index.entries)))
+
+    for e in index.entries:
+        name = e.name.encode("utf8")
+        flags = (0x8000 if e.flag_assume_valid else 0) | (e.flag_stage << 12) | min(len(name), 0xFFF)
+        out.append(INDEX_ENTRY.pack(e.ctime[0], e.ctime[1], e.mtime[0], e.mtime[1],
+                                    e.dev & 0xFFFFFFFF, e.ino & 0xFFFFFFFF, e.mode,
+                                    e.uid, e.gid, e.fsize & 0xFFFFFFFF,
+                                    bytes.fromhex(e.sha), flags))
+        out.append(name)
+        # Pad with 1 to 8 NUL bytes, up to a multiple of 8
+        length = INDEX_ENTRY.size + len(name)
+        out.append(b'\x00' * (8 - length % 8))
+
+    if index.tree is not None:
+        tree = list()
+        index_tree_serialize(index.tree, "", tree)
+        tree = b''.join(tree)
+        out.append(struct.pack(">4sI", b'TREE', len(tree)))
+        out.append(tree)
+
+    data = b''.join(out)
+    data += hashlib.sha1(data).digest()
+
+    path = repo_file(repo, "index")
+    with open(path + ".lock", "wb") as f:
+        f.write(data)
+    os.replace(path + ".lock", path)
+
+def index_tree_serialize(node, name, out):
+    """Append the TREE records of node, named name, and of its
+subdirectories to out."""
+    out.append(b'%s\x00%d %d\n' % (name.encode("utf8"), node.entries, len(node.subtrees)))
+    if node.entries >= 0:
+        out.append(bytes.fromhex(node.sha))
+    # Like git: shorter names first, then byte order
+    for sub in sorted(node.subtrees, key=lambda n: (len(n.encode("utf8")), n.encode("utf8"))):
+        index_tree_serialize(node.subtrees[sub], sub, out)
+
+def index_tree_update(repo, index):
+    """Bring the cached trees of index up to date and return the SHA of the
+root tree, like git write-tree.
+
+Only directories whose cached tree was invalidated are rebuilt, and only
+their trees are written: a directory still valid is skipped whole, since
+we know how many entries it covers.  Changing one file thus writes one
+tree per directory on its path."""
+    if index.tree is None:
+        index.tree = GitCacheTree()
+    index_tree_update_dir(repo, index.tree, index.entries, 0, "")
+    return index.tree.sha
+
+def index_tree_update_dir(repo, node, entries, start, prefix):
+    """Update node, the cached tree of directory prefix (empty for the
+root, else ending with a /) whose entries start at entries[start].
+Returns how many entries it covers."""
+    if node.entries >= 0:
+        return node.entries
+
+    tree = GitTree()
+    subtrees = dict()
+    i = start
+    while i < len(entries):
+        e = entries[i]
+        if not e.name.startswith(prefix):
+            break
+        if e.flag_stage:
+            raise Exception(f"{e.name}: unmerged, can't write a tree")
+
+        name = e.name[len(prefix):]
+        slash = name.find("/")
+        if slash < 0:
+            tree.items.append(GitTreeLeaf(b'%o' % e.mode, name, e.sha))
+            i += 1
+            continue
+
+        # A subdirectory: its entries all follow, since they share a prefix
+        name = name[:slash]
+        sub = node.subtrees.get(name) or GitCacheTree()
+        i += index_tree_update_dir(repo, sub, entries, i, prefix + name + "/")
+        subtrees[name] = sub
+        tree.items.append(GitTreeLeaf(b'40000', name, sub.sha))
+
+    # Directories that lost all their entries are gone
+    node.subtrees = subtrees
+    node.entries = i - start
+    node.sha = object_write(tree, repo)
+    return node.entries
+
+def index_mode(st):
+    """The mode git records for a file with stat result st."""
+    if stat.S_ISLNK(st.st_mode):
+        return 0o120000
+    if st.st_mode & 0o111:
+        return 0o100755
+    return 0o100644
+
+def index_entry_from_stat(name, sha, st):
+    """Build the entry for file name, whose blob is sha, from its stat()."""
+    return GitIndexEntry(ctime=(st.st_ctime_ns // 1000000000, st.st_ctime_ns % 1000000000),
+                         mtime=(st.st_mtime_ns // 1000000000, st.st_mtime_ns % 1000000000),
+                         dev=st.st_dev, ino=st.st_ino, mode=index_mode(st),
+                         uid=st.st_uid, gid=st.st_gid, fsize=st.st_size,
+                         sha=sha, name=name)
+
+def index_entry_stat_changed(entry, st, index_mtime = None):
+    """Whether the file might differ from what entry recorded.
+
+This is the stat cache: if size, times, inode and mode all match, the
+file is assumed unchanged and doesn't need to be rehashed.
+
+index_mtime is the mtime_ns of the index file.  A file modified in the
+same instant the index was written could have changed again without its
+mtime moving ("racy git"), so such entries always count as changed."""
+    if entry.flag_assume_valid:
+        return False
+    if (entry.fsize != st.st_size & 0xFFFFFFFF
+        or entry.mtime != (st.st_mtime_ns // 1000000000, st.st_mtime_ns % 1000000000)
+        or entry.ctime != (st.st_ctime_ns // 1000000000, st.st_ctime_ns % 1000000000)
+        or entry.ino != st.st_ino & 0xFFFFFFFF
+        or entry.mode != index_mode(st)):
+        return True
+    if index_mtime is not None:
+        mtime_ns = entry.mtime[0] * 1000000000 + entry.mtime[1]
+        if mtime_ns >= index_mtime:
+            return True
+    return False
+
+def index_mtime(repo):
+    """mtime_ns of the index file, or None if there is none."""
+    try:
+        return os.stat(repo_file(repo, "index")).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def index_hash_path(path, st, repo = None):
+    """Hash the worktree file at path, whose lstat() is st, as a blob.
+Symlinks are stored as a blob holding the link target."""
+    if stat.S_ISLNK(st.st_mode):
+        target = os.fsencode(os.readlink(path))
+        return object_write_stream(b'blob', len(target), [target], repo)
+    with open(path, "rb") as f:
+        return object_hash(f, b'blob', repo)
@@ -1,118 +1,272 @@
 import argparse
-import configparser
-from datetime import datetime
-import grp
-from fnmatch import fnmatch
-import hashlib
-from math import ceil
 import os
-import re
 import sys
-import zlib
 
-from object.object_utils import object_find, object_hash, object_read
-from object.refs.refs_utils import GitTag, ref_list
-from repository.git_repository import GitRepository
-from repository.repo_utils import repo_create, repo_default_config, repo_dir, repo_file, repo_find
+# Only what most commands need: the rest is imported by the commands using
+# it, see commands at the bottom.
+from object.object_utils import (object_abbrev, object_find, object_hash, object_hash_paths,
+                                 object_info, object_read, object_read_raw, object_resolve,
+                                 object_write)
+from object.refs.refs_utils import ref_resolve, ref_snapshot, ref_write
+from repository.repo_utils import repo_create, repo_file, repo_find
 
 
-argparser = argparse.ArgumentParser(description="The best content tracker")
-argsubparsers = argparser.add_subparsers(title="Commands" ,dest="command")
-argsubparsers.required = True
-
 def main(argv=sys.argv[1:]):
-    args = argparser.parse_args(argv)
-    match args.command:
-        case "add"          : cmd_add(args)
-        case "cat-file"     : cmd_cat_file(args)
-        case "check-ignore" : cmd_check_ignore(args)
-        case "checkout"     : cmd_checkout(args)
-        case "commit"       : cmd_commit(args)
-        case "hash-object"  : cmd_hash_object(args)
-        case "init"         : cmd_init(args)
-        case "log"          : cmd_log(args)
-        case "ls-files"     : cmd_ls_files(args)
-        case "ls-tree"      : cmd_ls_tree(args)
-        case "rev-parse"    : cmd_rev_parse(args)
-        case "rm"           : cmd_rm(args)
-        case "show-ref"     : cmd_show_ref(args)
-        case "status"       : cmd_status(args)
-        case "tag"          : cmd_tag(args)
-        case _              : print("Bad command.")
-
-
-    repo = GitRepository(args.path, True)
-
-    #Creating the .git directory
-    assert repo_dir(repo, "branches", mkdir = True)
-    assert repo_dir(repo, "objects", mkdir = True)
-    assert repo_dir(repo, "refs", "tags", mkdir = True)
-    assert repo_dir(repo, "refs", "heads", mkdir = True)
-
-    # .git/description
-    with open(repo_file(repo, "description"), "w") as f:
-        f.write("Unnamed repository; edit this file 'description' to name the repository.\n")
-    
-    # .git/HEAD 
-    with open(repo_file(repo, "HEAD"), "w") as f:
-        f.write("ref: refs/heads/master\n")
-            
-    # And lastly for .git/config
-    with open(repo_file(repo, "config"), "w") as f:
-        config = repo_default_config()
-        config.write(f)
+    argparser = argparse.ArgumentParser(description="The best content tracker")
+    argsubparsers = argparser.add_subparsers(title="Commands" ,dest="command")
+    argsubparsers.required = True
+
+    # Only the command we run gets its arguments set up.  Without one
+    # (or with an unknown one), all of them, to list them in the error.
+    if argv and argv[0] in commands:
+        commands[argv[0]][0](argsubparsers)
+    else:
+        for arguments, _ in commands.values():
+            arguments(argsubparsers)
 
-    return repo
+    # Options whose value is optional, like git's --short[=N], only take
+    # one given as --option=value: a bare one gets its default written
+    # out, so that argparse doesn't take the next word as its value
+    if argv and argv[0] in optional_values:
+        bare = optional_values[argv[0]]
+        argv = argv[:1] + [bare.get(a, a) for a in argv[1:]]
+
+    args = argparser.parse_args(argv)
+    commands[args.command][1](args)
 
 
 # Command : git init
-argsp = argsubparsers.add_parser("init", help="Create an empty git repository")
-argsp.add_argument("path", 
-                   metavar="directory",
-                   default=".",
-                   help="Where to create the repository.",
-                   nargs = "?")
+def args_init(argsubparsers):
+    argsp = argsubparsers.add_parser("init", help="Create an empty git repository")
+    argsp.add_argument("path", 
+                       metavar="directory",
+                       default=".",
+                       help="Where to create the repository.",
+                       nargs = "?")
 
 def cmd_init(args):
     repo_create(args.path)
 
 
 # Command : git cat-file blob e0695f14a412c29e252c998c81de1dde59658e4a
-argsp = argsubparsers.add_parser("cat-file", help="Show information about a git object")
-
-argsp.add_argument("type",
-                     metavar="type",
-                     choices=["commit", "tree", "blob", "tag"],
-                     help="Specify the type of the object to show.")
-
-argsp.add_argument("object",
-                     metavar="object",
-                     help="The object to show.")
+def args_cat_file(argsubparsers):
+    argsp = argsubparsers.add_parser("cat-file", help="Show information about a git object")
+
+    argsp.add_argument("--batch",
+                       dest="batch",
+                       action="store_true",
+                       help="Read object names from the standard input, print their type, size and content")
+    argsp.add_argument("--batch-check",
+                       dest="batch_check",
+                       action="store_true",
+                       help="Read object names from the standard input, print their type and size")
+    argsp.add_argument("--buffer",
+                       dest="buffer",
+                       action="store_true",
+                       help="With --batch, only flush the output when the buffer is full")
+
+    argsp.add_argument("type",
+                         metavar="type",
+                         nargs="?",
+                         choices=["commit", "tree", "blob", "tag"],
+                         help="Specify the type of the object to show.")
+
+    argsp.add_argument("object",
+                         metavar="object",
+                         nargs="?",
+                         help="The object to show.")
 
 def cmd_cat_file(args):
     repo = repo_find()
+    if args.batch or args.batch_check:
+        cat_file_batch(repo, sys.stdin.buffer, sys.stdout.buffer,
+                       contents = args.batch, buffer = args.buffer)
+        return
+    if not (args.type and args.object):
+        raise Exception("cat-file needs a type and an object, or --batch")
     cat_file(repo,args.object, format = args.type.encode())
 
 def cat_file(repo, obj, format = None):
-    obj = object_read(repo, object_find(repo, obj, format=format))
+    sha = object_find(repo, obj, format=format)
+    if sha is None:
+        raise Exception(f"{obj} is not a {format.decode('ascii')}.")
+    obj = object_read(repo, sha)
     sys.stdout.buffer.write(obj.serialize())
 
+def cat_file_batch(repo, input, output, contents = True, buffer = False):
+    """Answer object names read from input, one per line, like git
+cat-file --batch: "<sha> <type> <size>\\n<content>\\n" for each, or
+"<name> missing\\n".  Without contents (--batch-check), only the first
+line, which doesn't need the object to be inflated.
+
+One process serves the whole stream, so the repository, its caches and
+open packs are set up once.  Unless buffer is set, output is flushed
+after every object, so another program can talk to us through pipes."""
+    refs = ref_snapshot(repo)
+    for line in input:
+        name = line.strip().decode("utf8")
+        info = None
+        if len(name) == 40:
+            # Full SHAs are the common case: go straight to the object
+            info = object_info(repo, name.lower())
+        if info is not None:
+            candidates = [name.lower()]
+        else:
+            candidates = object_resolve(repo, name, refs) if name else None
+
+        if not candidates or candidates[0] is None:
+            output.write(line.rstrip(b"\n") + b" missing\n")
+        elif len(candidates) > 1:
+            output.write(line.rstrip(b"\n") + b" ambiguous\n")
+        elif contents:
+            format, data = object_read_raw(repo, candidates[0])
+            output.write(b"%s %s %d\n" % (candidates[0].encode("ascii"), format, len(data)))
+            output.write(data)
+            output.write(b"\n")
+        else:
+            format, size = info or object_info(repo, candidates[0])
+            output.write(b"%s %s %d\n" % (candidates[0].encode("ascii"), format, size))
+        if not buffer:
+            output.flush()
+    output.flush()
+
+# Command : git rev-parse [--short[=N]] [-t TYPE] NAME...
+def args_rev_parse(argsubparsers):
+    argsp = argsubparsers.add_parser("rev-parse", help="Parse revision (or other objects) identifiers")
+
+    argsp.add_argument("-t", "--type",
+                       metavar="type",
+                       dest="type",
+                       choices=["blob", "commit", "tag", "tree"],
+                       default=None,
+                       help="Specify the expected type, following tags (and commits, to their tree)")
+    argsp.add_argument("--short",
+                       metavar="length",
+                       dest="short",
+                       type=int,
+                       help="Print the shortest unique abbreviation, at least length digits "
+                            "long (7 for a bare --short)")
+    argsp.add_argument("--stdin",
+                       dest="stdin",
+                       action="store_true",
+                       help="Read names from the standard input, one per line")
+    argsp.add_argument("name",
+                       nargs="*",
+                       help="The names to parse")
+
+def cmd_rev_parse(args):
+    repo = repo_find()
+    format = args.type.encode() if args.type else None
+
+    names = args.name
+    if args.stdin:
+        names = names + [line.strip() for line in sys.stdin if line.strip()]
+
+    # One ref snapshot for the whole batch
+    refs = ref_snapshot(repo)
+    out = list()
+    for name in names:
+        sha = object_find(repo, name, format, refs=refs)
+        if sha is None:
+            raise Exception(f"{name} is not a {args.type}.")
+        if args.short:
+            sha = object_abbrev(repo, sha, args.short)
+        out.append(sha + "\n")
+    sys.stdout.write("".join(out))
+
+# Command : git rev-list [--objects] [--count] [--all] [--use-bitmap-index] COMMIT... [^COMMIT...]
+def args_rev_list(argsubparsers):
+    argsp = argsubparsers.add_parser("rev-list",
+                                     help="List the commits reachable from some commits but not others")
+
+    argsp.add_argument("--objects",
+                       dest="objects",
+                       action="store_true",
+                       help="List every object, not only commits")
+    argsp.add_argument("--count",
+                       dest="count",
+                       action="store_true",
+                       help="Only print how many there are")
+    argsp.add_argument("--all",
+                       dest="all",
+                       action="store_true",
+                       help="Start from HEAD and every ref")
+    argsp.add_argument("--use-bitmap-index",
+                       dest="bitmap",
+                       action="store_true",
+                       help="Use the reachability bitmaps of the pack, if there are any")
+    argsp.add_argument("commit",
+                       nargs="*",
+                       help="Commits to start from; ^COMMIT leaves out what COMMIT reaches")
+
+def cmd_rev_list(args):
+    from object.pack.pack_bitmap import bitmap_open, bitmap_reachable
+
+    repo = repo_find()
+    refs = ref_snapshot(repo)
+    tips = list()
+    exclude = list()
+    for name in args.commit:
+        if name.startswith("^"):
+            exclude.append(object_find(repo, name[1:], format=b'commit', refs=refs))
+        else:
+            tips.append(object_find(repo, name, format=b'commit', refs=refs))
+    if args.all:
+        tips.extend(sha for _, sha in refs.items())
+        head = ref_resolve(repo, "HEAD")
+        if head:
+            tips.append(head)
+
+    # Without bitmaps, everything ends up in seen.  Shown in no particular
+    # order: pack order, then walk order.
+    bitmap = bitmap_open(repo) if args.bitmap else None
+    bits, seen = bitmap_reachable(repo, bitmap, tips, exclude)
+    if not args.objects:
+        bits &= bitmap.commits if bitmap else 0
+        seen = [sha for sha, format in seen.items() if format == b'commit']
+
+    if args.count:
+        print(bits.bit_count() + len(seen))
+        return
+    try:
+        for sha in bitmap.shas(bits) if bitmap else ():
+            print(sha)
+        for sha in seen:
+            print(sha)
+    except BrokenPipeError:
+        # Piped into head, or similar: stop quietly
+        sys.stdout = None
+
 # Command : git hash-object [-w] [-t TYPE] FILE
-argsp = argsubparsers.add_parser("hash-object", 
-                                 help="Compute the object ID and optionally create a blob from a file")
-
-argsp.add_argument("-w", 
-                   dest="write",
-                   action="store_true",
-                   help="Write the object into the database")
-argsp.add_argument("-t",
-                   metavar="type",  
-                   choices=["commit", "tree", "blob", "tag"], 
-                   default="blob",
-                   help="Specify the type of the object to create.")
-argsp.add_argument("path",
-                    metavar="file",
-                    help="The file to hash.")
+def args_hash_object(argsubparsers):
+    argsp = argsubparsers.add_parser("hash-object", 
+                                     help="Compute the object ID and optionally create a blob from a file")
+
+    argsp.add_argument("-w", 
+                       dest="write",
+                       action="store_true",
+                       help="Write the object into the database")
+    argsp.add_argument("-t",
+                       metavar="type",
+                       dest="type",
+                       choices=["commit", "tree", "blob", "tag"], 
+                       default="blob",
+                       help="Specify the type of the object to create.")
+    argsp.add_argument("--stdin-paths",
+                       dest="stdin_paths",
+                       action="store_true",
+                       help="Read file names from the standard input, one per line")
+    argsp.add_argument("-j",
+                       metavar="jobs",
+                       dest="jobs",
+                       type=int,
+                       help="Number of processes to hash with (default: one per CPU)")
+    argsp.add_argument("path",
+                        metavar="file",
+                        nargs="*",
+                        help="The file to hash.")
+    # For cmd_hash_object to report a usage error
+    argsp.set_defaults(parser=argsp)
 
 def cmd_hash_object(args):
     if(args.write):
@@ -120,142 +274,406 @@ def cmd_hash_object(args):
     else : 
         repo = None
 
-    with open(args.path, "rb") as f:
-        sha = object_hash(f, args.type.encode(), repo)
-        print(sha)
+    if not args.path and not args.stdin_paths:
+        args.parser.error("nothing to hash: give files, or --stdin-paths")
 
-def kvlm_parse(raw, start=0, dct=None):
-    if not dct:
-        dct = dict()
-        # You CANNOT declare the argument as dct=dict() or all call to
-        # the functions will endlessly grow the same dict.
-
-    # This function is recursive: it reads a key/value pair, then call
-    # itself back with the new position.  So we first need to know
-    # where we are: at a keyword, or already in the messageQ
-
-    # We search for the next space and the next newline.
-    spc = raw.find(b' ', start)
-    nl = raw.find(b'\n', start)
-
-    # If space appears before newline, we have a keyword.  Otherwise,
-    # it's the final message, which we just read to the end of the file.
-
-    # Base case
-    # =========
-    # If newline appears first (or there's no space at all, in which
-    # case find returns -1), we assume a blank line.  A blank line
-    # means the remainder of the data is the message.  We store it in
-    # the dictionary, with None as the key, and return.
-    if (spc < 0) or (nl < spc):
-        assert nl == start
-        dct[None] = raw[start+1:]
-        return dct
-
-    # Recursive case
-    # ==============
-    # we read a key-value pair and recurse for the next.
-    key = raw[start:spc]
-
-    # Find the end of the value.  Continuation lines begin with a
-    # space, so we loop until we find a "\n" not followed by a space.
-    end = start
-    while True:
-        end = raw.find(b'\n', end+1)
-        if raw[end+1] != ord(' '): break
-
-    # Grab the value
-    # Also, drop the leading space on continuation lines
-    value = raw[spc+1:end].replace(b'\n ', b'\n')
-
-    # Don't overwrite existing data contents
-    if key in dct:
-        if type(dct[key]) == list:
-            dct[key].append(value)
-        else:
-            dct[key] = [ dct[key], value ]
-    else:
-        dct[key]=value
+    paths = args.path
+    if args.stdin_paths:
+        paths = paths + [line.rstrip("\n") for line in sys.stdin if line.strip()]
 
-    return kvlm_parse(raw, start=end+1, dct=dct)
-
-#kvlm is a dictionary with the keys being the keywords and the values
-# being the values. The key None is reserved for the message.
-def kvlm_serialize(kvlm):
-
-    ret = b''
+    if len(paths) == 1:
+        with open(paths[0], "rb") as f:
+            sha = object_hash(f, args.type.encode(), repo)
+            print(sha)
+        return
 
-    for k in kvlm.keys():
-        if k is None:
+    # SHAs come back in input order, as soon as each one is ready
+    for sha in object_hash_paths(paths, args.type.encode(), repo, jobs=args.jobs):
+        print(sha, flush=True)
+
+# Command : git add PATH...
+def args_add(argsubparsers):
+    argsp = argsubparsers.add_parser("add", help="Add files contents to the index")
+    argsp.add_argument("-f", "--force",
+                       dest="force",
+                       action="store_true",
+                       help="Add files even if they are ignored")
+    argsp.add_argument("-j",
+                       metavar="jobs",
+                       dest="jobs",
+                       type=int,
+                       help="Number of processes to hash with (default: one per CPU)")
+    argsp.add_argument("path",
+                       nargs="+",
+                       help="Files or directories to add.")
+
+def cmd_add(args):
+    repo = repo_find()
+    add(repo, args.path, jobs=args.jobs, force=args.force)
+
+def add_expand(repo, paths, index, ignore = None):
+    """List every file under paths as (name, path), skipping the .git
+directory.  Symlinks are files, even when they point to a directory.
+
+With ignore (see GitIgnore), files in directories that ignore excludes
+are left out, unless they're already tracked, and naming an ignored file
+is an error, like with git."""
+    gitdir = os.path.realpath(repo.gitdir)
+    for path in paths:
+        if os.path.islink(path) or not os.path.isdir(path):
+            name = worktree_name(repo, path)
+            if ignore and not index.find(name) and ignore(name, False):
+                raise Exception("The following path is ignored by one of your .gitignore files:\n"
+                                f"{path}\nUse -f if you really want to add it.")
+            yield name, path
             continue
-        val = kvlm[k]
-        #NORMALIZE TO A LIST
-        if type(val) != list:
-            val = [val]
-        for v in val:
-            ret += k + b' ' + (v.replace(b'\n', b'\n ')) + b'\n'
-    
-    ret += b'\n' + kvlm[None]
-
-    return ret
+        for root, dirs, files in os.walk(path):
+            links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+            dirs[:] = sorted(d for d in dirs
+                             if d not in links and os.path.realpath(os.path.join(root, d)) != gitdir)
+            if ignore:
+                kept = list()
+                for d in dirs:
+                    name = worktree_name(repo, os.path.join(root, d))
+                    # Tracked files below an ignored directory are still
+                    # updated: entries are sorted, so the first one after
+                    # name/ tells whether there are any
+                    pos = index.position(name + "/")
+                    if (not ignore(name, True) or (pos < len(index.entries)
+                                                   and index.entries[pos].name.startswith(name + "/"))):
+                        kept.append(d)
+                dirs[:] = kept
+            for f in sorted(files + links):
+                path = os.path.join(root, f)
+                name = worktree_name(repo, path)
+                if ignore and not index.find(name) and ignore(name, False):
+                    continue
+                yield name, path
+
+def worktree_name(repo, path):
+    """Turn path into an index entry name: relative to the worktree, with
+/ separators."""
+    name = os.path.relpath(os.path.abspath(path), os.path.realpath(repo.worktree))
+    if name == os.pardir or name.startswith(os.pardir + os.sep):
+        raise Exception(f"Path {path} is outside of the worktree")
+    return name.replace(os.sep, "/")
+
+def add(repo, paths, jobs = None, force = False):
+    """Stage every file under paths in the index.  Ignored files are left
+out, unless force.
+
+Files whose stat() data still matches their index entry are skipped; the
+others are hashed and written in parallel."""
+    import stat
+    from index.index_utils import (index_entry_from_stat, index_entry_stat_changed,
+                                   index_hash_path, index_mtime, index_read, index_write)
+    from worktree.git_ignore import GitIgnore
+
+    index = index_read(repo)
+    racy = index_mtime(repo)
+    ignore = None if force else GitIgnore(repo)
+
+    files = list()
+    links = list()
+    # Listed first: an ignored file named on the command line stages nothing
+    for name, path in list(add_expand(repo, paths, index, ignore)):
+        st = os.lstat(path)
+        entry = index.find(name)
+        if entry and not index_entry_stat_changed(entry, st, racy):
+            continue
+        if stat.S_ISLNK(st.st_mode):
+            links.append((name, path, st))
+        else:
+            files.append((name, path, st))
+
+    shas = object_hash_paths([path for _, path, _ in files], b'blob', repo, jobs=jobs)
+    for (name, path, st), sha in zip(files, shas):
+        index.add(index_entry_from_stat(name, sha, st))
+    for name, path, st in links:
+        index.add(index_entry_from_stat(name, index_hash_path(path, st, repo), st))
+
+    index_write(repo, index)
+
+# Command : git rm [--cached] PATH...
+def args_rm(argsubparsers):
+    argsp = argsubparsers.add_parser("rm", help="Remove files from the working tree and the index.")
+    argsp.add_argument("--cached",
+                       action="store_true",
+                       help="Only remove from the index, keep the files")
+    argsp.add_argument("path",
+                       nargs="+",
+                       help="Files to remove")
+
+def cmd_rm(args):
+    repo = repo_find()
+    rm(repo, args.path, delete = not args.cached)
+
+def rm(repo, paths, delete = True):
+    """Remove paths, files or whole directories, from the index, and from
+the worktree if delete."""
+    from index.index_utils import index_read, index_write
+    from worktree.checkout_utils import checkout_remove
+
+    index = index_read(repo)
+
+    removed = list()
+    for path in paths:
+        name = worktree_name(repo, path)
+        found = False
+        # Entries are sorted, so a directory's files are contiguous
+        pos = index.position(name)
+        while pos < len(index.entries):
+            e = index.entries[pos]
+            if e.name == name or name == "." or e.name.startswith(name + "/"):
+                removed.append(index.entries.pop(pos))
+                index.invalidate(e.name)
+                found = True
+            elif e.name > name + "/":
+                break
+            else:
+                pos += 1
+        if not found:
+            raise Exception(f"Pathspec {path} did not match any files")
+
+    if delete:
+        # Like git, directories left empty go too
+        for e in removed:
+            checkout_remove(repo, e.name)
+
+    index_write(repo, index)
+
+# Command : git ls-files [-s]
+def args_ls_files(argsubparsers):
+    argsp = argsubparsers.add_parser("ls-files", help = "List all the stage files")
+    argsp.add_argument("-s", "--stage",
+                       dest="stage",
+                       action="store_true",
+                       help="Show mode, object name and stage of each entry")
+
+def cmd_ls_files(args):
+    from index.index_utils import index_read
 
-# Command : git log 
-argsp = argsubparsers.add_parser("log", help="Show the history of a given commit")
-argsp.add_argument("commit",
-                    metavar="HEAD",
-                    help="The object to show.",
-                    nargs = "?")
+    repo = repo_find()
+    index = index_read(repo)
+    for e in index:
+        if args.stage:
+            print(f"{e.mode:06o} {e.sha} {e.flag_stage}\t{e.name}")
+        else:
+            print(e.name)
+
+# Command : git log [-n N] [--since DATE] [--first-parent] [--topo-order] [--oneline|--graphviz] [COMMIT...]
+def args_log(argsubparsers):
+    argsp = argsubparsers.add_parser("log", help="Show the history of a given commit")
+    argsp.add_argument("-n",
+                       metavar="number",
+                       dest="max_count",
+                       type=int,
+                       help="Show at most this many commits.")
+    argsp.add_argument("--since",
+                       metavar="date",
+                       help="Only show commits more recent than a date (YYYY-MM-DD[THH:MM:SS] or a Unix timestamp).")
+    argsp.add_argument("--first-parent",
+                       dest="first_parent",
+                       action="store_true",
+                       help="Only follow the first parent of merge commits.")
+    argsp.add_argument("--topo-order",
+                       dest="topo_order",
+                       action="store_true",
+                       help="Never show a commit before all its children.")
+    argsp.add_argument("--date-order",
+                       dest="date_order",
+                       action="store_true",
+                       help="Like --topo-order, but show commits newest first when possible.")
+    argsp.add_argument("--oneline",
+                       action="store_true",
+                       help="One line per commit.")
+    argsp.add_argument("--graphviz",
+                       action="store_true",
+                       help="Output the history as a graphviz graph.")
+    argsp.add_argument("commit",
+                        metavar="HEAD",
+                        default=["HEAD"],
+                        help="The object to show.",
+                        nargs = "*")
 
 def cmd_log(args):
+    from itertools import islice
+    from object.commit.commit_walk import commit_walk, commit_walk_topo
+
     repo = repo_find()
-    print("digraph giitlog")
-    print("node[shape=react]")
 
-def log_graphviz(repo, sha ,seen):
-    if sha in seen:
-        return
-    seen.add(sha)
-    commit = object_read(repo, sha)
-    message = commit.kvlm[None].decode("utf-8").strip()
-    message = message.replace("\\", "\\\\")
-    message = message.replace("\"", "\\\"")
+    tips = [object_find(repo, name, format=b'commit') for name in args.commit]
 
-    if "\n" in message : 
+    since = None
+    if args.since:
+        from datetime import datetime
+        since = int(args.since) if args.since.isdigit() else int(datetime.fromisoformat(args.since).timestamp())
+
+    if args.topo_order or args.date_order or args.graphviz:
+        shas = commit_walk_topo(repo, tips, first_parent=args.first_parent, since=since,
+                                date_order=args.date_order)
+    else:
+        shas = commit_walk(repo, tips, first_parent=args.first_parent, since=since)
+    if args.max_count is not None:
+        shas = islice(shas, args.max_count)
+
+    try:
+        if args.graphviz:
+            log_graphviz(repo, shas, first_parent=args.first_parent)
+        else:
+            log_text(repo, shas, oneline=args.oneline)
+    except BrokenPipeError:
+        # Piped into head, or similar: stop quietly
+        sys.stdout = None
+
+def log_message_subject(commit):
+    message = commit.kvlm[None].decode("utf-8", "replace").strip()
+    if "\n" in message:
         message = message[: message.index("\n")]
-    
-    print(f" c_{sha} [label=\"[sha[0:7] : {message}\"]")
-    assert commit.format == b'commit'
-    
-    if not b'parent' in commit.kvlm.keys():
-        return
+    return message
+
+def log_date(ident):
+    """Format the date part of an author/committer line like git does."""
+    from datetime import datetime, timedelta, timezone
+
+    _, timestamp, tz = ident.rsplit(b' ', 2)
+    tz = tz.decode("ascii")
+    offset = (int(tz[1:3]) * 60 + int(tz[3:5])) * (-1 if tz[0] == "-" else 1)
+    date = datetime.fromtimestamp(int(timestamp), timezone(timedelta(minutes=offset)))
+    return f"{date:%a %b} {date.day} {date:%H:%M:%S %Y} {tz}"
+
+def log_text(repo, shas, oneline = False):
+    first = True
+    for sha in shas:
+        commit = object_read(repo, sha)
+        if oneline:
+            print(f"{sha[0:7]} {log_message_subject(commit)}")
+        else:
+            if not first:
+                print()
+            print(f"commit {sha}")
+            parents = commit.kvlm.get(b'parent', [])
+            if type(parents) == list and len(parents) > 1:
+                print("Merge: " + " ".join(p.decode("ascii")[0:7] for p in parents))
+            author = commit.kvlm[b'author']
+            print("Author: " + author.rsplit(b' ', 2)[0].decode("utf-8", "replace"))
+            print("Date:   " + log_date(author))
+            print()
+            for line in commit.kvlm[None].decode("utf-8", "replace").rstrip("\n").split("\n"):
+                print(("    " + line).rstrip())
+        if first:
+            # Show something right away, then let stdout buffer
+            sys.stdout.flush()
+            first = False
+
+def log_graphviz(repo, shas, first_parent = False):
+    from object.commit.commit_graph import commit_parents
+
+    print("digraph giitlog{")
+    print("  node[shape=rect]")
+    for sha in shas:
+        commit = object_read(repo, sha)
+        assert commit.format == b'commit'
+        message = log_message_subject(commit)
+        message = message.replace("\\", "\\\\")
+        message = message.replace("\"", "\\\"")
+        print(f"  c_{sha} [label=\"{sha[0:7]}: {message}\"]")
+
+        # The commit-graph, when there is one, saves parsing the parents
+        parents = commit_parents(repo, sha)
+        if first_parent:
+            parents = parents[:1]
+        for p in parents:
+            print(f"  c_{sha} -> c_{p};")
+    print("}")
+
+# Command : git commit-graph write
+def args_commit_graph(argsubparsers):
+    argsp = argsubparsers.add_parser("commit-graph", help="Write the commit-graph file")
+    argsp.add_argument("action",
+                       choices=["write"],
+                       help="What to do with the commit-graph.")
+
+def cmd_commit_graph(args):
+    from object.commit.commit_graph import commit_graph_write
 
-    parents = commit.kvlm[b'parent']
+    repo = repo_find()
+    count = commit_graph_write(repo)
+    print(f"Wrote commit-graph with {count} commits")
+
+# Command : git diff-tree TREE-ISH TREE-ISH
+def args_diff_tree(argsubparsers):
+    argsp = argsubparsers.add_parser("diff-tree", help="Compare two trees, recursively.")
+    argsp.add_argument("old",
+                       help="A tree-ish object.")
+    argsp.add_argument("new",
+                       help="A tree-ish object.")
 
-    if type(parents) != list:
-        parents = [parents]
-    
+def cmd_diff_tree(args):
+    from object.tree.tree_diff import tree_diff
 
-    for p in parents:
-        p = p.decode("utf-8")
-        print(f" c_{sha} -> c_{p}")
-        log_graphviz(repo, p, seen)
+    repo = repo_find()
+    zero = "0" * 40
+    try:
+        for status, path, old, new in tree_diff(repo, object_find(repo, args.old), object_find(repo, args.new)):
+            print(f":{old.mode.decode('ascii') if old else '000000'} {new.mode.decode('ascii') if new else '000000'} "
+                  f"{old.sha if old else zero} {new.sha if new else zero} {status}\t{path}")
+    except BrokenPipeError:
+        # Piped into head, or similar: stop quietly
+        sys.stdout = None
+
+# Command : git merge-base [--all] COMMIT COMMIT... | git merge-base --is-ancestor COMMIT COMMIT
+def args_merge_base(argsubparsers):
+    argsp = argsubparsers.add_parser("merge-base", help="Find the best common ancestors of commits")
+    argsp.add_argument("-a", "--all",
+                       dest="all",
+                       action="store_true",
+                       help="Print every best common ancestor, not only the first")
+    argsp.add_argument("--is-ancestor",
+                       dest="is_ancestor",
+                       action="store_true",
+                       help="Exit with status 0 if the first commit is an ancestor of the second, 1 if not")
+    argsp.add_argument("commit",
+                       nargs="+",
+                       help="The commits")
+
+def cmd_merge_base(args):
+    from object.commit.commit_walk import commit_is_ancestor, commit_merge_bases
+
+    repo = repo_find()
+    refs = ref_snapshot(repo)
+    shas = [object_find(repo, name, format=b'commit', refs=refs) for name in args.commit]
+    if len(shas) < 2:
+        raise Exception("merge-base needs at least two commits")
+
+    if args.is_ancestor:
+        if len(shas) != 2:
+            raise Exception("--is-ancestor takes exactly two commits")
+        sys.exit(0 if commit_is_ancestor(repo, shas[0], shas[1]) else 1)
+
+    bases = commit_merge_bases(repo, shas[0], shas[1:])
+    if not bases:
+        sys.exit(1)
+    for sha in bases if args.all else bases[:1]:
+        print(sha)
 
 # Command : git ls-tree [-r] [tree-ish]
-argsp = argsubparsers.add_parser("ls-tree", help="Pretty-print a tree object.")
-argsp.add_argument("-r",
-                   dest="recursive",
-                   action="store_true",
-                   help="Recurse into sub-trees")
+def args_ls_tree(argsubparsers):
+    argsp = argsubparsers.add_parser("ls-tree", help="Pretty-print a tree object.")
+    argsp.add_argument("-r",
+                       dest="recursive",
+                       action="store_true",
+                       help="Recurse into sub-trees")
 
-argsp.add_argument("tree",
-                   help="A tree-ish object.")
+    argsp.add_argument("tree",
+                       help="A tree-ish object.")
 
 def cmd_ls_tree(args):
     repo = repo_find()
     ls_tree(repo, args.tree, args.recursive)
 
 def ls_tree(repo, ref, recursive=None, prefix=""):
-    sha = object_find(repo, ref, fmt=b"tree")
+    sha = object_find(repo, ref, format=b"tree")
     obj = object_read(repo, sha)
     for item in obj.items:
         if len(item.mode) == 5:
@@ -275,20 +693,35 @@ def ls_tree(repo, ref, recursive=None, prefix=""):
         else: # This is a branch, recurse
             ls_tree(repo, item.sha, recursive, os.path.join(prefix, item.path))
 
-argsp = argsubparsers.add_parser("checkout", help="Checkout a commit inside of a directory")
-argsp.add_argument("commit",
-                    metavar="commit",
-                    help="The commit to checkout.")
-argsp.add_argument("path",
-                   help="The EMPTY directory to checkout into.")
+def args_checkout(argsubparsers):
+    argsp = argsubparsers.add_parser("checkout", help="Checkout a commit inside of a directory, or switch the worktree to it")
+    argsp.add_argument("-j",
+                       metavar="jobs",
+                       dest="jobs",
+                       type=int,
+                       help="Number of threads writing files (default: depends on the CPU count)")
+    argsp.add_argument("-f", "--force",
+                       dest="force",
+                       action="store_true",
+                       help="Switch even if local changes would be lost")
+    argsp.add_argument("commit",
+                        metavar="commit",
+                        help="The commit to checkout.")
+    argsp.add_argument("path",
+                       nargs="?",
+                       help="The EMPTY directory to checkout into.  Without it, the worktree is switched in place.")
 
 def cmd_checkout(args):
+    from worktree.checkout_utils import checkout_tree
+
     repo = repo_find()
 
-    obj = object_read(repo, object_find(repo, args.commit))
+    if args.path is None:
+        checkout_in_place(repo, args.commit, args.force, args.jobs)
+        return
 
-    if obj.format == b'commit':
-        obj = object_read(repo, obj.kvlm[b'tree'].decode("ascii"))
+    # Whatever it names (commit, tag, tree), we want a tree
+    sha = object_find(repo, args.commit, format=b'tree')
 
     if os.path.exists(args.path):
         if not os.path.isdir(args.path):
@@ -299,70 +732,110 @@ def cmd_checkout(args):
         # Create the directory if it doesn't exist
         os.makedirs(args.path)    
 
-    tree_checkout(repo, obj, os.path.realpath(args.path))
+    files, size, elapsed = checkout_tree(repo, sha, os.path.realpath(args.path), jobs=args.jobs)
+    print(f"Checked out {files} files ({size / (1 << 20):.1f} MiB) in {elapsed:.2f}s, "
+          f"{files / max(elapsed, 1e-9):,.0f} files/s", file=sys.stderr)
+
+def checkout_in_place(repo, name, force = False, jobs = None):
+    """Switch the worktree, index and HEAD to name: a branch, which HEAD
+then follows, or any commit, which detaches HEAD."""
+    from worktree.checkout_utils import checkout_switch
+
+    branch = ref_resolve(repo, "refs/heads/" + name)
+    sha = branch or object_find(repo, name, format=b'commit')
+
+    written, removed, elapsed = checkout_switch(repo, sha, force=force, jobs=jobs)
 
-def tree_checkout(repo, tree, path):
-    for item in tree.items:
-        obj = object_read(repo, item.sha)
-        dest = os.path.join(path, item.path)
+    with open(repo_file(repo, "HEAD"), "w") as f:
+        if branch:
+            f.write(f"ref: refs/heads/{name}\n")
+        else:
+            f.write(sha + "\n")
 
-        if obj.fmt == b'tree':
-            os.mkdir(dest)
-            tree_checkout(repo, obj, dest)
-        elif obj.fmt == b'blob':
-            # @TODO Support symlinks (identified by mode 12)
-            with open(dest, "wb") as f:
-                f.write(obj.blobdata)
+    print(f"Updated {written} files, removed {removed} in {elapsed:.2f}s", file=sys.stderr)
+    if branch:
+        print(f"Switched to branch '{name}'")
+    else:
+        print(f"HEAD is now at {sha[:7]}")
+
+
+# Command : git gc [-j JOBS] [--window N] [--depth N] [--no-write-bitmap-index]
+def args_gc(argsubparsers):
+    from object.pack.pack_write import PACK_DEPTH, PACK_WINDOW
+
+    argsp = argsubparsers.add_parser("gc", help="Pack every reachable object, then drop old packs and loose objects")
+    argsp.add_argument("-j",
+                       metavar="jobs",
+                       dest="jobs",
+                       type=int,
+                       help="Number of processes searching for deltas (default: one per CPU)")
+    argsp.add_argument("--window",
+                       type=int,
+                       default=PACK_WINDOW,
+                       help=f"How many objects each one is compared with (default: {PACK_WINDOW})")
+    argsp.add_argument("--depth",
+                       type=int,
+                       default=PACK_DEPTH,
+                       help=f"Maximum length of delta chains (default: {PACK_DEPTH})")
+    argsp.add_argument("--no-write-bitmap-index",
+                       dest="bitmap",
+                       action="store_false",
+                       help="Don't write reachability bitmaps for the new pack")
+
+def cmd_gc(args):
+    import time
+    from object.pack.pack_write import pack_repack
+
+    repo = repo_find()
+    start = time.perf_counter()
+    objects, deltas, name = pack_repack(repo, window = args.window, depth = args.depth,
+                                          jobs = args.jobs, bitmap = args.bitmap)
+    size = os.path.getsize(name + ".pack")
+    print(f"Packed {objects} objects ({deltas} deltas) into {os.path.basename(name)}.pack, "
+          f"{size / (1 << 20):.1f} MiB in {time.perf_counter() - start:.2f}s", file=sys.stderr)
 
 
 # Command : git show-ref
 
-argsp = argsubparsers.add_parser("show-ref", help="List references in the repository")
+def args_show_ref(argsubparsers):
+    argsp = argsubparsers.add_parser("show-ref", help="List references in the repository")
 
 def cmd_show_ref(args):
     repo = repo_find()
-    refs = ref_list(repo)
-    show_ref(repo, refs,prefix = "refs")
-
-def show_ref(repo, refs, with_hash = True, prefix = ""):
-    if prefix:
-        prefix += "/"
-    for k, v in refs.items():
-        if type(v) == str and with_hash:
-            print (f"{v} {prefix}{k}")
-        elif type(v) == str:
-            print (f"{prefix}{k}")
-        else:
-            show_ref(repo, v, with_hash = with_hash, prefix = f"{prefix}{k}" )
+    for name, sha in ref_snapshot(repo).items("refs/"):
+        print(f"{sha} {name}")
 
 # Command : git tag | git tag NAME [OBJECT] | git tag -a NAME [OBJECT]
-argsp = argsubparsers.add_parser("tag", help ="List and Create tags")
-
-argsp.add_argument("-a",
-                   action="store_true",
-                   dest="create_tag_object",
-                   help="Whether to creta a tag object")
-argsp.add_argument("name",
-                   nargs="?",
-                   help="The name of the tag to create.")
-argsp.add_argument("object",
-                    default="HEAD",
-                    nargs="?",
-                    help="The object to tag. If not specified, HEAD is used.")
+def args_tag(argsubparsers):
+    argsp = argsubparsers.add_parser("tag", help ="List and Create tags")
+
+    argsp.add_argument("-a",
+                       action="store_true",
+                       dest="create_tag_object",
+                       help="Whether to creta a tag object")
+    argsp.add_argument("name",
+                       nargs="?",
+                       help="The name of the tag to create.")
+    argsp.add_argument("object",
+                        default="HEAD",
+                        nargs="?",
+                        help="The object to tag. If not specified, HEAD is used.")
 
 def cmd_tag(args):
     repo = repo_find()
 
     if not args.name:
-        refs = ref_list(repo)
-        show_ref(repo, refs, with_hash = False)
+        for name, _ in ref_snapshot(repo).items("refs/tags/"):
+            print(name[10:])
         return
 
     else: 
         tag_create(repo, args.name, args.object, create_tag_object = args.create_tag_object)
 
 def tag_create(repo, name, obj, create_tag_object = False):
-    sha = object_find(repo, ref)
+    from object.refs.refs_utils import GitTag
+
+    sha = object_find(repo, obj)
 
     if create_tag_object:
         # Create a tag object (commit)
@@ -381,11 +854,391 @@ def tag_create(repo, name, obj, create_tag_object = False):
         ref_create(repo, "tags/" + name, sha)
 
 def ref_create(repo, ref, sha):
-    path = repo_file(repo, ref)
-    if not os.path.exists(os.path.dirname(path)):
-        os.makedirs(os.path.dirname(path))
-    
-    with open(path, 'w') as f:
-        f.write(sha + "\n")
-    
-    print(f"Created reference {ref} to {sha}")  
\ No newline at end of file
+    ref_write(repo, "refs/" + ref, sha)
+    print(f"Created reference {ref} to {sha}")
+
+# Command : git pack-refs [--all]
+def args_pack_refs(argsubparsers):
+    argsp = argsubparsers.add_parser("pack-refs", help="Pack references into .git/packed-refs")
+    argsp.add_argument("--all",
+                       dest="all",
+                       action="store_true",
+                       help="Pack branches too, not only tags")
+
+def cmd_pack_refs(args):
+    from object.refs.refs_utils import ref_pack
+
+    repo = repo_find()
+    count = ref_pack(repo, all = args.all)
+    print(f"Packed {count} references")
+
+
+# Command : git check-ignore PATH...
+def args_check_ignore(argsubparsers):
+    argsp = argsubparsers.add_parser("check-ignore", help = "Check path(s) against ignore rules.")
+    argsp.add_argument("path", nargs="+", help="Paths to check")
+
+def cmd_check_ignore(args):
+    from worktree.git_ignore import GitIgnore
+
+    repo = repo_find()
+    rules = GitIgnore(repo)
+    for path in args.path:
+        if rules.check(worktree_name(repo, path), os.path.isdir(path)):
+            print(path)
+
+# Command : git status
+def args_status(argsubparsers):
+    argsp = argsubparsers.add_parser("status", help = "Show the working tree status.")
+
+def cmd_status(args):
+    from index.index_utils import index_read
+
+    repo = repo_find()
+    index = index_read(repo)
+
+    try:
+        cmd_status_branch(repo)
+        cmd_status_head_index(repo, index)
+        print()
+        cmd_status_index_worktree(repo, index)
+    except BrokenPipeError:
+        # Piped into head, or similar: stop quietly
+        sys.stdout = None
+
+def branch_get_active(repo):
+    with open(repo_file(repo, "HEAD"), "r") as f:
+        head = f.read()
+
+    if head.startswith("ref: refs/heads/"):
+        return head[16:-1]
+    else:
+        return False
+
+def cmd_status_branch(repo):
+    branch = branch_get_active(repo)
+    if branch:
+        print(f"On branch {branch}.")
+    else:
+        print(f"HEAD detached at {ref_resolve(repo, 'HEAD')}")
+
+def tree_to_dict(repo, sha, prefix=""):
+    """Flatten the tree (or commit) sha into a {path: blob sha} dict."""
+    ret = dict()
+    obj = object_read(repo, sha)
+    if obj.format == b'commit':
+        obj = object_read(repo, obj.kvlm[b'tree'].decode("ascii"))
+
+    for leaf in obj.items:
+        path = prefix + leaf.path
+        if leaf.mode.startswith(b'04'):
+            ret.update(tree_to_dict(repo, leaf.sha, path + "/"))
+        else:
+            ret[path] = leaf.sha
+    return ret
+
+def cmd_status_head_index(repo, index):
+    print("Changes to be committed:")
+
+    head = ref_resolve(repo, "HEAD")
+    head = tree_to_dict(repo, head) if head else dict()
+    for entry in index:
+        if entry.name in head:
+            if head[entry.name] != entry.sha:
+                print("  modified:", entry.name)
+            del head[entry.name]
+        else:
+            print("  added:   ", entry.name)
+
+    # Whatever's left wasn't in the index
+    for name in head.keys():
+        print("  deleted: ", name)
+
+def status_worktree(repo, index, jobs = None):
+    """Compare the worktree with index.
+
+Returns (modified, deleted, untracked) lists of names.  worktree_scan
+tells us which files' stat() doesn't match their entry; only those get
+rehashed.  Those that turn out to be unchanged have their entry
+refreshed, and the index is rewritten so the next status doesn't hash
+them again."""
+    from index.index_utils import index_entry_from_stat, index_hash_path, index_write
+    from worktree.git_ignore import GitIgnore
+    from worktree.worktree_utils import worktree_scan
+
+    changed, deleted, untracked = worktree_scan(repo, index, ignore = GitIgnore(repo), jobs = jobs)
+
+    modified = list()
+    refreshed = False
+    for entry, st in changed:
+        sha = index_hash_path(os.path.join(repo.worktree, entry.name), st)
+        if sha != entry.sha:
+            modified.append(entry.name)
+        else:
+            index.add(index_entry_from_stat(entry.name, sha, st))
+            refreshed = True
+
+    if refreshed:
+        index_write(repo, index)
+
+    return modified, deleted, untracked
+
+def cmd_status_index_worktree(repo, index):
+    modified, deleted, untracked = status_worktree(repo, index)
+
+    print("Changes not staged for commit:")
+    for name in modified:
+        print("  modified:", name)
+    for name in deleted:
+        print("  deleted: ", name)
+
+    print()
+    print("Untracked files:")
+    for name in untracked:
+        print(" ", name)
+
+
+# Command : git commit -m MESSAGE
+def args_commit(argsubparsers):
+    argsp = argsubparsers.add_parser("commit", help="Record changes to the repository.")
+    argsp.add_argument("-m",
+                       metavar="message",
+                       dest="message",
+                       required=True,
+                       help="Message to associate with this commit.")
+
+def cmd_commit(args):
+    from index.index_utils import index_read, index_tree_update, index_write
+
+    repo = repo_find()
+    index = index_read(repo)
+
+    # Only the directories changed since the last commit get new trees
+    tree = index_tree_update(repo, index)
+    parent = ref_resolve(repo, "HEAD")
+    if parent and object_read(repo, parent).kvlm[b'tree'].decode("ascii") == tree:
+        raise Exception("Nothing to commit")
+
+    sha = commit_create(repo, tree, parent, commit_identity(repo), args.message)
+    # Keep the cached trees for the next commit
+    index_write(repo, index)
+
+    branch = branch_get_active(repo)
+    if branch:
+        ref_write(repo, "refs/heads/" + branch, sha)
+    else:
+        ref_write(repo, "HEAD", sha)
+    subject = args.message.splitlines()[0] if args.message else ""
+    print(f"[{branch or 'detached HEAD'} {sha[:7]}] {subject}")
+
+def commit_identity(repo):
+    """"Name <email>" of the user, from user.name and user.email in the
+repository's config, else in the global ones."""
+    import configparser
+
+    conf = configparser.ConfigParser(strict=False, interpolation=None)
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    # Later files win
+    for path in (os.path.join(config_home, "git", "config"),
+                 os.path.expanduser("~/.gitconfig"),
+                 repo_file(repo, "config")):
+        try:
+            conf.read(path)
+        except configparser.Error:
+            # Git syntax configparser doesn't know: skip the file
+            pass
+
+    name = conf.get("user", "name", fallback=None)
+    email = conf.get("user", "email", fallback=None)
+    if not (name and email):
+        raise Exception("Please set user.name and user.email in .git/config or ~/.gitconfig")
+    return f"{name} <{email}>"
+
+def commit_create(repo, tree, parent, author, message):
+    """Write the commit of tree, with parent (or None for a first commit),
+made now by author ("Name <email>").  Returns its SHA."""
+    import time
+    from object.commit.commit_object import GitCommit
+
+    now = int(time.time())
+    offset = time.localtime(now).tm_gmtoff // 60
+    tz = f"{'+' if offset >= 0 else '-'}{abs(offset) // 60:02}{abs(offset) % 60:02}"
+    ident = f"{author} {now} {tz}".encode("utf8")
+
+    commit = GitCommit()
+    commit.kvlm = dict()
+    commit.kvlm[b'tree'] = tree.encode("ascii")
+    if parent:
+        commit.kvlm[b'parent'] = parent.encode("ascii")
+    commit.kvlm[b'author'] = ident
+    commit.kvlm[b'committer'] = ident
+    commit.kvlm[None] = message.encode("utf8") + (b'' if message.endswith("\n") else b'\n')
+    return object_write(commit, repo)
+
+
+
+# Command : git clone [--upload-pack COMMAND] REPOSITORY [DIRECTORY]
+def args_clone(argsubparsers):
+    argsp = argsubparsers.add_parser("clone", help="Copy a repository, from a local path or over smart HTTP, into a new directory")
+    argsp.add_argument("--upload-pack",
+                       metavar="command",
+                       dest="upload_pack",
+                       help="Command serving a local repository (default: giit upload-pack)")
+    argsp.add_argument("-j",
+                       metavar="jobs",
+                       dest="jobs",
+                       type=int,
+                       help="Number of threads writing files (default: depends on the CPU count)")
+    argsp.add_argument("repository",
+                       help="Path, file:// or http:// URL of the repository to clone")
+    argsp.add_argument("directory",
+                       nargs="?",
+                       help="Where to clone it (default: named after the repository)")
+
+def cmd_clone(args):
+    import time
+    from remote.remote_utils import remote_clone
+
+    path = args.directory
+    if path is None:
+        path = os.path.basename(args.repository.rstrip("/"))
+        if path.endswith(".git"):
+            path = path[:-4]
+    if os.path.exists(path) and (not os.path.isdir(path) or os.listdir(path)):
+        raise Exception(f"Destination path '{path}' already exists and is not an empty directory")
+
+    print(f"Cloning into '{path}'...", file=sys.stderr)
+    start = time.perf_counter()
+    repo, objects, branch = remote_clone(args.repository, path, args.upload_pack, args.jobs)
+    if branch is None:
+        print("warning: You appear to have cloned an empty repository.", file=sys.stderr)
+    print(f"Received {objects} objects in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+
+# Command : git fetch [--upload-pack COMMAND] [REMOTE]
+def args_fetch(argsubparsers):
+    argsp = argsubparsers.add_parser("fetch", help="Download objects and refs from a remote")
+    argsp.add_argument("--upload-pack",
+                       metavar="command",
+                       dest="upload_pack",
+                       help="Command serving a local repository (default: giit upload-pack)")
+    argsp.add_argument("remote",
+                       nargs="?",
+                       default="origin",
+                       help="The remote to fetch from (default: origin)")
+
+def cmd_fetch(args):
+    from remote.remote_utils import remote_fetch
+
+    repo = repo_find()
+    url = repo.conf.get(f'remote "{args.remote}"', "url", fallback=None)
+    if url is None:
+        raise Exception(f"No such remote: {args.remote}")
+
+    updates, objects, head = remote_fetch(repo, args.remote, url, args.upload_pack)
+    if updates:
+        print(f"From {url}", file=sys.stderr)
+    for ref, old, new in updates:
+        if ref.startswith("refs/tags/"):
+            name = local = ref[10:]
+        else:
+            local = ref[13:]
+            name = local[len(args.remote) + 1:]
+        if old is None:
+            kind = "[new tag]" if ref.startswith("refs/tags/") else "[new branch]"
+            print(f" * {kind:<17} {name:<10} -> {local}", file=sys.stderr)
+        else:
+            print(f"   {old[:7]}..{new[:7]}  {name:<10} -> {local}", file=sys.stderr)
+
+
+# Command : git upload-pack [--stateless-rpc] [--advertise-refs] DIRECTORY
+def args_upload_pack(argsubparsers):
+    argsp = argsubparsers.add_parser("upload-pack", help="Send objects to a fetch or clone, over stdin and stdout")
+    argsp.add_argument("--stateless-rpc",
+                       dest="stateless",
+                       action="store_true",
+                       help="Answer a single HTTP request: no ref advertisement, stop at the first flush")
+    argsp.add_argument("--advertise-refs",
+                       dest="advertise_refs",
+                       action="store_true",
+                       help="Only send the ref advertisement")
+    argsp.add_argument("directory",
+                       help="The repository to serve")
+
+def cmd_upload_pack(args):
+    from remote.remote_upload import upload_pack, upload_pack_advertise
+
+    repo = repo_find(args.directory)
+    if args.advertise_refs:
+        upload_pack_advertise(repo, sys.stdout.buffer)
+        return
+    upload_pack(repo, sys.stdin.buffer, sys.stdout.buffer,
+                stateless = args.stateless, advertise = not args.stateless)
+
+
+# Command : git serve [--host HOST] [--port PORT] [DIRECTORY]
+def args_serve(argsubparsers):
+    argsp = argsubparsers.add_parser("serve", help="Serve fetches and clones of a repository over smart HTTP")
+    argsp.add_argument("--host",
+                       default="127.0.0.1",
+                       help="Address to listen on (default: 127.0.0.1)")
+    argsp.add_argument("--port",
+                       type=int,
+                       default=8000,
+                       help="Port to listen on (default: 8000)")
+    argsp.add_argument("-v", "--verbose",
+                       action="store_true",
+                       help="Log every request")
+    argsp.add_argument("directory",
+                       nargs="?",
+                       default=".",
+                       help="The repository to serve")
+
+def cmd_serve(args):
+    from remote.remote_http import remote_http_server
+
+    repo = repo_find(args.directory)
+    server = remote_http_server(repo.worktree, args.host, args.port, args.verbose)
+    host, port = server.server_address[:2]
+    print(f"Serving {repo.worktree} on http://{host}:{port}/", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+# Every command, with the function adding its subparser and the one
+# running it.  Commands import what they need themselves, so running one
+# doesn't load the modules of all the others.
+commands = {
+    "add"          : (args_add, cmd_add),
+    "cat-file"     : (args_cat_file, cmd_cat_file),
+    "check-ignore" : (args_check_ignore, cmd_check_ignore),
+    "checkout"     : (args_checkout, cmd_checkout),
+    "clone"        : (args_clone, cmd_clone),
+    "commit"       : (args_commit, cmd_commit),
+    "commit-graph" : (args_commit_graph, cmd_commit_graph),
+    "diff-tree"    : (args_diff_tree, cmd_diff_tree),
+    "fetch"        : (args_fetch, cmd_fetch),
+    "gc"           : (args_gc, cmd_gc),
+    "hash-object"  : (args_hash_object, cmd_hash_object),
+    "init"         : (args_init, cmd_init),
+    "log"          : (args_log, cmd_log),
+    "ls-files"     : (args_ls_files, cmd_ls_files),
+    "ls-tree"      : (args_ls_tree, cmd_ls_tree),
+    "merge-base"   : (args_merge_base, cmd_merge_base),
+    "pack-refs"    : (args_pack_refs, cmd_pack_refs),
+    "rev-list"     : (args_rev_list, cmd_rev_list),
+    "rev-parse"    : (args_rev_parse, cmd_rev_parse),
+    "rm"           : (args_rm, cmd_rm),
+    "serve"        : (args_serve, cmd_serve),
+    "show-ref"     : (args_show_ref, cmd_show_ref),
+    "status"       : (args_status, cmd_status),
+    "tag"          : (args_tag, cmd_tag),
+    "upload-pack"  : (args_upload_pack, cmd_upload_pack),
+}
+
+# Per command, what a bare optional-value option stands for, see main
+optional_values = {
+    "rev-parse"    : { "--short": "--short=7" },
+}
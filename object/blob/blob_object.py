@@ -6,7 +6,7 @@ class GitBlob(GitObject):
 
     format = b'blob'
 
-    def serialize(self, data):
+    def serialize(self):
         """Serialize the blob object."""
         return self.blobdata
 
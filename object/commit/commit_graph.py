@@ -0,0 +1,285 @@
+"""The commit-graph file, .git/objects/info/commit-graph.
+
+It caches, for every commit it covers, what history walks need: parents,
+root tree, commit date and generation number, in fixed-width records that
+are read straight out of an mmap instead of inflating and parsing commits.
+
+    - header: b'CGPH', version (1), hash version (1 = SHA-1),
+      number of chunks, number of base graphs (0)
+    - chunk table: (4-byte id, 8-byte offset) per chunk, plus a terminating
+      entry with id 0 pointing to the end of the last chunk
+    - OIDF: 256 uint32 fanout table, like a pack index
+    - OIDL: the sorted 20-byte commit SHAs
+    - CDAT: one 36-byte record per commit: root tree SHA, first and second
+      parent positions, generation << 2 | top 2 bits of the date, low 32
+      bits of the date
+    - EDGE: parent lists of octopus merges (3 parents or more)
+    - SHA-1 of everything above
+
+A commit's position is its index in OIDL.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from object.commit.commit_utils import kvlm_parse
+from object.object_utils import object_read, object_read_raw
+from object.pack.pack_store import GitShaTable
+from object.refs.refs_utils import ref_list, ref_resolve
+from repository.repo_utils import repo_file
+
+
+GRAPH_SIGNATURE = b'CGPH'
+GRAPH_PARENT_NONE = 0x70000000
+GRAPH_EXTRA_EDGES = 0x80000000
+GRAPH_LAST_EDGE = 0x80000000
+GRAPH_DATA = struct.Struct(">20sIIII")
+
+# The headers commit_info needs; the others and the message are skipped
+COMMIT_INFO_KEYS = frozenset([b'tree', b'parent', b'committer', b'author'])
+
+
+class GitCommitGraph (object):
+    """A commit-graph file, mmapped."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        signature, version, hash_version, chunks, bases = struct.unpack_from(">4sBBBB", self.buf, 0)
+        if signature != GRAPH_SIGNATURE:
+            raise Exception("Not a commit-graph file: " + path)
+        if version != 1 or hash_version != 1:
+            raise Exception("Unsupported commit-graph version")
+
+        self.chunks = dict()
+        for i in range(chunks):
+            id, offset = struct.unpack_from(">4sQ", self.buf, 8 + i * 12)
+            self.chunks[id] = offset
+
+        for id in (b'OIDF', b'OIDL', b'CDAT'):
+            if id not in self.chunks:
+                raise Exception("Commit-graph is missing chunk " + id.decode("ascii"))
+
+        self.fanout = struct.unpack_from(">256I", self.buf, self.chunks[b'OIDF'])
+        self.count = self.fanout[255]
+        self.shas = GitShaTable(self.buf, self.chunks[b'OIDL'], self.count)
+        self.data = self.chunks[b'CDAT']
+        self.edges = self.chunks.get(b'EDGE')
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.buf.close()
+
+    def position(self, sha):
+        """Position of binary sha in the graph, or None."""
+        first = sha[0]
+        lo = self.fanout[first - 1] if first else 0
+        hi = self.fanout[first]
+        pos = bisect_left(self.shas, sha, lo, hi)
+        if pos < hi and self.shas[pos] == sha:
+            return pos
+        return None
+
+    def sha(self, pos):
+        return self.shas[pos]
+
+    def record(self, pos):
+        """Return (tree, parents, generation, date) for the commit at pos;
+tree is a binary SHA, parents a list of positions."""
+        tree, p1, p2, gen_date, date = GRAPH_DATA.unpack_from(self.buf, self.data + pos * 36)
+
+        parents = list()
+        if p1 != GRAPH_PARENT_NONE:
+            parents.append(p1)
+        if p2 & GRAPH_EXTRA_EDGES:
+            # Octopus: p2 indexes the list of the remaining parents
+            edge = self.edges + (p2 & 0x7fffffff) * 4
+            while True:
+                p = struct.unpack_from(">I", self.buf, edge)[0]
+                parents.append(p & 0x7fffffff)
+                if p & GRAPH_LAST_EDGE:
+                    break
+                edge += 4
+        elif p2 != GRAPH_PARENT_NONE:
+            parents.append(p2)
+
+        return tree, parents, gen_date >> 2, ((gen_date & 3) << 32) | date
+
+
+def commit_graph(repo):
+    """The repository's commit-graph, opened on first use, or None if there
+isn't one."""
+    if repo.graph is None:
+        path = repo_file(repo, "objects", "info", "commit-graph")
+        repo.graph = GitCommitGraph(path) if path and os.path.exists(path) else False
+    return repo.graph or None
+
+def commit_date(kvlm):
+    """The committer timestamp of a parsed commit."""
+    committer = kvlm.get(b'committer') or kvlm.get(b'author')
+    if not committer:
+        return 0
+    return int(committer.rsplit(b' ', 2)[-2])
+
+def commit_info(repo, sha):
+    """Return (tree, parents, date, generation) for commit sha, SHAs as hex
+strings.  Comes from the commit-graph when it covers sha; otherwise the
+commit is read and generation is None.
+
+Either way, the result is kept in repo.commits: walks come back to the
+same commits over and over, and decoding them again costs more than a
+dict lookup.  The parents list is shared: don't modify it."""
+    info = repo.commits.get(sha)
+    if info is not None:
+        return info
+
+    graph = commit_graph(repo)
+    pos = graph.position(bytes.fromhex(sha)) if graph else None
+    if pos is not None:
+        tree, parents, generation, date = graph.record(pos)
+        info = tree.hex(), [graph.sha(p).hex() for p in parents], date, generation
+    else:
+        raw = object_read_raw(repo, sha)
+        if raw is None:
+            raise Exception("Missing commit: " + sha)
+        if raw[0] != b'commit':
+            raise Exception(f"Not a commit: {sha}")
+
+        # Only the headers we need are copied out: no message, no gpgsig
+        kvlm = kvlm_parse(raw[1], keys=COMMIT_INFO_KEYS)
+        parents = kvlm.get(b'parent', [])
+        if type(parents) != list:
+            parents = [parents]
+        info = (kvlm[b'tree'].decode("ascii"),
+                [p.decode("ascii") for p in parents],
+                commit_date(kvlm),
+                None)
+
+    repo.commits.put(sha, info, 200 + 50 * len(info[1]))
+    return info
+
+def commit_parents(repo, sha):
+    """The parents of commit sha, as hex strings."""
+    return commit_info(repo, sha)[1]
+
+def commit_graph_tips(repo):
+    """Every commit pointed to by HEAD or a ref, peeling tags."""
+    tips = set()
+
+    def walk(refs):
+        for v in refs.values():
+            if type(v) == str:
+                tips.add(v)
+            else:
+                walk(v)
+
+    walk(ref_list(repo))
+    head = ref_resolve(repo, "HEAD")
+    if head:
+        tips.add(head)
+
+    ret = set()
+    for sha in tips:
+        obj = object_read(repo, sha)
+        while obj is not None and obj.format == b'tag':
+            sha = obj.kvlm[b'object'].decode("ascii")
+            obj = object_read(repo, sha)
+        if obj is not None and obj.format == b'commit':
+            ret.add(sha)
+    return ret
+
+def commit_graph_write(repo, tips = None):
+    """Write the commit-graph for every commit reachable from tips (by
+default, from every ref).  Returns the number of commits written."""
+    if tips is None:
+        tips = commit_graph_tips(repo)
+
+    # Collect the commits, iteratively: histories are deep
+    commits = dict()
+    stack = list(tips)
+    while stack:
+        sha = stack.pop()
+        if sha in commits:
+            continue
+        tree, parents, date, _ = commit_info(repo, sha)
+        commits[sha] = (tree, parents, date)
+        stack.extend(p for p in parents if p not in commits)
+
+    # Generation numbers: 1 for roots, else 1 + the max of the parents'.
+    # A commit is computed once all its parents are.
+    generation = dict()
+    for sha in commits:
+        stack = [sha]
+        while stack:
+            cur = stack[-1]
+            if cur in generation:
+                stack.pop()
+                continue
+            todo = [p for p in commits[cur][1] if p not in generation]
+            if todo:
+                stack.extend(todo)
+            else:
+                generation[cur] = 1 + max((generation[p] for p in commits[cur][1]), default=0)
+                stack.pop()
+
+    order = sorted(commits)
+    position = { sha: i for i, sha in enumerate(order) }
+
+    fanout = [0] * 256
+    for sha in order:
+        fanout[int(sha[0:2], 16)] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    oidf = struct.pack(">256I", *fanout)
+    oidl = b''.join(bytes.fromhex(sha) for sha in order)
+
+    cdat = list()
+    edges = list()
+    for sha in order:
+        tree, parents, date = commits[sha]
+        p1 = position[parents[0]] if parents else GRAPH_PARENT_NONE
+        if len(parents) > 2:
+            p2 = GRAPH_EXTRA_EDGES | len(edges)
+            edges.extend(position[p] for p in parents[1:])
+            edges[-1] |= GRAPH_LAST_EDGE
+        elif len(parents) == 2:
+            p2 = position[parents[1]]
+        else:
+            p2 = GRAPH_PARENT_NONE
+        gen = min(generation[sha], 0x3fffffff)
+        cdat.append(GRAPH_DATA.pack(bytes.fromhex(tree), p1, p2,
+                                    (gen << 2) | ((date >> 32) & 3), date & 0xffffffff))
+    cdat = b''.join(cdat)
+
+    chunks = [(b'OIDF', oidf), (b'OIDL', oidl), (b'CDAT', cdat)]
+    if edges:
+        chunks.append((b'EDGE', struct.pack(f">{len(edges)}I", *edges)))
+
+    out = [struct.pack(">4sBBBB", GRAPH_SIGNATURE, 1, 1, len(chunks), 0)]
+    offset = 8 + (len(chunks) + 1) * 12
+    for id, data in chunks:
+        out.append(struct.pack(">4sQ", id, offset))
+        offset += len(data)
+    out.append(struct.pack(">4sQ", b'\x00' * 4, offset))
+    out.extend(data for _, data in chunks)
+    data = b''.join(out)
+    data += hashlib.sha1(data).digest()
+
+    path = repo_file(repo, "objects", "info", "commit-graph", mkdir = True)
+    with open(path + ".lock", "wb") as f:
+        f.write(data)
+    if repo.graph:
+        repo.graph.close()
+    os.replace(path + ".lock", path)
+    repo.graph = None
+    # Commits read before have no generation number
+    repo.commits.clear()
+
+    return len(order)
@@ -1,9 +1,9 @@
-from libgiit import kvlm_parse, kvlm_serialize
+from object.commit.commit_utils import kvlm_parse, kvlm_serialize
 from object.git_object import GitObject
 
 
 class GitCommit(GitObject):
-    fmt=b'commit'
+    format = b'commit'
 
     def deserialize(self, data):
         self.kvlm = kvlm_parse(data)
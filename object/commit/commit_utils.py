@@ -0,0 +1,104 @@
+import re
+
+
+# The end of a header value: a newline not followed by a space
+KVLM_VALUE_END = re.compile(rb'\n(?! )')
+
+def kvlm_iter(raw, start=0):
+    """Walk the headers of a commit or tag, without copying anything.
+
+Yields (key, value_start, value_end) for every header, in order, then
+(None, message_start, len(raw)) for the message.  raw can be bytes or
+anything supporting find() and indexing, like an mmap.
+
+A header is "key value\\n"; a value can span several lines, every
+continuation line starting with a space.  A blank line ends the headers,
+and the rest is the message."""
+    n = len(raw)
+    pos = start
+
+    while pos < n:
+        # We search for the next space and the next newline.
+        spc = raw.find(b' ', pos)
+        nl = raw.find(b'\n', pos)
+
+        # If newline appears first (or there's no space at all, in which
+        # case find returns -1), we have a blank line: the remainder of
+        # the data is the message.
+        if (spc < 0) or (0 <= nl < spc):
+            if nl != pos:
+                raise Exception("Malformed commit header")
+            yield None, pos + 1, n
+            return
+
+        # Find the end of the value.  Continuation lines begin with a
+        # space, so we look for a "\n" not followed by a space.
+        if nl < 0:
+            end = n
+        elif nl + 1 < n and raw[nl + 1] == 0x20:
+            m = KVLM_VALUE_END.search(raw, nl + 1)
+            end = m.start() if m else n
+        else:
+            end = nl
+
+        yield raw[pos:spc], spc + 1, end
+        pos = end + 1
+
+    # No blank line: empty message
+    yield None, n, n
+
+def kvlm_parse(raw, start=0, dct=None, keys=None):
+    """Parse a commit or tag into a dict: keys are header names, values are
+bytes, or lists of bytes for repeated headers like parent.  The message is
+stored under the key None.
+
+If keys is given, only those headers (and the message, if None is in
+keys) are copied out and decoded; the others are just skipped over.
+Walking history, for example, only needs {b'tree', b'parent'}."""
+    if dct is None:
+        dct = dict()
+        # You CANNOT declare the argument as dct=dict() or all call to
+        # the functions will endlessly grow the same dict.
+
+    for key, s, e in kvlm_iter(raw, start):
+        if keys is not None and key not in keys:
+            continue
+
+        if key is None:
+            dct[None] = raw[s:e]
+            break
+
+        # Drop the leading space on continuation lines
+        value = raw[s:e].replace(b'\n ', b'\n')
+
+        # Don't overwrite existing data contents
+        if key in dct:
+            if type(dct[key]) == list:
+                dct[key].append(value)
+            else:
+                dct[key] = [ dct[key], value ]
+        else:
+            dct[key] = value
+
+    return dct
+
+#kvlm is a dictionary with the keys being the keywords and the values
+# being the values. The key None is reserved for the message.
+def kvlm_serialize(kvlm):
+
+    ret = list()
+
+    for k in kvlm.keys():
+        if k is None:
+            continue
+        val = kvlm[k]
+        #NORMALIZE TO A LIST
+        if type(val) != list:
+            val = [val]
+        for v in val:
+            ret.append(k + b' ' + (v.replace(b'\n', b'\n ')) + b'\n')
+
+    ret.append(b'\n')
+    ret.append(kvlm[None])
+
+    return b''.join(ret)
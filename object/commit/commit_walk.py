@@ -0,0 +1,211 @@
+import heapq
+from object.commit.commit_graph import commit_info
+
+
+def commit_walk(repo, tips, first_parent = False, since = None):
+    """Walk history from tips, newest commit first, and yield the SHA of
+every reachable commit once.  See commit_walk_info."""
+    for sha, _, _ in commit_walk_info(repo, tips, first_parent, since):
+        yield sha
+
+def commit_walk_info(repo, tips, first_parent = False, since = None):
+    """Walk history from tips, newest commit first, and yield (sha,
+parents, date) for every reachable commit, once.
+
+This is a priority queue keyed by commit date: memory grows with the
+frontier (the commits seen but not yet shown), not with the length of
+history, and the first commit comes out right away.  Parents and dates
+come from the commit-graph when there is one.
+
+With first_parent, only the first parent of merges is followed.  With
+since (a Unix timestamp), commits older than since are skipped, and the
+walk stops once the whole frontier is older."""
+    queue = list()
+    seen = set()
+    counter = 0
+
+    def push(sha):
+        nonlocal counter
+        if sha in seen:
+            return
+        seen.add(sha)
+        _, parents, date, _ = commit_info(repo, sha)
+        # counter breaks ties between commits with the same date, in
+        # the order we found them
+        heapq.heappush(queue, (-date, counter, sha, parents))
+        counter += 1
+
+    for sha in tips:
+        push(sha)
+
+    while queue:
+        date, _, sha, parents = heapq.heappop(queue)
+        if since is not None and -date < since:
+            # Everything left is older
+            return
+        if first_parent:
+            parents = parents[:1]
+        yield sha, parents, -date
+        for p in parents:
+            push(p)
+
+def commit_walk_topo(repo, tips, first_parent = False, since = None, date_order = False):
+    """Like commit_walk, but never show a commit before all of its
+children: this is the order graph drawing needs.
+
+Done by in-degree counting: a first pass over the walk counts, for each
+commit, how many of the walked commits have it as a parent; then we show
+commits whose count dropped to zero.  Among those, like git, we go depth
+first (the last parent freed is shown next), which keeps lines of
+history together, or newest first with date_order.  Unlike commit_walk,
+the first pass has to see the whole history before showing anything."""
+    indegree = dict()
+    parents_of = dict()
+    dates = dict()
+    order = list()
+    for sha, parents, date in commit_walk_info(repo, tips, first_parent, since):
+        parents_of[sha] = parents
+        dates[sha] = date
+        order.append(sha)
+        indegree.setdefault(sha, 0)
+        for p in parents:
+            indegree[p] = indegree.get(p, 0) + 1
+
+    # Start with the commits nobody walked points to, in walk order.  With
+    # a stack, that means pushing them in reverse.
+    ready = [sha for sha in order if indegree[sha] == 0]
+    if date_order:
+        queue = [(-dates[sha], i, sha) for i, sha in enumerate(ready)]
+        heapq.heapify(queue)
+    else:
+        queue = ready[::-1]
+    counter = len(ready)
+
+    while queue:
+        if date_order:
+            _, _, sha = heapq.heappop(queue)
+        else:
+            sha = queue.pop()
+        yield sha
+        for p in parents_of.pop(sha):
+            if p not in dates:
+                # Cut off by since
+                continue
+            indegree[p] -= 1
+            if indegree[p] == 0:
+                if date_order:
+                    heapq.heappush(queue, (-dates[p], counter, p))
+                    counter += 1
+                else:
+                    queue.append(p)
+
+# Colours of commit_paint
+PAINT_ONE = 1
+PAINT_TWO = 2
+PAINT_STALE = 4
+PAINT_RESULT = 8
+
+# Commits missing from the commit-graph have no generation number: they
+# are taken as newer than anything in it, as they usually are
+GENERATION_INFINITY = 0xffffffff
+
+def commit_paint(repo, one, twos, min_generation = 0, until_found = False):
+    """Paint what one reaches with PAINT_ONE and what the twos (a list)
+reach with PAINT_TWO, down to their common ancestors, like git's
+paint_down_to_common.  Returns (common ancestors found, flags), flags
+mapping the SHA of every commit seen to its colours.
+
+Commits come out of a priority queue, highest generation number first,
+then newest.  A commit that gets both colours is a common ancestor, and
+its own ancestors are painted stale: they can't be the best one.  The
+walk stops once the queue only holds stale commits, so nothing below the
+common ancestors is read.  It also stops at the first commit whose
+generation is below min_generation, which can't reach a commit of that
+generation, or, with until_found, as soon as one gets PAINT_TWO.
+
+Common ancestors painted stale after being found aren't best either, see
+commit_merge_bases."""
+    flags = dict()
+    queue = list()
+    counter = 0
+    # How many entries of the queue each commit has (it is pushed again
+    # when it gets a new colour), and how many entries aren't stale: the
+    # walk goes on while some aren't, and counting beats scanning the
+    # queue at every step
+    queued = dict()
+    nonstale = 0
+
+    def push(sha):
+        nonlocal counter, nonstale
+        _, parents, date, generation = commit_info(repo, sha)
+        heapq.heappush(queue, (-(generation or GENERATION_INFINITY), -date, counter, sha, parents))
+        counter += 1
+        queued[sha] = queued.get(sha, 0) + 1
+        if not flags[sha] & PAINT_STALE:
+            nonstale += 1
+
+    flags[one] = PAINT_ONE
+    push(one)
+    for sha in twos:
+        flags[sha] = flags.get(sha, 0) | PAINT_TWO
+        push(sha)
+
+    result = list()
+    while nonstale:
+        generation, _, _, sha, parents = heapq.heappop(queue)
+        queued[sha] -= 1
+        if not flags[sha] & PAINT_STALE:
+            nonstale -= 1
+        if -generation < min_generation:
+            break
+
+        paint = flags[sha] & (PAINT_ONE | PAINT_TWO | PAINT_STALE)
+        if paint == PAINT_ONE | PAINT_TWO:
+            if not flags[sha] & PAINT_RESULT:
+                flags[sha] |= PAINT_RESULT
+                result.append(sha)
+            paint |= PAINT_STALE
+
+        for p in parents:
+            old = flags.get(p, 0)
+            if old & paint == paint:
+                continue
+            if paint & PAINT_STALE and not old & PAINT_STALE:
+                # Its entries already in the queue turn stale too
+                nonstale -= queued.get(p, 0)
+            flags[p] = old | paint
+            push(p)
+
+        if until_found and flags[one] & PAINT_TWO:
+            break
+
+    return result, flags
+
+def commit_merge_bases(repo, one, twos):
+    """The best common ancestors of one and the twos: the common ancestors
+that aren't ancestors of other common ancestors.  Usually one, more after
+criss-cross merges.  Newest first."""
+    if one in twos:
+        return [one]
+
+    result, flags = commit_paint(repo, one, twos)
+    bases = [sha for sha in result if not flags[sha] & PAINT_STALE]
+    if len(bases) > 1:
+        # Walks in date order can find a base before another one it
+        # reaches, when commit dates are skewed
+        bases = [sha for sha in bases
+                 if not any(commit_is_ancestor(repo, sha, other) for other in bases if other != sha)]
+    return bases
+
+def commit_is_ancestor(repo, ancestor, commit):
+    """Whether ancestor is commit, or one of its ancestors.
+
+The walk goes down from commit and stops once ancestor is reached, or at
+the common ancestors of both.  With the commit-graph it stops earlier,
+at generation numbers below that of ancestor."""
+    if ancestor == commit:
+        return True
+    generation = commit_info(repo, ancestor)[3]
+    _, flags = commit_paint(repo, ancestor, [commit], min_generation = generation or 0,
+                            until_found = True)
+    return bool(flags.get(ancestor, 0) & PAINT_TWO)
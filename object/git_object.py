@@ -6,7 +6,7 @@ class GitObject (object):
         else:
             self.init()
 
-    def serialize(self, data):
+    def serialize(self):
         """This function MUST be implemented by subclasses.
 
 It must read the object's contents from self.data, a byte string, and
@@ -0,0 +1,105 @@
+import os
+from bisect import bisect_left
+from object.pack.pack_store import GitShaTable
+
+
+class GitPrefixIndex (object):
+    """Every object SHA of a repository, loose and packed, in one sorted
+table of 20-byte binary SHAs, to resolve abbreviated SHAs with bisect.
+
+Pack indexes already store their SHAs sorted, so their tables are copied
+as is; loose objects cost one listdir per objects/xx directory.  With a
+single pack and no loose objects there is nothing to merge.  Like in a
+pack index, fanout[i] is where SHAs starting with byte i start.
+
+This is a snapshot: objects written after it was built aren't in it, see
+object_match.  Like GitRefs, it keeps a stamp to tell: the mtime and
+inode of objects, objects/pack and every objects/xx directory, which
+writing an object or a pack changes."""
+
+    def __init__(self, repo):
+        tables = list()
+        objects = os.path.join(repo.gitdir, "objects")
+        dirs = [d for d in os.listdir(objects) if len(d) == 2] if os.path.isdir(objects) else []
+        # Taken before reading anything: an object written meanwhile
+        # makes the stamp stale rather than going unnoticed
+        self.stamp = prefix_stamp(objects, dirs)
+
+        repo.packs.scan()
+        for p in repo.packs.packs:
+            start = p.shas.start
+            tables.append(p.shas.buf[start:start + p.shas.count * 20])
+
+        loose = list()
+        for d in dirs:
+            for f in os.listdir(os.path.join(objects, d)):
+                if len(f) == 38:
+                    loose.append(bytes.fromhex(d + f))
+        loose.sort()
+        tables.append(b''.join(loose))
+
+        tables = [t for t in tables if t]
+        if len(tables) == 1:
+            buf = tables[0]
+        else:
+            # The same object can be in several packs, or packed and loose
+            shas = set()
+            for t in tables:
+                shas.update(t[i:i + 20] for i in range(0, len(t), 20))
+            buf = b''.join(sorted(shas))
+
+        self.shas = GitShaTable(buf, 0, len(buf) // 20)
+        self.fanout = [bisect_left(self.shas, bytes([i])) for i in range(256)]
+        self.fanout.append(len(self.shas))
+
+    def __len__(self):
+        return len(self.shas)
+
+    def match(self, prefix, limit = 2):
+        """The SHAs (hex) starting with prefix, an hex string of at least
+two digits.  At most limit are returned: two are enough to tell that an
+abbreviation is ambiguous."""
+        # Pad odd lengths: the smallest SHA that could match
+        odd = len(prefix) % 2
+        key = bytes.fromhex(prefix + "0" * odd)
+        whole = len(prefix) // 2
+        end = self.fanout[key[0] + 1]
+        i = bisect_left(self.shas, key, self.fanout[key[0]], end)
+
+        ret = list()
+        while i < end and len(ret) < limit:
+            sha = self.shas[i]
+            # Compare bytes, then the odd digit if there is one
+            if sha[:whole] != key[:whole] or (odd and sha[whole] >> 4 != key[whole] >> 4):
+                break
+            ret.append(sha.hex())
+            i += 1
+        return ret
+
+    def abbrev(self, sha, length = 7):
+        """The shortest prefix of sha, at least length digits long, that
+no other object shares."""
+        key = bytes.fromhex(sha)
+        i = bisect_left(self.shas, key, self.fanout[key[0]], self.fanout[key[0] + 1])
+        # Only the neighbours in sort order can share a longer prefix
+        for j in (i - 1, i + 1 if i < len(self.shas) and self.shas[i] == key else i):
+            if 0 <= j < len(self.shas):
+                other = self.shas[j].hex()
+                common = 0
+                while common < 40 and other[common] == sha[common]:
+                    common += 1
+                length = max(length, common + 1)
+        return sha[:min(length, 40)]
+
+
+def prefix_stamp(objects, dirs):
+    """(path, mtime_ns, inode) of the objects directory, its pack
+directory and the loose object directories dirs, for ref_stamp_current."""
+    ret = list()
+    for path in [objects, os.path.join(objects, "pack")] + [os.path.join(objects, d) for d in dirs]:
+        try:
+            st = os.stat(path)
+            ret.append((path, st.st_mtime_ns, st.st_ino))
+        except FileNotFoundError:
+            ret.append((path, None, None))
+    return ret
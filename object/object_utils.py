@@ -13,7 +13,13 @@ import hashlib
 import os
 import re
 import zlib
-from object.refs.refs_utils import ref_resolve
+from object.blob.blob_object import GitBlob
+from object.commit.commit_object import GitCommit
+from object.object_prefix import GitPrefixIndex
+from object.pack.pack_utils import pack_read
+from object.refs.refs_utils import GitTag, ref_resolve, ref_snapshot, ref_stamp_current
+from object.tree.tree_object import GitTree
+from repository.git_repository import GitRepository
 from repository.repo_utils import repo_dir, repo_file, repo_path
 
 
@@ -27,6 +33,71 @@ def object_read(repo, sha):
     sha[2:] = 73d1b7eaa0aa01b5bc2442d570a765bdaae751
     That is, the path to e673d1b7eaa0aa01b5bc2442d570a765bdaae751 is .git/objects/e6/73d1b7eaa0aa01b5bc2442d570a765bdaae751."""
 
+    raw = object_read_raw(repo, sha)
+    if raw is None:
+        return None
+    format, data = raw
+
+    #Pick constructor according to the type of the object
+    match format:
+        case b'commit' : c=GitCommit
+        case b'tree'   : c=GitTree
+        case b'blob'   : c=GitBlob
+        case b'tag'    : c=GitTag
+        case _         : raise Exception("Unknown object type: " + format.decode("ascii"))
+
+    return c(data)
+
+def object_read_raw(repo, sha):
+    """Read object sha as (format, data), without parsing it.  None if
+there is no such object."""
+    # Objects are immutable, so whatever we inflated before is still good.
+    raw = repo.objects.get(sha)
+    if raw is None:
+        # Packed objects first: on big repositories most objects live in packs.
+        raw = pack_read(repo, sha)
+        if raw is None:
+            raw = object_read_loose(repo, sha)
+            if raw is None:
+                return None
+        repo.objects.put(sha, raw, len(raw[1]))
+    return raw
+
+def object_exists(repo, sha):
+    return (sha in repo.objects
+            or repo.packs.find(bytes.fromhex(sha)) is not None
+            or os.path.exists(repo_path(repo, "objects", sha[0:2], sha[2:])))
+
+def object_info(repo, sha):
+    """(format, size) of object sha, or None if there is no such object.
+
+Cheaper than reading it: packed objects only have their headers parsed,
+loose ones are inflated just enough to read theirs."""
+    raw = repo.objects.get(sha)
+    if raw is not None:
+        return raw[0], len(raw[1])
+
+    info = repo.packs.info(bytes.fromhex(sha))
+    if info is not None:
+        return info
+
+    path = repo_path(repo, "objects", sha[0:2], sha[2:])
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        # "<type> <size>\0" fits in 32 bytes
+        head = zlib.decompressobj().decompress(f.read(512), 32)
+    x = head.find(b' ')
+    y = head.find(b'\x00', x)
+    if x < 0 or y < 0:
+        raise Exception("Malformed object " + sha)
+    return head[:x], int(head[x+1:y])
+
+def object_read_loose(repo, sha):
+    """Read a loose object, returning (format, data) or None if sha isn't
+stored as a loose file."""
     path = repo_path(repo, "objects", sha[0:2], sha[2:])
 
     if not os.path.exists(path):
@@ -51,49 +122,195 @@ def object_read(repo, sha):
         if(size != len(raw) - y -1):
             raise Exception("Object size mismatch: " + sha)
 
-
-        #Pick constructor according to the type of the object
-        match format:
-            case b'commit' : c=GitCommit
-            case b'tree'   : c=GitTree
-            case b'blob'   : c=GitBlob
-            case b'tag'    : c=GitTag
-            case _         : raise Exception("Unknown object type: " + format.decode("ascii"))
-
-        return c(raw[y+1:])
+        return format, raw[y+1:]
     
 
+# Objects are hashed and compressed this many bytes at a time
+CHUNK_SIZE = 1 << 20
+
 #now we will create how to write the object
 def object_write(obj, repo = None):
     #Serialize the object (encrypt it)
     data = obj.serialize()
 
-    result = obj.format + b' ' + str(len(data)).encode("ascii") + b'\x00' + data
+    return object_write_stream(obj.format, len(data), [data], repo)
+
+def object_hash(fd, format, repo = None):
+    """Hash the contents of file fd as an object of type format, and write
+it to repo if one is given.
+
+The file is never loaded whole: the object size comes from fstat() and the
+data is read, hashed and compressed CHUNK_SIZE bytes at a time."""
+    try:
+        size = os.fstat(fd.fileno()).st_size - fd.tell()
+        chunks = iter(lambda: fd.read(CHUNK_SIZE), b'')
+    except (AttributeError, OSError):
+        # Not a regular file (a pipe, say): we need the size before the
+        # first byte, so there is nothing to do but read it all.
+        data = fd.read()
+        size = len(data)
+        chunks = [data]
+
+    return object_write_stream(format, size, chunks, repo)
+
+def object_write_stream(format, size, chunks, repo = None):
+    """Hash an object of type format whose size bytes of content come from
+the iterable chunks, and write it to repo if one is given.
+
+Every chunk goes both into the SHA-1 and into a zlib compressor writing to
+a temporary file in the objects directory.  Once the SHA is known, the
+file is renamed into place, so readers never see a partial object."""
+    header = format + b' ' + str(size).encode("ascii") + b'\x00'
 
     #Compute the sha1 hash of the object
-    sha = hashlib.sha1(result).hexdigest()
+    sha = hashlib.sha1(header)
 
     if repo:
-        #If there is a repository, we will create a path for it
-        path = repo_file(repo, "objects", sha[0:2], sha[2:], mkdir = True)
-
-        #If the path doesn't exist, we will create it
-        #and write the object to it
-        #The path is the sha1 hash of the object
-        if not os.path.exists(path):
-            with open(path, "wb") as f:
-                f.write(zlib.compress(result))
-        
+        # Only writes need it: keep it off the read-only commands' startup
+        import tempfile
+        tmp = tempfile.NamedTemporaryFile(dir=repo_dir(repo, "objects", mkdir = True),
+                                          prefix="tmp_obj_", delete=False)
+        z = zlib.compressobj()
+        tmp.write(z.compress(header))
+
+    try:
+        total = 0
+        for chunk in chunks:
+            sha.update(chunk)
+            total += len(chunk)
+            if repo:
+                tmp.write(z.compress(chunk))
+
+        if total != size:
+            raise Exception(f"Object size changed while hashing: expected {size}, got {total}")
+
+        sha = sha.hexdigest()
+
+        if repo:
+            tmp.write(z.flush())
+            tmp.close()
+
+            #If there is a repository, we will create a path for it
+            #The path is the sha1 hash of the object
+            path = repo_file(repo, "objects", sha[0:2], sha[2:], mkdir = True)
+
+            if os.path.exists(path):
+                os.unlink(tmp.name)
+            else:
+                # Objects are read-only, as in git
+                os.chmod(tmp.name, 0o444)
+                os.replace(tmp.name, path)
+    except BaseException:
+        if repo:
+            tmp.close()
+            os.unlink(tmp.name)
+        raise
+
     return sha
 
-def object_find(repo, name, format=None, follow=True):
-    return name
+# Each worker process of object_hash_paths opens the repository once and
+# keeps it here
+worker_repo = None
+
+def object_hash_worker_init(worktree):
+    global worker_repo
+    worker_repo = GitRepository(worktree) if worktree else None
+
+def object_hash_path(path, format):
+    with open(path, "rb") as f:
+        return object_hash(f, format, worker_repo)
+
+def object_hash_paths(paths, format, repo = None, jobs = None):
+    """Hash (and write to repo, if given) every file in paths, yielding
+their SHAs in the same order as paths.
+
+SHA-1 and zlib are CPU bound, so the work is spread over a pool of jobs
+processes (one per CPU by default).  Each worker writes its loose objects
+itself: object_write_stream renames them into place atomically, so two
+workers hashing identical files is harmless."""
+    paths = list(paths)
+    jobs = jobs or os.cpu_count() or 1
+
+    if jobs == 1 or len(paths) < 2:
+        object_hash_worker_init(repo.worktree if repo else None)
+        for path in paths:
+            yield object_hash_path(path, format)
+        return
+
+    # A process pool costs tens of milliseconds to import alone
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools import repeat
+
+    # Batch paths so the pool isn't dominated by pickling overhead on
+    # trees with lots of small files
+    chunksize = max(1, min(256, len(paths) // (jobs * 8)))
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=object_hash_worker_init,
+                             initargs=(repo.worktree if repo else None,)) as ex:
+        yield from ex.map(object_hash_path, paths, repeat(format), chunksize=chunksize)
 
-def object_resolve(repo, name):
+def object_match(repo, prefix):
+    """The SHAs of the objects whose SHA starts with prefix (at most two),
+from the repository's GitPrefixIndex.
+
+The index is a snapshot, built on first use.  If nothing matches, the
+object may be newer than the index: it is rebuilt and asked again, but
+only if objects were written since, see GitPrefixIndex.stamp.  Names that
+just aren't SHAs, like a branch called cafe, only cost a stat() per
+objects directory."""
+    index = repo.prefixes
+    if index is not None:
+        found = index.match(prefix)
+        if found or ref_stamp_current(index.stamp):
+            return found
+    repo.prefixes = GitPrefixIndex(repo)
+    return repo.prefixes.match(prefix)
+
+def object_abbrev(repo, sha, length = 7):
+    """The shortest unique abbreviation of sha, at least length digits."""
+    if repo.prefixes is None:
+        repo.prefixes = GitPrefixIndex(repo)
+    return repo.prefixes.abbrev(sha, length)
+
+def object_find(repo, name, format=None, follow=True, refs=None):
+    """Resolve name (see object_resolve) to a SHA.
+
+With format, follow tags (and commits, to their tree) until an object of
+that type is found; None if follow is False or there is none."""
+    candidates = object_resolve(repo, name, refs)
+    if not candidates or candidates[0] is None:
+        raise Exception(f"No such reference {name}.")
+    if len(candidates) > 1:
+        raise Exception(f"Ambiguous reference {name}: Candidates are:\n - {'\n - '.join(candidates)}.")
+
+    sha = candidates[0]
+    if not format:
+        return sha
+
+    while True:
+        obj = object_read(repo, sha)
+        if obj is None:
+            raise Exception(f"Missing object {sha}")
+        if obj.format == format:
+            return sha
+        if not follow:
+            return None
+
+        # Follow tags
+        if obj.format == b'tag':
+            sha = obj.kvlm[b'object'].decode("ascii")
+        elif obj.format == b'commit' and format == b'tree':
+            sha = obj.kvlm[b'tree'].decode("ascii")
+        else:
+            return None
+
+def object_resolve(repo, name, refs=None):
     """If name is HEAD, it will just resolve .git/HEAD;
     If name is a full hash, this hash is returned unmodified.
     If name looks like a short hash, it will collect objects whose full hash begin with this short hash.
-    At last, it will resolve tags and branches matching name."""
+    At last, it will resolve tags and branches matching name.
+
+    refs is a ref snapshot to use, when resolving many names in a row."""
 
     """This function is aware of :
     -the HEAD literal
@@ -112,28 +329,21 @@ def object_resolve(repo, name):
     if name == "HEAD":
         return [ref_resolve(repo, "HEAD")]
     
-    #If it's a hex string, try for a full hash
+    #If it's a hex string, look it up in the packs and loose objects
     if hashRE.match(name):
-        name = name.lower()
-        prefix = name[0:2]
-        path = repo_dir(repo, "objects", prefix, mkdir=False)
-        if path:
-            rem = name[2:]
-            for f in os.listdir(path):
-                if f.startswith(rem):
-                    candidates.append(prefix + f)
-    
-       # Try for references.
-    as_tag = ref_resolve(repo, "refs/tags/" + name)
-    if as_tag: # Did we find a tag?
-        candidates.append(as_tag)
-
-    as_branch = ref_resolve(repo, "refs/heads/" + name)
-    if as_branch: # Did we find a branch?
-        candidates.append(as_branch)
-
-    as_remote_branch = ref_resolve(repo, "refs/remotes/" + name)
-    if as_remote_branch: # Did we find a remote branch?
-        candidates.append(as_remote_branch)
+        if len(name) == 40:
+            # No need for the prefix index, nor to rebuild it if missing
+            if object_exists(repo, name.lower()):
+                candidates.append(name.lower())
+        else:
+            candidates.extend(object_match(repo, name.lower()))
+
+    # Try for references.  One snapshot answers all the lookups.
+    if refs is None:
+        refs = ref_snapshot(repo)
+    for namespace in ("", "refs/", "refs/tags/", "refs/heads/", "refs/remotes/"):
+        sha = refs.get(namespace + name)
+        if sha: # Did we find a tag, a branch, a remote branch?
+            candidates.append(sha)
 
     return candidates
\ No newline at end of file
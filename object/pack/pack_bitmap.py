@@ -0,0 +1,366 @@
+"""Reachability bitmaps: pack-XXXX.bitmap, next to the pack it describes.
+
+For some commits, the bitmap file stores which objects of the pack they
+reach: bit i is set when the i-th object of the pack (in pack order, by
+offset) is reachable.  "What does X reach that Y doesn't" then becomes
+bits(X) & ~bits(Y), instead of a walk through every commit and tree.
+
+Same format as git (version 1), so either can read the other's:
+    - header: b'BITM', version (1), options (FULL_DAG, plus HASH_CACHE
+      when there is a name-hash cache), number of entries, SHA-1 of the
+      pack
+    - four EWAH bitmaps, the objects of each type: commits, trees,
+      blobs, tags
+    - per entry: the position of its commit in the .idx (uint32), an
+      XOR offset and flags (one byte each), and an EWAH bitmap.  With an
+      XOR offset of n, the real bitmap is that one XORed with the real
+      bitmap of the entry n places before
+    - with HASH_CACHE, the name hash (see pack_name_hash) of every
+      object, in pack order, as uint32s
+    - SHA-1 of everything above
+
+An EWAH bitmap is its size in bits and number of 64-bit words (uint32
+each), the words, then the position of the last marker word (uint32).
+Words are markers followed by literals: a marker holds a running bit
+(bit 0), the number of words that are all that bit (bits 1 to 32) and
+the number of literal words that follow it (bits 33 to 63).  Long runs
+of all-0 or all-1 words thus cost one marker.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+from object.commit.commit_graph import commit_graph_tips, commit_info
+from object.commit.commit_walk import commit_walk_topo
+from object.object_utils import object_info, object_read_raw
+from object.pack.pack_store import GitPack
+from object.tree.tree_diff import tree_leaf_is_tree
+from object.tree.tree_utils import tree_parse
+
+
+BITMAP_SIGNATURE = b'BITM'
+BITMAP_OPT_FULL_DAG = 1
+BITMAP_OPT_HASH_CACHE = 4
+
+# Which commits get a bitmap, on top of every ref tip: the most recent
+# ones, which queries are mostly about, then one in BITMAP_INTERVAL.
+# Walks from the others stop at the nearest ones.
+BITMAP_RECENT = 100
+BITMAP_INTERVAL = 100
+
+EWAH_ONES = 0xffffffffffffffff
+EWAH_RUN_MAX = 0xffffffff
+EWAH_LITERAL_MAX = 0x7fffffff
+
+
+def ewah_encode(bits, size):
+    """bits, an int whose bit i is bit i of the bitmap, serialized as an
+EWAH bitmap of size bits."""
+    count = (size + 63) // 64
+    words = struct.unpack(f"<{count}Q", bits.to_bytes(count * 8, "little"))
+
+    out = list()
+    rlw = 0
+    i = 0
+    while i < count or not out:
+        # A marker: a run of clean words, then literals until the next
+        # clean word
+        run = 0
+        bit = 0
+        if i < count and words[i] in (0, EWAH_ONES):
+            word = words[i]
+            bit = word & 1
+            while i < count and words[i] == word and run < EWAH_RUN_MAX:
+                run += 1
+                i += 1
+        start = i
+        while i < count and words[i] not in (0, EWAH_ONES) and i - start < EWAH_LITERAL_MAX:
+            i += 1
+
+        rlw = len(out)
+        out.append(bit | run << 1 | (i - start) << 33)
+        out.extend(words[start:i])
+
+    return struct.pack(f">II{len(out)}QI", size, len(out), *out, rlw)
+
+def ewah_decode(buf, pos):
+    """The EWAH bitmap serialized at pos in buf, as (int, position after
+it)."""
+    size, count = struct.unpack_from(">II", buf, pos)
+    words = struct.unpack_from(f">{count}Q", buf, pos + 8)
+
+    out = list()
+    i = 0
+    while i < count:
+        rlw = words[i]
+        run = (rlw >> 1) & EWAH_RUN_MAX
+        literals = rlw >> 33
+        if run:
+            out.append((b'\xff' if rlw & 1 else b'\x00') * (run * 8))
+        out.append(struct.pack(f"<{literals}Q", *words[i + 1:i + 1 + literals]))
+        i += 1 + literals
+
+    # Runs of ones can go past the last object
+    bits = int.from_bytes(b''.join(out), "little") & ((1 << size) - 1)
+    return bits, pos + 12 + count * 8
+
+
+class GitPackBitmap (object):
+    """The bitmaps of one pack, mmapped.  Bitmaps are Python ints, bit i
+being the i-th object of the pack.
+
+Entries are decoded on first use and kept.  Built with load=False, this
+is an empty set of bitmaps for pack, to be filled and written by
+bitmap_write."""
+
+    def __init__(self, pack, load = True):
+        self.pack = pack
+        self.count = pack.count
+        self.buf = None
+        # commit SHA (hex) -> bitmap, once decoded
+        self.bitmaps = dict()
+        # commit SHA (hex) -> position in entries
+        self.index = dict()
+        # (position of the EWAH in buf, XOR offset, commit SHA)
+        self.entries = list()
+        self.commits = self.trees = self.blobs = self.tags = 0
+
+        # The index sorts objects by SHA; bits follow the pack order.
+        # order[i] is the index position of the i-th object of the pack,
+        # positions the reverse.
+        offsets = struct.unpack_from(f">{self.count}I", pack.idx, pack.offsets)
+        if offsets and max(offsets) & 0x80000000:
+            offsets = [pack.offset(i) for i in range(self.count)]
+        self.order = sorted(range(self.count), key=offsets.__getitem__)
+        self.positions = array("I", bytes(4 * self.count))
+        for i, pos in enumerate(self.order):
+            self.positions[pos] = i
+
+        if load:
+            self.load(pack.path + ".bitmap")
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self.buf
+
+        signature, version, options, count = struct.unpack_from(">4sHHI", buf, 0)
+        if signature != BITMAP_SIGNATURE:
+            raise Exception("Not a bitmap file: " + path)
+        if version != 1:
+            raise Exception("Unsupported bitmap version: " + str(version))
+        if not options & BITMAP_OPT_FULL_DAG:
+            raise Exception("Bitmap doesn't cover everything reachable: " + path)
+        if buf[12:32] != self.pack.pack[-20:]:
+            raise Exception("Bitmap doesn't match its pack: " + path)
+
+        pos = 32
+        self.commits, pos = ewah_decode(buf, pos)
+        self.trees, pos = ewah_decode(buf, pos)
+        self.blobs, pos = ewah_decode(buf, pos)
+        self.tags, pos = ewah_decode(buf, pos)
+
+        for i in range(count):
+            idx, xor, flags = struct.unpack_from(">IBB", buf, pos)
+            sha = self.pack.shas[idx].hex()
+            self.index[sha] = i
+            self.entries.append((pos + 6, xor, sha))
+            # Skip the EWAH without decoding it
+            pos += 6 + 12 + struct.unpack_from(">I", buf, pos + 10)[0] * 8
+
+    def close(self):
+        if self.buf is not None:
+            self.buf.close()
+
+    def position(self, sha):
+        """Position of object sha (hex) in the pack order, or None."""
+        pos = self.pack.position(bytes.fromhex(sha))
+        return None if pos is None else self.positions[pos]
+
+    def sha(self, pos):
+        """SHA (hex) of the object at pos in the pack order."""
+        return self.pack.shas[self.order[pos]].hex()
+
+    def get(self, sha):
+        """The bitmap of commit sha (hex), or None if it has none."""
+        bits = self.bitmaps.get(sha)
+        if bits is not None or sha not in self.index:
+            return bits
+
+        # Follow the XOR offsets back to a plain or known entry, then
+        # apply them forward
+        chain = list()
+        i = self.index[sha]
+        bits = 0
+        while True:
+            pos, xor, entry = self.entries[i]
+            if entry in self.bitmaps:
+                bits = self.bitmaps[entry]
+                break
+            chain.append((pos, entry))
+            if not xor:
+                break
+            i -= xor
+        for pos, entry in reversed(chain):
+            bits ^= ewah_decode(self.buf, pos)[0]
+            self.bitmaps[entry] = bits
+        return bits
+
+    def shas(self, bits):
+        """The SHAs (hex) of the objects set in bits, in pack order."""
+        for i, byte in enumerate(bits.to_bytes((self.count + 7) // 8, "little")):
+            while byte:
+                low = byte & -byte
+                yield self.sha(i * 8 + low.bit_length() - 1)
+                byte ^= low
+
+
+def bitmap_open(repo):
+    """The bitmaps of the repository, or None if no pack has any.  Like
+git, only one pack's are used: the first found."""
+    repo.packs.scan()
+    for pack in repo.packs.packs:
+        if pack.bitmap is None:
+            pack.bitmap = os.path.exists(pack.path + ".bitmap") and GitPackBitmap(pack)
+        if pack.bitmap:
+            return pack.bitmap
+    return None
+
+def bitmap_walk(repo, bitmap, tips, bits = 0, seen = None):
+    """Every object reachable from tips (hex SHAs), as (bits, seen): bits
+has the bit of every object reached in bitmap's pack, seen maps the
+SHAs of the others (all of them, when bitmap is None) to their type.
+
+Objects already in bits or seen are taken as walked, along with all they
+reach: pass in the result of another walk to only add what it misses.
+
+Commits are walked first, stopping at those that have a bitmap, which is
+ORed in whole.  Then come the trees of the commits that had none,
+skipping whatever is already set."""
+    seen = dict() if seen is None else seen
+    size = (bitmap.count + 7) // 8 if bitmap else 0
+    found = bytearray(bits.to_bytes(size, "little"))
+
+    trees = list()
+    stack = [(sha, None) for sha in tips]
+    while stack:
+        sha, format = stack.pop()
+        pos = bitmap.position(sha) if bitmap else None
+        if pos is None:
+            if sha in seen:
+                continue
+        elif found[pos >> 3] >> (pos & 7) & 1:
+            continue
+        else:
+            have = bitmap.get(sha)
+            if have is not None:
+                found = bytearray((int.from_bytes(found, "little") | have).to_bytes(size, "little"))
+                continue
+
+        if format is None:
+            info = object_info(repo, sha)
+            if info is None:
+                raise Exception("Missing object: " + sha)
+            format = info[0]
+
+        if format in (b'tree', b'blob'):
+            # Tags can point to those: leave them to the second pass
+            trees.append((sha, format))
+            continue
+
+        if pos is None:
+            seen[sha] = format
+        else:
+            found[pos >> 3] |= 1 << (pos & 7)
+
+        if format == b'commit':
+            tree, parents, _, _ = commit_info(repo, sha)
+            stack.extend((p, b'commit') for p in parents)
+            trees.append((tree, b'tree'))
+        elif format == b'tag':
+            stack.append((object_read_raw(repo, sha)[1][7:47].decode("ascii"), None))
+
+    stack = trees
+    while stack:
+        sha, format = stack.pop()
+        pos = bitmap.position(sha) if bitmap else None
+        if pos is None:
+            if sha in seen:
+                continue
+            seen[sha] = format
+        elif found[pos >> 3] >> (pos & 7) & 1:
+            continue
+        else:
+            found[pos >> 3] |= 1 << (pos & 7)
+
+        if format == b'tree':
+            raw = object_read_raw(repo, sha)
+            if raw is None:
+                raise Exception("Missing object: " + sha)
+            for leaf in tree_parse(raw[1]):
+                # Submodule commits live in another repository
+                if leaf.mode != b'160000':
+                    stack.append((leaf.sha, b'tree' if tree_leaf_is_tree(leaf) else b'blob'))
+
+    return int.from_bytes(found, "little"), seen
+
+def bitmap_reachable(repo, bitmap, tips, exclude = ()):
+    """The objects reachable from tips but not from exclude, as (bits,
+seen), see bitmap_walk.  With bitmap None, this is a plain walk."""
+    bits, seen = bitmap_walk(repo, bitmap, exclude)
+    have, found = bitmap_walk(repo, bitmap, tips, bits, dict(seen))
+    return have & ~bits, { sha: format for sha, format in found.items() if sha not in seen }
+
+def bitmap_write(repo, path, objects):
+    """Write the bitmaps of the pack at path (without extension), just
+written by pack_write from objects, sorted as in the pack.
+
+Every commit pointed to by a ref gets a bitmap, as do the BITMAP_RECENT
+most recent commits and one older commit in BITMAP_INTERVAL.  Commits are
+done parents first, so each walk stops at the bitmaps of the nearest
+ancestors.  Returns the number of bitmaps."""
+    pack = GitPack(path)
+    try:
+        bitmap = GitPackBitmap(pack, load=False)
+
+        types = { format: bytearray((pack.count + 7) // 8)
+                  for format in (b'commit', b'tree', b'blob', b'tag') }
+        hashes = [0] * pack.count
+        for sha, format, size, hash in objects:
+            pos = bitmap.position(sha)
+            types[format][pos >> 3] |= 1 << (pos & 7)
+            hashes[pos] = hash
+
+        tips = commit_graph_tips(repo)
+        # Children first
+        order = list(commit_walk_topo(repo, tips))
+        selected = [sha for i, sha in enumerate(order)
+                    if sha in tips or i < BITMAP_RECENT or i % BITMAP_INTERVAL == 0]
+        for sha in reversed(selected):
+            bits, seen = bitmap_walk(repo, bitmap, [sha])
+            if seen:
+                # Written since the pack was: not all in there
+                continue
+            bitmap.bitmaps[sha] = bits
+
+        out = [struct.pack(">4sHHI", BITMAP_SIGNATURE, 1,
+                           BITMAP_OPT_FULL_DAG | BITMAP_OPT_HASH_CACHE, len(bitmap.bitmaps)),
+               pack.pack[-20:]]
+        for format in (b'commit', b'tree', b'blob', b'tag'):
+            out.append(ewah_encode(int.from_bytes(types[format], "little"), pack.count))
+        for sha, bits in bitmap.bitmaps.items():
+            out.append(struct.pack(">IBB", pack.position(bytes.fromhex(sha)), 0, 0))
+            out.append(ewah_encode(bits, pack.count))
+        out.append(struct.pack(f">{pack.count}I", *hashes))
+        data = b''.join(out)
+        data += hashlib.sha1(data).digest()
+
+        with open(path + ".bitmap.tmp", "wb") as f:
+            f.write(data)
+        os.chmod(path + ".bitmap.tmp", 0o444)
+        os.replace(path + ".bitmap.tmp", path + ".bitmap")
+        return len(bitmap.bitmaps)
+    finally:
+        pack.close()
@@ -0,0 +1,236 @@
+"""Receive a packfile from a stream, as a fetch does, and index it while
+it is still arriving, like git index-pack --stdin.
+
+Entries are parsed as soon as their bytes are in.  Whole objects are
+hashed right away, and so are deltas whose base was already seen, which
+is every OFS_DELTA (the base always comes first).  Only a REF_DELTA to a
+base further down the stream waits for the end.  The stream is copied to
+a temporary file as it comes, which is what bases that dropped out of
+the cache are rebuilt from.  Once the trailing checksum checks out, the
+.idx is written and the pair is renamed into objects/pack.
+"""
+
+import hashlib
+import os
+import tempfile
+import zlib
+from object.object_cache import GitObjectCache
+from object.pack.pack_utils import (OBJ_OFS_DELTA, OBJ_REF_DELTA, PACK_TYPES, delta_apply,
+                                    pack_entry_header, pack_ofs_delta_offset)
+from object.pack.pack_write import pack_index
+from repository.repo_utils import repo_config_size, repo_dir
+
+
+# Bytes asked of the stream at a time
+RECEIVE_CHUNK = 1 << 16
+
+
+class GitPackReceiver (object):
+    """The state of one pack being received from input, a binary file.
+
+Bytes come in through fill() and go out through take(), which keeps the
+checksum of the pack and the CRC of the current entry.  entries holds,
+per offset, what rebuilding the object there from the file needs:
+(type, data offset, data end, base), base being the offset or binary SHA
+of a delta's base."""
+
+    def __init__(self, repo, input, data = b''):
+        self.repo = repo
+        self.read = getattr(input, "read1", input.read)
+        self.buf = bytearray(data)
+        # Position of the next byte to parse in buf, and offset in the
+        # pack of buf[0]
+        self.start = 0
+        self.base = 0
+        self.checksum = hashlib.sha1()
+        self.crc = 0
+
+        self.offsets = list()
+        self.crcs = list()
+        self.shas = list()
+        self.entries = dict()
+        # Binary SHA -> offset, for REF_DELTA bases
+        self.by_sha = dict()
+        # Offset -> index in shas of the deltas whose base wasn't known
+        # yet when they came: REF_DELTAs to a base further down the pack
+        self.deferred = dict()
+        self.cache = GitObjectCache(repo_config_size(repo, "deltabasecachelimit", 16 << 20))
+
+        path = repo_dir(repo, "objects", "pack", mkdir=True)
+        self.fd, self.path = tempfile.mkstemp(dir=path, prefix="tmp_pack_")
+        os.write(self.fd, data)
+
+    def fill(self, n):
+        """Read until at least n bytes wait to be parsed, or the stream
+ends.  Returns how many do."""
+        while len(self.buf) - self.start < n:
+            chunk = self.read(RECEIVE_CHUNK)
+            if not chunk:
+                break
+            os.write(self.fd, chunk)
+            if self.start >= RECEIVE_CHUNK:
+                del self.buf[:self.start]
+                self.base += self.start
+                self.start = 0
+            self.buf += chunk
+        return len(self.buf) - self.start
+
+    def take(self, n):
+        if self.fill(n) < n:
+            raise Exception("Truncated pack")
+        data = self.buf[self.start:self.start + n]
+        self.start += n
+        self.checksum.update(data)
+        self.crc = zlib.crc32(data, self.crc)
+        return data
+
+    def offset(self):
+        return self.base + self.start
+
+    def receive_entry(self):
+        offset = self.offset()
+        self.crc = 0
+        # An entry header, with the base of a delta, fits in 32 bytes
+        self.fill(32)
+        try:
+            type, size, pos = pack_entry_header(self.buf, self.start)
+            base = None
+            if type == OBJ_OFS_DELTA:
+                distance, pos = pack_ofs_delta_offset(self.buf, pos)
+                base = offset - distance
+            elif type == OBJ_REF_DELTA:
+                base = bytes(self.buf[pos:pos + 20])
+                pos += 20
+        except IndexError:
+            raise Exception("Truncated pack")
+        if type not in PACK_TYPES and base is None:
+            raise Exception("Unknown pack object type: " + str(type))
+        self.take(pos - self.start)
+
+        data_offset = self.offset()
+        d = zlib.decompressobj()
+        out = list()
+        # As in pack_inflate, zlib gets bounded slices: what follows the
+        # stream would otherwise be copied into unused_data
+        step = size + (size >> 10) + 64
+        while not d.eof:
+            if self.fill(1) == 0:
+                raise Exception("Truncated pack")
+            piece = self.buf[self.start:self.start + step]
+            out.append(d.decompress(piece))
+            self.take(len(piece) - len(d.unused_data))
+        data = b''.join(out)
+        if len(data) != size:
+            raise Exception("Pack entry size mismatch")
+
+        self.offsets.append(offset)
+        self.crcs.append(self.crc)
+        self.entries[offset] = (type, data_offset, self.offset(), base)
+
+        if base is None:
+            sha = self.resolved(offset, PACK_TYPES[type], data)
+        elif self.ready(base):
+            format, base_data = self.object_at(self.base_offset(base))
+            sha = self.resolved(offset, format, delta_apply(base_data, data))
+        else:
+            sha = None
+            self.deferred[offset] = len(self.shas)
+        self.shas.append(sha)
+
+    def ready(self, base):
+        """Whether the base of a delta, an offset or a binary SHA, is known."""
+        if isinstance(base, int):
+            return base not in self.deferred
+        return base in self.by_sha
+
+    def base_offset(self, base):
+        return base if isinstance(base, int) else self.by_sha[base]
+
+    def resolved(self, offset, format, data):
+        """Record the object at offset, and return its binary SHA."""
+        sha = hashlib.sha1(b'%s %d\x00' % (format, len(data)) + data).digest()
+        self.by_sha[sha] = offset
+        self.cache.put(offset, (format, data), len(data))
+        return sha
+
+    def object_at(self, offset):
+        """(format, data) of the object at offset, which must be resolved.
+Deltas are rebuilt from the file, down to the nearest cached base."""
+        deltas = list()
+        while True:
+            hit = self.cache.get(offset)
+            if hit is not None:
+                format, data = hit
+                break
+            type, start, end, base = self.entries[offset]
+            raw = zlib.decompress(os.pread(self.fd, end - start, start))
+            if base is None:
+                format, data = PACK_TYPES[type], raw
+                break
+            deltas.append(raw)
+            offset = self.base_offset(base)
+        for delta in reversed(deltas):
+            data = delta_apply(data, delta)
+        return format, data
+
+    def resolve_deferred(self):
+        """Resolve the deltas whose base came after them: REF_DELTAs, and
+whatever was deltified against those."""
+        while self.deferred:
+            left = dict()
+            for offset, i in self.deferred.items():
+                type, start, end, base = self.entries[offset]
+                if not self.ready(base):
+                    left[offset] = i
+                    continue
+                format, base_data = self.object_at(self.base_offset(base))
+                delta = zlib.decompress(os.pread(self.fd, end - start, start))
+                self.shas[i] = self.resolved(offset, format, delta_apply(base_data, delta))
+            if len(left) == len(self.deferred):
+                # Its base isn't in the pack: a thin pack, which we never ask for
+                raise Exception("Missing delta base in pack")
+            self.deferred = left
+
+def pack_receive(repo, input, data = b''):
+    """Read a pack from input and store it, indexed, in objects/pack.
+data is the start of the pack, if some of it was already read.  Returns
+(number of objects, pack path without extension); the path is None for
+an empty pack, which isn't kept."""
+    r = GitPackReceiver(repo, input, data)
+    try:
+        header = r.take(12)
+        if header[:4] != b'PACK':
+            raise Exception("Not a pack: " + repr(bytes(header[:4])))
+        version = int.from_bytes(header[4:8], "big")
+        if version not in (2, 3):
+            raise Exception("Unsupported pack version: " + str(version))
+        count = int.from_bytes(header[8:12], "big")
+
+        for _ in range(count):
+            r.receive_entry()
+        checksum = r.checksum.digest()
+        if r.fill(20) < 20 or bytes(r.buf[r.start:r.start + 20]) != checksum:
+            raise Exception("Pack checksum mismatch")
+        r.resolve_deferred()
+    except BaseException:
+        os.close(r.fd)
+        os.unlink(r.path)
+        raise
+
+    os.close(r.fd)
+    if count == 0:
+        os.unlink(r.path)
+        return 0, None
+
+    name = os.path.join(os.path.dirname(r.path), "pack-" + checksum.hex())
+    objects = [(sha.hex(),) for sha in r.shas]
+    with open(name + ".idx.tmp", "wb") as f:
+        f.write(pack_index(objects, r.offsets, r.crcs, checksum))
+    os.chmod(r.path, 0o444)
+    os.replace(r.path, name + ".pack")
+    os.chmod(name + ".idx.tmp", 0o444)
+    os.replace(name + ".idx.tmp", name + ".idx")
+
+    repo.packs.scan()
+    repo.prefixes = None
+    return count, name
@@ -0,0 +1,253 @@
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left
+from object.pack.pack_utils import (OBJ_OFS_DELTA, OBJ_REF_DELTA, PACK_TYPES,
+                                    delta_apply, pack_delta_size, pack_entry_header,
+                                    pack_inflate, pack_ofs_delta_offset)
+
+
+IDX_MAGIC = b'\377tOc'
+
+
+class GitShaTable (object):
+    """Sequence view over the sorted SHA table of an mmapped index, so we
+can hand it straight to bisect without building a list."""
+
+    def __init__(self, buf, start, count):
+        self.buf = buf
+        self.start = start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        pos = self.start + i * 20
+        return self.buf[pos:pos + 20]
+
+
+class GitPack (object):
+    """One .pack/.idx pair, both mmapped for the lifetime of the object."""
+
+    # Its GitPackBitmap, opened on first use (False if there is none)
+    bitmap = None
+    # Every entry offset, sorted, built on first use by end()
+    ends = None
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path + ".idx", "rb") as f:
+            self.idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(path + ".pack", "rb") as f:
+            self.pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Zero-copy view: slicing this doesn't copy the pack
+        self.data = memoryview(self.pack)
+
+        if self.idx[0:4] != IDX_MAGIC:
+            raise Exception("Unsupported pack index (version 1?): " + path)
+        version = struct.unpack_from(">I", self.idx, 4)[0]
+        if version != 2:
+            raise Exception("Unsupported pack index version: " + str(version))
+
+        # The fanout table is tiny, decode it once.  fanout[i] is the
+        # number of objects whose first SHA byte is <= i.
+        self.fanout = struct.unpack_from(">256I", self.idx, 8)
+        self.count = self.fanout[255]
+        self.shas = GitShaTable(self.idx, 8 + 256 * 4, self.count)
+        self.offsets = 8 + 256 * 4 + self.count * 24
+        self.large_offsets = self.offsets + self.count * 4
+
+    def close(self):
+        if self.bitmap:
+            self.bitmap.close()
+        self.data.release()
+        self.pack.close()
+        self.idx.close()
+
+    def position(self, sha):
+        """Return the position of binary sha in the index, or None."""
+        first = sha[0]
+        lo = self.fanout[first - 1] if first else 0
+        hi = self.fanout[first]
+        pos = bisect_left(self.shas, sha, lo, hi)
+        if pos < hi and self.shas[pos] == sha:
+            return pos
+        return None
+
+    def lookup(self, sha):
+        """Return the pack offset of binary sha, or None."""
+        pos = self.position(sha)
+        return None if pos is None else self.offset(pos)
+
+    def offset(self, pos):
+        """Return the pack offset of the pos-th object of the index."""
+        offset = struct.unpack_from(">I", self.idx, self.offsets + pos * 4)[0]
+        if offset & 0x80000000:
+            # Packs bigger than 2GB keep large offsets in a separate table
+            offset = struct.unpack_from(">Q", self.idx, self.large_offsets + (offset & 0x7fffffff) * 8)[0]
+        return offset
+
+    def end(self, offset):
+        """Where the entry at offset ends: the offset of the next entry, or
+of the trailing checksum.  Lets an entry be copied as is."""
+        if self.ends is None:
+            ends = sorted(self.offset(i) for i in range(self.count))
+            ends.append(len(self.pack) - 20)
+            self.ends = ends
+        return self.ends[bisect_left(self.ends, offset + 1)]
+
+
+class GitPackStore (object):
+    """Every pack of a repository.
+
+Packs are opened on first use and stay mapped.  When a lookup misses and
+the pack directory changed since we last listed it (a gc or fetch ran),
+we pick up the new packs and retry.
+
+base_cache, if given, is a GitObjectCache holding delta bases keyed by
+(pack path, offset): objects deltified against the same base (typically
+successive versions of one file) then only inflate that base once."""
+
+    def __init__(self, path, base_cache = None):
+        self.path = path
+        self.base_cache = base_cache
+        self.packs = None
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def scan(self):
+        with self.lock:
+            return self.scan_locked()
+
+    def scan_locked(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if self.packs is not None and mtime == self.mtime:
+            return False
+
+        old = dict()
+        if self.packs:
+            old = { p.path: p for p in self.packs }
+
+        packs = list()
+        if mtime is not None:
+            for f in sorted(os.listdir(self.path)):
+                base = os.path.join(self.path, f[:-4])
+                if f.endswith(".idx") and os.path.exists(base + ".pack"):
+                    packs.append(old.pop(base, None) or GitPack(base))
+
+        for p in old.values():
+            p.close()
+
+        self.packs = packs
+        self.mtime = mtime
+        return True
+
+    def find(self, sha):
+        """Return (pack, offset) for binary sha, or None."""
+        if self.packs is None:
+            self.scan()
+        for p in self.packs:
+            offset = p.lookup(sha)
+            if offset is not None:
+                return p, offset
+        if self.scan():
+            return self.find(sha)
+        return None
+
+    def read(self, sha):
+        """Read binary sha.  Returns (format, data) or None."""
+        found = self.find(sha)
+        if found is None:
+            return None
+        return self.read_at(*found)
+
+    def info(self, sha):
+        """(format, size) of binary sha, or None, without reading it."""
+        found = self.find(sha)
+        if found is None:
+            return None
+        return self.info_at(*found)
+
+    def info_at(self, pack, offset):
+        """(format, size) of the object stored at offset in pack.
+
+The size of a deltified object is in the header of its delta, and its
+type is the type of the base at the end of the chain: we only read entry
+headers, nothing is rebuilt."""
+        size = None
+        while True:
+            buf = pack.data
+            type, entry_size, pos = pack_entry_header(buf, offset)
+
+            if type == OBJ_OFS_DELTA:
+                distance, pos = pack_ofs_delta_offset(buf, pos)
+                if size is None:
+                    size = pack_delta_size(buf, pos)
+                offset -= distance
+            elif type == OBJ_REF_DELTA:
+                if size is None:
+                    size = pack_delta_size(buf, pos + 20)
+                found = self.find(bytes(buf[pos:pos + 20]))
+                if found is None:
+                    raise Exception("Missing delta base: " + bytes(buf[pos:pos + 20]).hex())
+                pack, offset = found
+            elif type in PACK_TYPES:
+                return PACK_TYPES[type], entry_size if size is None else size
+            else:
+                raise Exception("Unknown pack object type: " + str(type))
+
+    def read_at(self, pack, offset):
+        """Read the object stored at offset in pack.
+
+Returns (format, data).  Delta chains are followed iteratively: we walk
+down to the base object, collecting deltas, then apply them in reverse."""
+        deltas = list()
+        # keys[i] locates the base deltas[i] applies to, as (pack path, offset)
+        keys = list()
+        cache = self.base_cache
+
+        while True:
+            if keys and cache is not None:
+                hit = cache.get(keys[-1])
+                if hit is not None:
+                    format, data = hit
+                    break
+
+            buf = pack.data
+            type, size, pos = pack_entry_header(buf, offset)
+
+            if type == OBJ_OFS_DELTA:
+                distance, pos = pack_ofs_delta_offset(buf, pos)
+                deltas.append(pack_inflate(buf, pos, size))
+                offset -= distance
+            elif type == OBJ_REF_DELTA:
+                base_sha = bytes(buf[pos:pos + 20])
+                deltas.append(pack_inflate(buf, pos + 20, size))
+                # The base may live in another pack
+                found = self.find(base_sha)
+                if found is None:
+                    raise Exception("Missing delta base: " + base_sha.hex())
+                pack, offset = found
+            elif type in PACK_TYPES:
+                format = PACK_TYPES[type]
+                data = pack_inflate(buf, pos, size)
+                break
+            else:
+                raise Exception("Unknown pack object type: " + str(type))
+
+            keys.append((pack.path, offset))
+
+        # Remember every base we rebuild on the way back up
+        for i in reversed(range(len(deltas))):
+            if cache is not None:
+                cache.put(keys[i], (format, data), len(data))
+            data = delta_apply(data, deltas[i])
+
+        return format, data
@@ -0,0 +1,286 @@
+"""Read objects out of packfiles.
+
+A packfile (.git/objects/pack/pack-XXXX.pack) stores many objects one after
+the other, each zlib-compressed on its own.  Next to it lives an index
+(pack-XXXX.idx) which maps every SHA in the pack to its byte offset.
+
+Version 2 index layout:
+    - 4 bytes magic b'\\377tOc', 4 bytes version (2)
+    - fanout table: 256 big-endian uint32, fanout[i] is the number of
+      objects whose first SHA byte is <= i
+    - N sorted 20-byte SHAs
+    - N uint32 CRC32s
+    - N uint32 offsets (if the MSB is set, the low 31 bits index into
+      the 64-bit offset table that follows)
+    - 64-bit offsets table
+    - pack checksum and idx checksum (20 bytes each)
+"""
+
+import zlib
+
+
+# Object types as stored in the pack entry header
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+PACK_TYPES = {
+    OBJ_COMMIT : b'commit',
+    OBJ_TREE   : b'tree',
+    OBJ_BLOB   : b'blob',
+    OBJ_TAG    : b'tag',
+}
+
+
+def pack_entry_header(buf, pos):
+    """Parse the variable-length entry header at pos.
+
+Returns (type, size, pos) with pos pointing right after the header."""
+    c = buf[pos]
+    pos += 1
+    type = (c >> 4) & 7
+    size = c & 15
+    shift = 4
+    while c & 0x80:
+        c = buf[pos]
+        pos += 1
+        size |= (c & 0x7f) << shift
+        shift += 7
+    return type, size, pos
+
+def pack_ofs_delta_offset(buf, pos):
+    """Parse the negative base offset of an OFS_DELTA entry.
+
+Returns (distance, pos).  Note the +1 on every continuation byte: this
+encoding has no redundant representations."""
+    c = buf[pos]
+    pos += 1
+    ofs = c & 0x7f
+    while c & 0x80:
+        c = buf[pos]
+        pos += 1
+        ofs = ((ofs + 1) << 7) | (c & 0x7f)
+    return ofs, pos
+
+def pack_inflate(buf, pos, size):
+    """Inflate the zlib stream starting at pos in buf (usually a memoryview
+over an mmapped pack), which must decompress to exactly size bytes.
+
+We hand zlib bounded slices of buf rather than buf[pos:], otherwise
+everything after the stream would get copied into unused_data."""
+    d = zlib.decompressobj()
+    out = list()
+    # Deflate never grows data by more than a few bytes per 16KB block,
+    # so the first slice almost always holds the whole stream.
+    step = size + (size >> 10) + 64
+    end = len(buf)
+    while not d.eof:
+        if pos >= end:
+            raise Exception("Truncated pack entry")
+        out.append(d.decompress(buf[pos:pos + step]))
+        pos += step
+    data = b''.join(out)
+    if len(data) != size:
+        raise Exception("Pack entry size mismatch")
+    return data
+
+def delta_varint(delta, pos):
+    """Read a little-endian base-128 size from a delta header."""
+    ret = 0
+    shift = 0
+    while True:
+        c = delta[pos]
+        pos += 1
+        ret |= (c & 0x7f) << shift
+        shift += 7
+        if not c & 0x80:
+            return ret, pos
+
+def pack_delta_size(buf, pos):
+    """The size of the object the delta whose zlib stream starts at pos
+rebuilds.  Only the delta header (two varints, 20 bytes at most) is
+inflated."""
+    head = zlib.decompressobj().decompress(buf[pos:pos + 64], 20)
+    _, pos = delta_varint(head, 0)
+    return delta_varint(head, pos)[0]
+
+def delta_apply(base, delta):
+    """Rebuild an object from its base and a git delta.
+
+A delta starts with the base and result sizes, followed by instructions:
+either copy a range out of the base (MSB set) or insert the next n
+literal bytes (MSB clear)."""
+    base_size, pos = delta_varint(delta, 0)
+    if base_size != len(base):
+        raise Exception("Delta base size mismatch")
+    result_size, pos = delta_varint(delta, pos)
+
+    out = list()
+    end = len(delta)
+    while pos < end:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            # Copy: the low 4 bits flag which offset bytes are present,
+            # the next 3 which size bytes are.
+            offset = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (i * 8)
+                    pos += 1
+            size = 0
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (i * 8)
+                    pos += 1
+            if size == 0:
+                size = 0x10000
+            out.append(base[offset:offset + size])
+        elif op:
+            out.append(delta[pos:pos + op])
+            pos += op
+        else:
+            raise Exception("Invalid delta opcode 0")
+
+    ret = b''.join(out)
+    if len(ret) != result_size:
+        raise Exception("Delta result size mismatch")
+    return ret
+
+# Blocks of the base a delta can copy from are indexed at multiples of
+# this; any match at least twice as long is found.
+DELTA_BLOCK = 16
+
+def pack_entry_header_encode(type, size):
+    """The entry header pack_entry_header parses."""
+    c = (type << 4) | (size & 15)
+    size >>= 4
+    out = bytearray()
+    while size:
+        out.append(c | 0x80)
+        c = size & 0x7f
+        size >>= 7
+    out.append(c)
+    return bytes(out)
+
+def pack_ofs_delta_encode(distance):
+    """The negative base offset pack_ofs_delta_offset parses."""
+    out = bytearray([distance & 0x7f])
+    distance >>= 7
+    while distance:
+        distance -= 1
+        out.append(0x80 | (distance & 0x7f))
+        distance >>= 7
+    out.reverse()
+    return bytes(out)
+
+def delta_varint_encode(n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append(0x80 | (n & 0x7f))
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+def delta_index(base):
+    """Map every DELTA_BLOCK-aligned block of base to its offset, for
+delta_create.  Computed once per base, reused for every target."""
+    index = dict()
+    for i in range(len(base) - DELTA_BLOCK, -1, -DELTA_BLOCK):
+        # Going backwards, so the first occurrence wins
+        index[base[i:i + DELTA_BLOCK]] = i
+    return index
+
+def delta_match_length(base, b, target, t, known):
+    """How many bytes base[b:] and target[t:] have in common, knowing the
+first known do.  Compared in big slices first, then smaller ones."""
+    length = known
+    bend = len(base) - b
+    tend = len(target) - t
+    for step in (4096, 256, 16, 1):
+        while (length + step <= bend and length + step <= tend
+               and base[b + length:b + length + step] == target[t + length:t + length + step]):
+            length += step
+    return length
+
+def delta_create(base, target, index = None, max_size = None):
+    """A delta rebuilding target from base, as delta_apply reads them, or
+None if it would be bigger than max_size.
+
+For every position of target we look up the DELTA_BLOCK bytes there in
+the index of base; a hit is extended backwards over the pending literal
+bytes and forwards as far as the data agrees, and becomes a copy.  What
+matches nothing is inserted as literal data."""
+    if index is None:
+        index = delta_index(base)
+    if max_size is None:
+        max_size = len(target) + 64
+
+    out = [delta_varint_encode(len(base)), delta_varint_encode(len(target))]
+    size = len(out[0]) + len(out[1])
+    # target[literal:i] matched nothing (yet)
+    literal = 0
+    i = 0
+    end = len(target) - DELTA_BLOCK
+
+    def insert(start, stop):
+        nonlocal size
+        while start < stop:
+            n = min(stop - start, 0x7f)
+            out.append(bytes([n]))
+            out.append(target[start:start + n])
+            size += n + 1
+            start += n
+
+    while i <= end:
+        b = index.get(target[i:i + DELTA_BLOCK])
+        if b is None:
+            i += 1
+            # Literal bytes cost at least their own size
+            if size + i - literal > max_size:
+                return None
+            continue
+
+        # Grow the match backwards over pending literal bytes
+        t = i
+        while t > literal and b > 0 and base[b - 1] == target[t - 1]:
+            t -= 1
+            b -= 1
+        length = delta_match_length(base, b, target, t, i + DELTA_BLOCK - t)
+
+        insert(literal, t)
+        while length:
+            n = min(length, 0x10000)
+            op = 0x80
+            args = bytearray()
+            for k in range(4):
+                if (b >> (k * 8)) & 0xff:
+                    op |= 1 << k
+                    args.append((b >> (k * 8)) & 0xff)
+            # A size of 0x10000 is written as 0
+            for k in range(3):
+                if (n & 0xffff) >> (k * 8) & 0xff:
+                    op |= 0x10 << k
+                    args.append((n >> (k * 8)) & 0xff)
+            out.append(bytes([op]) + bytes(args))
+            size += 1 + len(args)
+            b += n
+            t += n
+            length -= n
+        i = literal = t
+        if size > max_size:
+            return None
+
+    insert(literal, len(target))
+    if size > max_size:
+        return None
+    return b''.join(out)
+
+def pack_read(repo, sha):
+    """Look sha up in every pack of repo.
+
+Returns (format, data), or None if no pack holds the object."""
+    return repo.packs.read(bytes.fromhex(sha))
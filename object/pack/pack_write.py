@@ -0,0 +1,386 @@
+"""Write packfiles: gather the objects reachable from the refs, find deltas
+between similar ones, and store them all in one .pack plus its .idx (see
+pack_utils for both formats).
+
+A pack entry is a header (type and size), then for deltas the distance
+back to the base entry (OFS_DELTA), then the zlib-compressed data.  The
+pack ends with the SHA-1 of everything before.
+"""
+
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from object.commit.commit_utils import kvlm_parse
+from object.object_utils import object_read_raw
+from object.pack.pack_bitmap import bitmap_write
+from object.pack.pack_store import IDX_MAGIC
+from object.pack.pack_utils import (OBJ_BLOB, OBJ_COMMIT, OBJ_OFS_DELTA, OBJ_REF_DELTA,
+                                    OBJ_TAG, OBJ_TREE, PACK_TYPES, delta_create, delta_index,
+                                    pack_entry_header, pack_entry_header_encode,
+                                    pack_ofs_delta_encode, pack_ofs_delta_offset)
+from object.refs.refs_utils import ref_resolve, ref_snapshot
+from object.tree.tree_utils import tree_parse
+from repository.git_repository import GitRepository
+from repository.repo_utils import repo_dir
+
+
+PACK_OBJ_TYPES = {
+    b'commit' : OBJ_COMMIT,
+    b'tree'   : OBJ_TREE,
+    b'blob'   : OBJ_BLOB,
+    b'tag'    : OBJ_TAG,
+}
+
+# Like git's pack.window and pack.depth
+PACK_WINDOW = 10
+PACK_DEPTH = 50
+
+# The headers of a commit that point to other objects
+COMMIT_LINK_KEYS = frozenset([b'tree', b'parent'])
+
+# Objects smaller than this aren't worth a delta
+PACK_DELTA_MIN = 50
+
+# pack_stream writes to its output this many bytes at a time
+PACK_STREAM_CHUNK = 1 << 16
+
+
+def pack_name_hash(name):
+    """git's pack_name_hash: mostly the last characters of a path, so files
+with the same name (or extension) end up next to each other when sorted,
+where the delta window can see them."""
+    hash = 0
+    for c in name.encode("utf8"):
+        if c in b' \t\n\r\f\v':
+            continue
+        hash = ((hash >> 2) + (c << 24)) & 0xffffffff
+    return hash
+
+def pack_gather(repo):
+    """Every object reachable from HEAD and the refs, as a list of
+(sha, type, size, name hash).  The name hash is that of the path a blob
+or tree was first seen at, 0 for commits and tags.
+
+Iterative: history and trees can both be deep."""
+    stack = [(sha, "") for _, sha in ref_snapshot(repo).items()]
+    head = ref_resolve(repo, "HEAD")
+    if head:
+        stack.append((head, ""))
+
+    seen = set()
+    ret = list()
+    while stack:
+        sha, name = stack.pop()
+        if sha in seen:
+            continue
+        seen.add(sha)
+
+        raw = object_read_raw(repo, sha)
+        if raw is None:
+            raise Exception("Missing object: " + sha)
+        format, data = raw
+        ret.append((sha, format, len(data), pack_name_hash(name)))
+
+        if format == b'commit':
+            kvlm = kvlm_parse(data, keys=COMMIT_LINK_KEYS)
+            parents = kvlm.get(b'parent', [])
+            for link in [kvlm[b'tree']] + (parents if type(parents) == list else [parents]):
+                stack.append((link.decode("ascii"), ""))
+        elif format == b'tag':
+            stack.append((data[7:47].decode("ascii"), ""))
+        elif format == b'tree':
+            for leaf in tree_parse(data):
+                # Submodule commits live in another repository
+                if leaf.mode != b'160000':
+                    stack.append((leaf.sha, leaf.path))
+    return ret
+
+def pack_sort_key(obj):
+    # Type, then name hash, then biggest first: like git, so that deltas
+    # go from big to small (removing data is cheaper than adding it)
+    sha, format, size, hash = obj
+    return PACK_OBJ_TYPES[format], hash, -size
+
+# Each worker process of pack_deltas opens the repository once and keeps
+# it here
+worker_repo = None
+
+def pack_delta_worker_init(worktree):
+    global worker_repo
+    worker_repo = GitRepository(worktree)
+
+def pack_delta_search(objects, window = PACK_WINDOW, depth = PACK_DEPTH, repo = None):
+    """Find deltas among objects, a slice of the sorted object list.
+
+Each object is compared with the window objects before it, of the same
+type; the smallest delta wins, if it saves enough.  Returns, per object,
+None or (base, delta), base being an index into objects.  Bases always
+come before the objects deltified against them."""
+    repo = repo or worker_repo
+    ret = list()
+    depths = list()
+    # (index, data, delta index of data, built on first use)
+    recent = deque(maxlen=window)
+
+    for i, (sha, format, size, hash) in enumerate(objects):
+        data = object_read_raw(repo, sha)[1]
+        best = None
+        if size >= PACK_DELTA_MIN:
+            max_size = size // 2 - 20
+            for entry in reversed(recent):
+                j, base, index = entry
+                if objects[j][1] != format or depths[j] >= depth:
+                    continue
+                if abs(len(base) - size) > max_size:
+                    # The size difference alone would make it too big
+                    continue
+                if index is None:
+                    index = entry[2] = delta_index(base)
+                # Deep chains are slower to read: ask more of them
+                allowed = max_size * (depth - depths[j]) // depth
+                delta = delta_create(base, data, index, allowed)
+                if delta is not None:
+                    best = (j, delta)
+                    max_size = len(delta) - 1
+
+        ret.append(best)
+        depths.append(depths[best[0]] + 1 if best else 0)
+        recent.append([i, data, None])
+    return ret
+
+def pack_search_chunk(start, objects, window, depth):
+    # Runs in a worker: indexes in the results are made absolute
+    return [None if found is None else (found[0] + start, found[1])
+            for found in pack_delta_search(objects, window, depth)]
+
+def pack_deltas(repo, objects, window = PACK_WINDOW, depth = PACK_DEPTH, jobs = None):
+    """pack_delta_search over the whole sorted object list, on jobs
+processes (one per CPU by default).
+
+The list is cut in contiguous slices searched independently; only the
+few objects at the start of a slice lose bases they could have had in
+the previous one.  There are more slices than workers, so a slice full
+of big blobs doesn't hold everyone else up."""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(objects) < 1000:
+        return pack_delta_search(objects, window, depth, repo)
+
+    step = max(500, len(objects) // (jobs * 4) + 1)
+    starts = range(0, len(objects), step)
+    ret = list()
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=pack_delta_worker_init,
+                             initargs=(repo.worktree,)) as ex:
+        for found in ex.map(pack_search_chunk, starts,
+                            [objects[s:s + step] for s in starts],
+                            [window] * len(starts), [depth] * len(starts)):
+            ret.extend(found)
+    return ret
+
+def pack_write(repo, objects, deltas):
+    """Write objects (sorted, see pack_sort_key) and their deltas (see
+pack_deltas) to a new pack and index in objects/pack.  Returns the path
+of the pack, without extension.
+
+Objects are written in list order, so a base is always before the
+deltas against it and OFS_DELTA applies.  Both files are written under
+temporary names and renamed once complete, the .idx last: readers only
+look at packs that have an index."""
+    path = repo_dir(repo, "objects", "pack", mkdir=True)
+    pack = tempfile.NamedTemporaryFile(dir=path, prefix="tmp_pack_", delete=False)
+    try:
+        header = b'PACK' + struct.pack(">II", 2, len(objects))
+        sha = hashlib.sha1(header)
+        pack.write(header)
+        pos = len(header)
+
+        offsets = list()
+        crcs = list()
+        for (obj, format, size, hash), found in zip(objects, deltas):
+            if found is None:
+                data = object_read_raw(repo, obj)[1]
+                entry = pack_entry_header_encode(PACK_OBJ_TYPES[format], len(data))
+            else:
+                base, data = found
+                entry = (pack_entry_header_encode(OBJ_OFS_DELTA, len(data))
+                         + pack_ofs_delta_encode(pos - offsets[base]))
+            entry += zlib.compress(data)
+
+            offsets.append(pos)
+            crcs.append(zlib.crc32(entry))
+            sha.update(entry)
+            pack.write(entry)
+            pos += len(entry)
+
+        checksum = sha.digest()
+        pack.write(checksum)
+        pack.close()
+
+        name = os.path.join(path, "pack-" + checksum.hex())
+        idx = pack_index(objects, offsets, crcs, checksum)
+        with open(name + ".idx.tmp", "wb") as f:
+            f.write(idx)
+        os.chmod(pack.name, 0o444)
+        os.replace(pack.name, name + ".pack")
+        os.chmod(name + ".idx.tmp", 0o444)
+        os.replace(name + ".idx.tmp", name + ".idx")
+    except BaseException:
+        pack.close()
+        if os.path.exists(pack.name):
+            os.unlink(pack.name)
+        raise
+    return name
+
+def pack_stream(repo, shas, out, ofs_delta = True):
+    """Write a pack of the objects shas (hex) to out, a binary file, as
+it is built: this is what a fetch receives.  Returns the number of objects.
+
+Nothing is deltified anew.  Packed objects are copied entry by entry,
+still compressed, in pack order.  A delta is kept whenever its base was
+sent before it, as an OFS_DELTA to the base's new offset (a REF_DELTA
+unless ofs_delta); otherwise it's rebuilt and sent whole.  Loose objects
+are sent whole."""
+    packed = list()
+    loose = list()
+    for sha in shas:
+        found = repo.packs.find(bytes.fromhex(sha))
+        if found is None:
+            loose.append(sha)
+        else:
+            packed.append((found[0], found[1], sha))
+    # Pack order keeps bases before their deltas, and reads sequential
+    packed.sort(key=lambda p: (p[0].path, p[1]))
+
+    header = b'PACK' + struct.pack(">II", 2, len(packed) + len(loose))
+    checksum = hashlib.sha1(header)
+    chunks = [header]
+    buffered = pos = len(header)
+    # The SHA of what we sent by (pack path, offset), and where it starts
+    # in the stream by SHA
+    sent = dict()
+    sent_at = dict()
+
+    for pack, offset, sha in packed:
+        buf = pack.data
+        type, size, start = pack_entry_header(buf, offset)
+        end = pack.end(offset)
+        base = None
+        if type == OBJ_OFS_DELTA:
+            distance, data = pack_ofs_delta_offset(buf, start)
+            base = sent.get((pack.path, offset - distance))
+        elif type not in PACK_TYPES:
+            # REF_DELTA
+            data = start + 20
+            base = bytes(buf[start:data]).hex()
+            if base not in sent_at:
+                base = None
+
+        if type in PACK_TYPES:
+            entry = [buf[offset:end]]
+        elif base is None:
+            format, raw = repo.packs.read_at(pack, offset)
+            entry = [pack_entry_header_encode(PACK_OBJ_TYPES[format], len(raw)) + zlib.compress(raw)]
+        elif ofs_delta:
+            entry = [pack_entry_header_encode(OBJ_OFS_DELTA, size)
+                     + pack_ofs_delta_encode(pos - sent_at[base]), buf[data:end]]
+        else:
+            entry = [pack_entry_header_encode(OBJ_REF_DELTA, size) + bytes.fromhex(base), buf[data:end]]
+
+        sent[(pack.path, offset)] = sha
+        sent_at[sha] = pos
+        for e in entry:
+            checksum.update(e)
+            chunks.append(e)
+            pos += len(e)
+            buffered += len(e)
+        if buffered >= PACK_STREAM_CHUNK:
+            out.write(b''.join(chunks))
+            chunks = list()
+            buffered = 0
+
+    for sha in loose:
+        format, data = object_read_raw(repo, sha)
+        entry = pack_entry_header_encode(PACK_OBJ_TYPES[format], len(data)) + zlib.compress(data)
+        checksum.update(entry)
+        chunks.append(entry)
+        buffered += len(entry)
+        if buffered >= PACK_STREAM_CHUNK:
+            out.write(b''.join(chunks))
+            chunks = list()
+            buffered = 0
+
+    chunks.append(checksum.digest())
+    out.write(b''.join(chunks))
+    out.flush()
+    return len(packed) + len(loose)
+
+def pack_index(objects, offsets, crcs, checksum):
+    """The version 2 .idx of a pack holding objects at offsets."""
+    order = sorted(range(len(objects)), key=lambda i: objects[i][0])
+
+    fanout = [0] * 256
+    for i in order:
+        fanout[int(objects[i][0][0:2], 16)] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    small = list()
+    large = list()
+    for i in order:
+        if offsets[i] < 0x80000000:
+            small.append(offsets[i])
+        else:
+            small.append(0x80000000 | len(large))
+            large.append(offsets[i])
+
+    out = [IDX_MAGIC, struct.pack(">I", 2), struct.pack(">256I", *fanout),
+           b''.join(bytes.fromhex(objects[i][0]) for i in order),
+           struct.pack(f">{len(order)}I", *(crcs[i] for i in order)),
+           struct.pack(f">{len(small)}I", *small),
+           struct.pack(f">{len(large)}Q", *large),
+           checksum]
+    data = b''.join(out)
+    return data + hashlib.sha1(data).digest()
+
+def pack_repack(repo, window = PACK_WINDOW, depth = PACK_DEPTH, jobs = None, bitmap = True):
+    """Pack every reachable object into a single new pack, then delete the
+old packs and the loose objects the new pack holds, like git repack -a -d
+followed by git prune-packed.  With bitmap, the new pack gets reachability
+bitmaps (see pack_bitmap): it holds everything reachable, as they require.
+
+Unreachable loose objects are left alone: they may be a commit being
+written right now.  Returns (objects, deltas, pack path)."""
+    objects = pack_gather(repo)
+    objects.sort(key=pack_sort_key)
+    deltas = pack_deltas(repo, objects, window, depth, jobs)
+    name = pack_write(repo, objects, deltas)
+    if bitmap:
+        bitmap_write(repo, name, objects)
+
+    path = os.path.dirname(name)
+    for f in os.listdir(path):
+        # The .pack, .idx and whatever else goes with them
+        if f.startswith("pack-") and not f.startswith(os.path.basename(name) + "."):
+            os.unlink(os.path.join(path, f))
+
+    packed = set(obj[0] for obj in objects)
+    objdir = repo_dir(repo, "objects")
+    for d in os.listdir(objdir):
+        if len(d) != 2:
+            continue
+        for f in os.listdir(os.path.join(objdir, d)):
+            if d + f in packed:
+                os.unlink(os.path.join(objdir, d, f))
+        try:
+            os.rmdir(os.path.join(objdir, d))
+        except OSError:
+            # Unreachable objects are still there
+            pass
+
+    repo.packs.scan()
+    repo.prefixes = None
+    return len(objects), sum(1 for d in deltas if d is not None), name
@@ -1,11 +1,195 @@
+"""References: loose ones, one file per ref under .git/refs, and packed
+ones, all in .git/packed-refs:
+
+    # pack-refs with: peeled fully-peeled sorted
+    <sha> refs/heads/master
+    <sha> refs/tags/v1.0
+    ^<sha of the commit the tag above points to>
+
+A loose ref wins over a packed one with the same name.
+"""
+
+import heapq
 import os
+from bisect import bisect_left
 from object.commit.commit_object import GitCommit
 from repository.repo_utils import repo_dir, repo_file
 
 class GitTag(GitCommit):
-    fmt = b'tag'
+    format = b'tag'
+
+
+class GitPackedRefs (object):
+    """.git/packed-refs, as two parallel lists sorted by name, for bisect.
+Peeled values (what annotated tags point to) are kept by name."""
+
+    def __init__(self, path):
+        self.names = list()
+        self.shas = list()
+        self.peeled = dict()
+
+        try:
+            with open(path, "r") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+
+        traits = list()
+        for line in lines:
+            if line.startswith("# pack-refs with:"):
+                traits = line[17:].split()
+            elif line.startswith("^"):
+                self.peeled[self.names[-1]] = line[1:]
+            elif line and not line.startswith("#"):
+                sha, name = line.split(" ", 1)
+                self.names.append(name)
+                self.shas.append(sha)
+
+        if "sorted" not in traits:
+            order = sorted(range(len(self.names)), key=lambda i: self.names[i])
+            self.names = [self.names[i] for i in order]
+            self.shas = [self.shas[i] for i in order]
+
+    def __len__(self):
+        return len(self.names)
+
+    def find(self, name):
+        """The SHA of ref name, or None."""
+        i = bisect_left(self.names, name)
+        if i < len(self.names) and self.names[i] == name:
+            return self.shas[i]
+        return None
+
+
+class GitRefs (object):
+    """A snapshot of every ref of a repository, loose and packed.
+
+Reading it walks .git/refs once.  Loose refs go in a dict; packed refs
+stay in GitPackedRefs's sorted table and are looked up there, so a big
+packed-refs costs one parse, not a copy.  stamp records the mtime of
+packed-refs and of every directory of .git/refs: writing a ref creates a
+file and renames it into place, which changes the mtime of its
+directory, so comparing stamps tells whether the snapshot is still
+current."""
+
+    def __init__(self, repo):
+        self.packed = GitPackedRefs(repo_file(repo, "packed-refs"))
+        # name -> SHA, or "ref: <name>" for symbolic refs
+        self.loose = dict()
+        self.stamp = ref_stamp(repo)
+
+        for path, _, _ in self.stamp[1:]:
+            prefix = os.path.relpath(path, repo.gitdir).replace(os.sep, "/") + "/"
+            for entry in os.scandir(path):
+                if entry.is_file() and not entry.name.endswith(".lock"):
+                    with open(entry.path, "r") as f:
+                        self.loose[prefix + entry.name] = f.read().strip()
+
+        # Comparing str compares code points, which sorts like the UTF-8
+        # bytes git compares
+        self.loose_names = sorted(self.loose)
+
+    def __len__(self):
+        return len(self.packed) + sum(1 for name in self.loose if self.packed.find(name) is None)
+
+    def value(self, name):
+        """What ref name holds, without following it: the loose ref if
+there is one, else the packed one, or None."""
+        value = self.loose.get(name)
+        if value is None:
+            value = self.packed.find(name)
+        return value
+
+    def get(self, name):
+        """The SHA name points to, following symbolic refs, or None."""
+        value = self.value(name)
+        # Symbolic refs can chain, but not forever
+        for i in range(5):
+            if value is None or not value.startswith("ref: "):
+                return value
+            value = self.value(value[5:])
+        return None
+
+    def names(self, prefix = "refs/"):
+        """The name of every ref starting with prefix, sorted: the two
+sorted lists, merged."""
+        packed = self.packed.names
+        loose = self.loose_names
+        i = bisect_left(packed, prefix)
+        j = bisect_left(loose, prefix)
+        last = None
+        # Generators rather than slices: nothing is copied
+        for name in heapq.merge((packed[k] for k in range(i, len(packed))),
+                                (loose[k] for k in range(j, len(loose)))):
+            if not name.startswith(prefix):
+                break
+            # Loose and packed both
+            if name != last:
+                yield name
+            last = name
+
+    def items(self, prefix = "refs/"):
+        """(name, SHA) for every ref whose name starts with prefix, sorted
+by name."""
+        for name in self.names(prefix):
+            sha = self.get(name)
+            if sha:
+                yield name, sha
+
+
+def ref_stamp(repo):
+    """(path, mtime_ns, inode) of packed-refs and of every directory under
+.git/refs.  Directories come after packed-refs."""
+    ret = list()
+    path = repo_file(repo, "packed-refs")
+    try:
+        st = os.stat(path)
+        ret.append((path, st.st_mtime_ns, st.st_ino))
+    except FileNotFoundError:
+        ret.append((path, None, None))
+
+    stack = [repo_dir(repo, "refs")]
+    while stack:
+        path = stack.pop()
+        if path is None:
+            continue
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        ret.append((path, st.st_mtime_ns, st.st_ino))
+        for entry in os.scandir(path):
+            if entry.is_dir():
+                stack.append(entry.path)
+    return ret
+
+def ref_stamp_current(stamp):
+    """Whether nothing recorded in stamp changed."""
+    for path, mtime, ino in stamp:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            if mtime is not None:
+                return False
+            continue
+        if (st.st_mtime_ns, st.st_ino) != (mtime, ino):
+            return False
+    return True
+
+def ref_snapshot(repo):
+    """The repository's GitRefs, rebuilt only when refs changed on disk."""
+    refs = repo.refs
+    if refs is None or not ref_stamp_current(refs.stamp):
+        refs = GitRefs(repo)
+        repo.refs = refs
+    return refs
 
 def ref_resolve(repo, ref):
+    """The SHA ref points to, following symbolic refs, or None.  Names
+under refs/ come from the snapshot; others (HEAD, FETCH_HEAD...) are
+files at the top of .git."""
+    if ref.startswith("refs/"):
+        return ref_snapshot(repo).get(ref)
 
     path = repo_file(repo, ref)
     # Resolve a reference in a case when we're looking for HEAD on a new repo
@@ -13,26 +197,98 @@ def ref_resolve(repo, ref):
 
     if not os.path.exists(path):
         return None
-    
+
     with open(path, 'r') as f:
         data = f.read()[:-1] # Remove trailing newline
-    
+
     if data.startswith("ref: "):
         return ref_resolve(repo, data[5:])
     else:
         return data
-    
-def ref_list(repo, path = None):
-    if not path:
-        path = repo_dir(repo, "refs")
+
+def ref_list(repo, prefix = "refs/"):
+    """Every ref under prefix, as nested dicts following the path: the
+leaves are SHAs.  Sorted, like git shows them."""
     ret = dict()
-    #As the refs shown by Git are sorted, we will do the same
-    for f in sorted(os.listdir(path)):
-        can = os.path.join(path,f)
-        if os.path.isdir(can):
-            ret[f] = ref_list(repo, can)
-        else:
-            with open(can, 'r') as file:
-                ret[f] = ref_resolve(repo, can)
-
-    return ret
\ No newline at end of file
+    for name, sha in ref_snapshot(repo).items(prefix):
+        parts = name[len(prefix):].split("/")
+        node = ret
+        for part in parts[:-1]:
+            node = node.setdefault(part, dict())
+        node[parts[-1]] = sha
+    return ret
+
+def ref_write(repo, ref, value):
+    """Point ref (e.g. "refs/tags/v1") to value, a SHA or "ref: <name>".
+
+Written to <ref>.lock then renamed, so readers never see half a ref and
+the snapshot notices the change."""
+    path = repo_file(repo, *ref.split("/"), mkdir=True)
+    with open(path + ".lock", "w") as f:
+        f.write(value + "\n")
+    os.replace(path + ".lock", path)
+
+def ref_peel(repo, sha):
+    """What sha points to once annotated tags are followed, or None if
+sha isn't a tag."""
+    # object_utils imports this module, so import it late
+    from object.object_utils import object_read
+
+    peeled = None
+    obj = object_read(repo, sha)
+    while obj is not None and obj.format == b'tag':
+        peeled = obj.kvlm[b'object'].decode("ascii")
+        obj = object_read(repo, peeled)
+    return peeled
+
+def ref_pack(repo, all = False):
+    """Move loose refs into packed-refs, like git pack-refs.
+
+Only tags, which rarely change, are packed unless all is set; branches
+are always written loose.  Returns the number of refs packed."""
+    refs = ref_snapshot(repo)
+
+    packed = list()
+    pruned = list()
+    for name in refs.names():
+        value = refs.value(name)
+        if value.startswith("ref: "):
+            # Symbolic refs stay loose
+            continue
+        if name in refs.loose:
+            if not (all or name.startswith("refs/tags/")):
+                continue
+            pruned.append((name, value))
+        packed.append((name, value))
+
+    out = ["# pack-refs with: peeled fully-peeled sorted \n"]
+    for name, sha in packed:
+        out.append(f"{sha} {name}\n")
+        peeled = refs.packed.peeled.get(name) if name not in refs.loose else ref_peel(repo, sha)
+        if peeled:
+            out.append(f"^{peeled}\n")
+
+    path = repo_file(repo, "packed-refs")
+    with open(path + ".lock", "w") as f:
+        f.write("".join(out))
+    os.replace(path + ".lock", path)
+
+    # Only remove a loose ref if nobody moved it in the meantime
+    top = repo_dir(repo, "refs")
+    for name, sha in pruned:
+        path = repo_file(repo, name)
+        with open(path, "r") as f:
+            if f.read().strip() != sha:
+                continue
+        os.unlink(path)
+        parent = os.path.dirname(path)
+        # Keep refs/heads and refs/tags themselves
+        while os.path.dirname(parent) != top and parent != top:
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+    repo.refs = None
+    return len(pruned)
@@ -0,0 +1,84 @@
+from object.object_utils import object_read
+from object.tree.tree_utils import GitTreeItems, tree_leaf_sort_key
+
+
+def tree_items(repo, sha):
+    """The leaves of tree (or commit) sha, in tree order.  None is the
+empty tree."""
+    if sha is None:
+        return []
+    obj = object_read(repo, sha)
+    if obj is None:
+        raise Exception("Missing object: " + sha)
+    if obj.format == b'commit':
+        obj = object_read(repo, obj.kvlm[b'tree'].decode("ascii"))
+    if obj.format != b'tree':
+        raise Exception(f"Not a tree: {sha}")
+    return obj.items
+
+def tree_leaf_is_tree(leaf):
+    return leaf.mode.startswith(b'04')
+
+def tree_diff_key(items, i):
+    # Trees sort as if their name ended with a /, which is what makes a
+    # file "a" and a directory "a" different entries.  Parsed trees can
+    # tell without building the leaf.
+    if type(items) == GitTreeItems:
+        return items.key(i)
+    return tree_leaf_sort_key(items[i])
+
+def tree_diff(repo, sha_a, sha_b, prefix = ""):
+    """Compare two trees (or commits), yielding (status, path, old, new)
+for every file that differs, with status 'A' (added), 'D' (deleted) or
+'M' (modified, content or mode), and old/new the GitTreeLeaf on each side
+(None when absent).  Either SHA can be None for the empty tree.
+
+Both trees are already sorted, so we walk the two lists side by side.
+Subtrees with the same SHA on both sides are identical and skipped
+without being read: comparing two close commits only reads the trees on
+the paths that changed."""
+    # Iterative, deep trees are common.  The stack holds either trees
+    # still to compare, or changes to yield once everything before them
+    # has been; the last pushed comes out first, so we push in reverse.
+    stack = [(prefix, sha_a, sha_b, None)]
+    while stack:
+        prefix, sha_a, sha_b, change = stack.pop()
+        if change is not None:
+            yield change
+            continue
+        if sha_a == sha_b:
+            continue
+
+        a = tree_items(repo, sha_a)
+        b = tree_items(repo, sha_b)
+        i = j = 0
+        out = list()
+        while i < len(a) or j < len(b):
+            ka = tree_diff_key(a, i) if i < len(a) else None
+            kb = tree_diff_key(b, j) if j < len(b) else None
+
+            if kb is None or (ka is not None and ka < kb):
+                out.append((a[i], None))
+                i += 1
+            elif ka is None or kb < ka:
+                out.append((None, b[j]))
+                j += 1
+            else:
+                old = a[i]
+                new = b[j]
+                if old.rawsha != new.rawsha or old.mode != new.mode:
+                    out.append((old, new))
+                i += 1
+                j += 1
+
+        for old, new in reversed(out):
+            leaf = old or new
+            path = prefix + leaf.path
+            if tree_leaf_is_tree(leaf):
+                stack.append((path + "/", old and old.sha, new and new.sha, None))
+            elif old is None:
+                stack.append((None, None, None, ('A', path, None, new)))
+            elif new is None:
+                stack.append((None, None, None, ('D', path, old, None)))
+            else:
+                stack.append((None, None, None, ('M', path, old, new)))
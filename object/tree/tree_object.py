@@ -1,8 +1,11 @@
 from object.git_object import GitObject
-from object.tree.tree_utils import tree_parse, tree_serialize
+from object.tree.tree_utils import GitTreeItems, tree_parse, tree_serialize
 
 
 class GitTree(GitObject):
+    """A tree.  Parsed trees keep their raw bytes and decode entries
+lazily, see GitTreeItems; trees built from scratch hold a plain list of
+GitTreeLeaf."""
 
     format = b'tree'
 
@@ -13,4 +16,13 @@ class GitTree(GitObject):
         return tree_serialize(self)
     
     def init(self):
-        self.items = list()
\ No newline at end of file
+        self.items = list()
+
+    def find(self, name):
+        """The leaf named name, or None."""
+        if type(self.items) == GitTreeItems:
+            return self.items.find(name)
+        for leaf in self.items:
+            if leaf.path == name:
+                return leaf
+        return None
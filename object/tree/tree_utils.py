@@ -1,42 +1,121 @@
+from array import array
+from bisect import bisect_left
+
+
 class GitTreeLeaf (object):
+    """One entry of a tree.
+
+The name and SHA are kept as they are stored in the tree: raw bytes, and
+a 20-byte binary SHA.  path and sha decode them only when asked for.
+Both str/hex and bytes/binary are accepted when building a leaf."""
+
+    __slots__ = ("mode", "rawpath", "rawsha")
+
     def __init__(self, mode, path, sha):
+        if len(mode) == 5:
+            # Normalize to six bytes.
+            mode = b"0" + mode
         self.mode = mode
-        self.path = path
-        self.sha = sha
+        self.rawpath = path.encode("utf8") if type(path) == str else path
+        self.rawsha = bytes.fromhex(sha) if type(sha) == str else sha
 
+    @property
+    def path(self):
+        return self.rawpath.decode("utf8")
 
-def tree_parse_one(raw, start=0):
-    # Find the space terminator of the mode
-    x = raw.find(b' ', start)
-    assert x-start == 5 or x-start==6
+    @path.setter
+    def path(self, path):
+        self.rawpath = path.encode("utf8")
 
-    # Read the mode
-    mode = raw[start:x]
-    if len(mode) == 5:
-        # Normalize to six bytes.
-        mode = b"0" + mode
+    @property
+    def sha(self):
+        return self.rawsha.hex()
 
-    # Find the NULL terminator of the path
-    y = raw.find(b'\x00', x)
-    # and read the path
-    path = raw[x+1:y]
+    @sha.setter
+    def sha(self, sha):
+        self.rawsha = bytes.fromhex(sha)
 
-    # Read the SHA…
-    raw_sha = int.from_bytes(raw[y+1:y+21], "big")
-    # and convert it into an hex string, padded to 40 chars
-    # with zeros if needed.
-    sha = format(raw_sha, "040x")
-    return y+21, GitTreeLeaf(mode, path.decode("utf8"), sha)
 
-def tree_parse(raw):
-    pos = 0
-    max = len(raw)
-    ret = list()
-    while pos < max:
-        pos, data = tree_parse_one(raw, pos)
-        ret.append(data)
+class GitTreeKeys (object):
+    """Sequence view of the sort keys of a GitTreeItems, for bisect."""
+
+    def __init__(self, items):
+        self.items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        return self.items.key(i)
+
+
+class GitTreeItems (object):
+    """The entries of a parsed tree, decoded lazily.
+
+We keep the raw tree and, per entry, the offset of the NUL that ends its
+name (4 bytes per entry): the entry starts 21 bytes after the previous
+NUL, and the SHA is the 20 bytes after its own.  Leaves are only built
+when accessed.
 
-    return ret
+This is read-only: to edit a parsed tree, replace its items with a list,
+tree.items = list(tree.items)."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.ends = array("I")
+        pos = 0
+        end = len(raw)
+        while pos < end:
+            nul = raw.find(b'\x00', pos)
+            if nul < 0 or nul + 21 > end:
+                raise Exception("Malformed tree object")
+            self.ends.append(nul)
+            pos = nul + 21
+
+    def __len__(self):
+        return len(self.ends)
+
+    def start(self, i):
+        return self.ends[i - 1] + 21 if i else 0
+
+    def __getitem__(self, i):
+        if type(i) == slice:
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self.ends)
+        start = self.start(i)
+        nul = self.ends[i]
+        spc = self.raw.find(b' ', start, nul)
+        return GitTreeLeaf(self.raw[start:spc], self.raw[spc+1:nul], self.raw[nul+1:nul+21])
+
+    def __iter__(self):
+        for i in range(len(self.ends)):
+            yield self[i]
+
+    def key(self, i):
+        """The sort key of entry i: its name, plus a / for trees."""
+        start = self.start(i)
+        nul = self.ends[i]
+        spc = self.raw.find(b' ', start, nul)
+        name = self.raw[spc+1:nul]
+        # Tree modes are 40000, everything else starts with 1
+        return name + b"/" if self.raw[start] == 0x34 else name
+
+    def find(self, name):
+        """The leaf named name (str or bytes), or None."""
+        if type(name) == str:
+            name = name.encode("utf8")
+        keys = GitTreeKeys(self)
+        # A file sorts as its name, a directory as its name plus a /
+        for key in (name, name + b"/"):
+            i = bisect_left(keys, key)
+            if i < len(self) and keys[i] == key:
+                return self[i]
+        return None
+
+
+def tree_parse(raw):
+    return GitTreeItems(raw)
 
 # Notice this isn't a comparison function, but a conversion function.
 # Python's default sort doesn't accept a custom comparison function,
@@ -44,19 +123,19 @@ def tree_parse(raw):
 # value, which is compared using the default rules.  So we just return
 # the leaf name, with an extra / if it's a directory.
 def tree_leaf_sort_key(leaf):
-    if leaf.mode.startswith(b"10"):
-        return leaf.path
+    if leaf.mode.startswith(b"04"):
+        return leaf.rawpath + b"/"
     else:
-        return leaf.path + "/"
-    
+        return leaf.rawpath
+
 def tree_serialize(obj):
+    if type(obj.items) == GitTreeItems:
+        # Untouched since it was parsed
+        return obj.items.raw
+
     obj.items.sort(key=tree_leaf_sort_key)
-    ret = b''
+    ret = list()
     for i in obj.items:
-        ret += i.mode
-        ret += b' '
-        ret += i.path.encode("utf8")
-        ret += b'\x00'
-        sha = int(i.sha, 16)
-        ret += sha.to_bytes(20, byteorder="big")
-    return ret
\ No newline at end of file
+        # Git writes tree modes without the leading zero
+        ret.append(i.mode.lstrip(b"0") + b' ' + i.rawpath + b'\x00' + i.rawsha)
+    return b''.join(ret)
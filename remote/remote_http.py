@@ -0,0 +1,77 @@
+"""A smart HTTP server for fetches, standing in for git http-backend behind
+a web server: enough to clone from and fetch over http://, locally.
+
+    GET  <path>/info/refs?service=git-upload-pack    the refs
+    POST <path>/git-upload-pack                      one round of upload_pack
+
+Any <path> serves the one repository the server was started on.  Request
+bodies may come gzipped or chunked, as git sends them.
+"""
+
+import gzip
+import io
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from remote.remote_upload import upload_pack, upload_pack_advertise
+from remote.remote_utils import pkt_flush, pkt_write
+from repository.git_repository import GitRepository
+
+
+class GitHttpHandler (BaseHTTPRequestHandler):
+    """One request.  The repository is opened anew for each, so the refs
+are always current."""
+
+    def reply(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if not path.endswith("/info/refs") or "service=git-upload-pack" not in query.split("&"):
+            self.send_error(404, "Only smart HTTP fetches are served")
+            return
+        self.reply("application/x-git-upload-pack-advertisement")
+        pkt_write(self.wfile, b'# service=git-upload-pack\n')
+        pkt_flush(self.wfile)
+        upload_pack_advertise(GitRepository(self.server.repo_path), self.wfile)
+
+    def do_POST(self):
+        if not self.path.endswith("/git-upload-pack"):
+            self.send_error(404, "Only smart HTTP fetches are served")
+            return
+        body = self.body()
+        self.reply("application/x-git-upload-pack-result")
+        upload_pack(GitRepository(self.server.repo_path), io.BytesIO(body), self.wfile,
+                    stateless=True, advertise=False)
+
+    def body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = list()
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                chunk = self.rfile.read(size)
+                self.rfile.readline()
+                if size == 0:
+                    break
+                chunks.append(chunk)
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding", "").lower() in ("gzip", "x-gzip"):
+            body = gzip.decompress(body)
+        return body
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def remote_http_server(path, host = "127.0.0.1", port = 8000, verbose = False):
+    """A server for the repository at path; serve_forever() runs it.
+port 0 picks a free port, see server_address."""
+    server = ThreadingHTTPServer((host, port), GitHttpHandler)
+    server.daemon_threads = True
+    server.repo_path = path
+    server.verbose = verbose
+    return server
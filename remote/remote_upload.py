@@ -0,0 +1,117 @@
+"""The serving side of a fetch, like git upload-pack: advertise our refs,
+find out what the client already has, and stream it a pack of the rest.
+See remote_utils for the protocol.
+
+What to send is what the wants reach and the common haves don't, which
+the bitmaps answer when the repository has them (see pack_bitmap).  The
+pack is written as it is built, by copying entries out of our packs
+(see pack_stream), so a clone of a freshly gc'd repository is mostly a
+copy of its pack.
+"""
+
+from object.object_utils import object_exists, object_info
+from object.pack.pack_bitmap import bitmap_open, bitmap_reachable
+from object.pack.pack_write import pack_stream
+from object.refs.refs_utils import ref_peel, ref_resolve, ref_snapshot
+from remote.remote_utils import ZERO_SHA, pkt_flush, pkt_read, pkt_write
+from repository.repo_utils import repo_file
+
+
+UPLOAD_PACK_CAPABILITIES = ["ofs-delta", "no-progress", "agent=giit/1.0"]
+
+
+def upload_pack_refs(repo):
+    """What we advertise: (SHA, name) for HEAD, then every ref, annotated
+tags followed by what they peel to, as name^{}."""
+    lines = list()
+    sha = ref_resolve(repo, "HEAD")
+    if sha:
+        lines.append((sha, "HEAD"))
+    for name, sha in ref_snapshot(repo).items():
+        lines.append((sha, name))
+        if name.startswith("refs/tags/") and object_info(repo, sha)[0] == b'tag':
+            lines.append((ref_peel(repo, sha), name + "^{}"))
+    return lines
+
+def upload_pack_advertise(repo, out):
+    """Send every ref (see upload_pack_refs), with the capabilities on the
+first line.  Returns the refs sent."""
+    caps = list(UPLOAD_PACK_CAPABILITIES)
+    with open(repo_file(repo, "HEAD")) as f:
+        head = f.read().strip()
+    if head.startswith("ref: "):
+        caps.append("symref=HEAD:" + head[5:])
+
+    refs = upload_pack_refs(repo)
+    lines = refs or [(ZERO_SHA, "capabilities^{}")]
+    for i, (sha, name) in enumerate(lines):
+        line = f"{sha} {name}"
+        if i == 0:
+            line += "\0" + " ".join(caps)
+        pkt_write(out, (line + "\n").encode("utf8"))
+    pkt_flush(out)
+    out.flush()
+    return refs
+
+def upload_pack(repo, input, out, stateless = False, advertise = True):
+    """Serve one fetch: input and out are binary files connected to the
+client.  stateless is for HTTP, where each request is answered on its
+own: up to the first flush after the haves, or up to done and the pack.
+Returns the number of objects sent.
+
+Only what we advertise can be asked for: the refs and the tags they peel
+to, not any object we happen to have, which may be unreachable or behind
+a ref the client wasn't shown.  Stateless requests are checked against
+the refs as they are now."""
+    refs = upload_pack_advertise(repo, out) if advertise else upload_pack_refs(repo)
+    tips = set(sha for sha, _ in refs)
+
+    wants = list()
+    caps = set()
+    while True:
+        line = pkt_read(input)
+        if line is None:
+            break
+        if not line.startswith(b'want '):
+            raise Exception("Expected a want, got " + repr(line))
+        words = line.decode("ascii").split(" ")
+        if words[1] not in tips:
+            pkt_write(out, b'ERR upload-pack: not our ref ' + words[1].encode("ascii"))
+            out.flush()
+            raise Exception("Not our ref: " + words[1])
+        wants.append(words[1])
+        caps.update(words[2:])
+    if not wants:
+        # The client has everything
+        return 0
+
+    common = list()
+    while True:
+        line = pkt_read(input)
+        if line is None:
+            # End of a batch of haves: without multi_ack, we only say
+            # something while we have nothing in common
+            if not common:
+                pkt_write(out, b'NAK\n')
+            out.flush()
+            if stateless:
+                return 0
+        elif line.startswith(b'have '):
+            sha = line[5:45].decode("ascii")
+            if object_exists(repo, sha):
+                common.append(sha)
+                if len(common) == 1:
+                    pkt_write(out, b'ACK %s\n' % sha.encode("ascii"))
+        elif line == b'done':
+            if not common:
+                pkt_write(out, b'NAK\n')
+            break
+        else:
+            raise Exception("Expected a have, got " + repr(line))
+
+    bitmap = bitmap_open(repo)
+    bits, seen = bitmap_reachable(repo, bitmap, wants, common)
+    shas = list(seen)
+    if bitmap:
+        shas.extend(bitmap.shas(bits))
+    return pack_stream(repo, shas, out, ofs_delta="ofs-delta" in caps)
@@ -0,0 +1,358 @@
+"""Fetch and clone: the client side of git's pack protocol, version 0.
+
+Everything is exchanged as pkt-lines: four hex digits giving the length
+of the line including themselves, then the line.  "0000" is a flush, which
+ends a section.  A fetch goes:
+
+    server: <sha> HEAD\\0<capabilities>     every ref it has, then a flush
+            <sha> refs/heads/master
+    client: want <sha> <capabilities>      what it lacks, then a flush
+            want <sha>
+            have <sha>                     what it has, newest first, in
+            have <sha>                     batches ending with a flush
+    server: NAK                            nothing in common yet, or
+            ACK <sha>                      a have it also has
+    client: done
+    server: NAK, unless it ACKed, then the pack, raw
+
+git's upload-pack ACKs every common have, ours only the first, so the
+client skips whatever lines come before the pack.
+
+We use the simplest form of it: no multi_ack, no side-band, no thin or
+shallow packs.  The server is either upload-pack run as a child process
+(a local path or file:// URL), or a smart HTTP server (http:// URL),
+which is stateless: every request repeats the wants and the haves so far.
+See remote_upload for the other side.
+"""
+
+import os
+import shlex
+import subprocess
+import sys
+from object.commit.commit_walk import commit_walk
+from object.object_utils import object_exists
+from object.pack.pack_receive import pack_receive
+from object.refs.refs_utils import ref_resolve, ref_snapshot, ref_write
+from repository.git_repository import GitRepository
+from repository.repo_utils import repo_create, repo_file
+
+
+# What we ask of servers that offer it
+REMOTE_CAPABILITIES = ["ofs-delta", "no-progress"]
+REMOTE_AGENT = "agent=giit/1.0"
+
+# Haves are sent this many at a time; after this many without an ACK we
+# give up and take whatever the server sends
+HAVE_BATCH = 32
+HAVE_MAX = 256
+
+ZERO_SHA = "0" * 40
+
+# The giit script, which upload-pack is run through by default
+GIIT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "giit")
+
+
+def pkt_line(data):
+    """data as a pkt-line."""
+    if len(data) > 65516:
+        raise Exception("pkt-line too long")
+    return b'%04x' % (len(data) + 4) + data
+
+def pkt_write(out, data):
+    out.write(pkt_line(data))
+
+def pkt_flush(out):
+    out.write(b'0000')
+
+def pkt_read_exact(input, n):
+    data = input.read(n)
+    while len(data) < n:
+        more = input.read(n - len(data))
+        if not more:
+            raise Exception("Unexpected end of stream")
+        data += more
+    return data
+
+def pkt_read(input, head = None):
+    """The next pkt-line from input, without its newline, or None for a
+flush.  An ERR line from the other side is raised.  head is its length,
+if already read."""
+    n = int(head or pkt_read_exact(input, 4), 16)
+    if n == 0:
+        return None
+    if n < 4:
+        raise Exception("Invalid pkt-line length: " + str(n))
+    data = pkt_read_exact(input, n - 4)
+    if data.endswith(b'\n'):
+        data = data[:-1]
+    if data.startswith(b'ERR '):
+        raise Exception("Remote error: " + data[4:].decode("utf8", "replace"))
+    return data
+
+def remote_read_advertisement(input):
+    """The refs the server advertised, as a list of (name, SHA), and its
+capabilities, which come after a NUL on the first line.  Peeled tags
+(name^{}) are left out."""
+    refs = list()
+    caps = list()
+    while True:
+        line = pkt_read(input)
+        if line is None:
+            break
+        if b'\x00' in line:
+            line, rest = line.split(b'\x00', 1)
+            caps = rest.decode("utf8").split()
+        sha, name = line.decode("utf8").split(" ", 1)
+        # What an empty repository advertises, to carry its capabilities
+        if name == "capabilities^{}" or name.endswith("^{}"):
+            continue
+        refs.append((name, sha))
+    return refs, caps
+
+def remote_pack_start(input):
+    """Skip what the server says after done, up to the pack: git ACKs
+every common have, not only the first.  Returns the first four bytes of
+the pack, which can't be mistaken for the hex length of a pkt-line."""
+    while True:
+        head = pkt_read_exact(input, 4)
+        if head == b'PACK':
+            return head
+        pkt_read(input, head)
+
+def remote_wants(wants, caps):
+    """The want section of a request: capabilities go on the first line."""
+    ours = [c for c in REMOTE_CAPABILITIES if c in caps] + [REMOTE_AGENT]
+    lines = [pkt_line(b'want %s %s\n' % (wants[0].encode("ascii"), " ".join(ours).encode("ascii")))]
+    lines.extend(pkt_line(b'want %s\n' % sha.encode("ascii")) for sha in wants[1:])
+    lines.append(b'0000')
+    return b''.join(lines)
+
+
+class GitPipeTransport (object):
+    """upload-pack run as a child process, talked to over its stdin and
+stdout.  upload_pack is the command, "git upload-pack" for instance;
+giit's own by default."""
+
+    def __init__(self, path, upload_pack = None):
+        command = shlex.split(upload_pack) if upload_pack else [sys.executable, GIIT, "upload-pack"]
+        self.process = subprocess.Popen(command + [path], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def advertisement(self):
+        return remote_read_advertisement(self.process.stdout)
+
+    def negotiate(self, wants, haves, caps):
+        """Send wants, then haves until the server knows one.  Returns the
+stream the pack then comes on, and the bytes of it already read."""
+        out = self.process.stdin
+        input = self.process.stdout
+        out.write(remote_wants(wants, caps))
+
+        acked = False
+        sent = 0
+        for sha in haves:
+            pkt_write(out, b'have %s\n' % sha.encode("ascii"))
+            sent += 1
+            if sent % HAVE_BATCH == 0:
+                pkt_flush(out)
+                out.flush()
+                acked = pkt_read(input).startswith(b'ACK ')
+                if acked or sent >= HAVE_MAX:
+                    break
+        if sent % HAVE_BATCH and not acked:
+            pkt_flush(out)
+            out.flush()
+            acked = pkt_read(input).startswith(b'ACK ')
+
+        pkt_write(out, b'done\n')
+        out.flush()
+        return input, remote_pack_start(input)
+
+    def close(self):
+        """Hang up.  Without wants, the server expects a flush first."""
+        try:
+            if self.process.stdin:
+                self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.stdout.close()
+        if self.process.wait() not in (0, None):
+            raise Exception("upload-pack failed")
+
+
+class GitHttpTransport (object):
+    """A smart HTTP server: one GET for the refs, then one POST per round
+of negotiation, each repeating the wants and every have so far."""
+
+    def __init__(self, url):
+        import http.client
+        import urllib.parse
+
+        parts = urllib.parse.urlsplit(url)
+        connection = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.connect = lambda: connection(parts.hostname, parts.port)
+        self.path = parts.path.rstrip("/")
+        self.response = None
+
+    def request(self, method, path, body = None, headers = {}):
+        conn = self.connect()
+        conn.request(method, self.path + path, body,
+                     dict(headers, **{ "User-Agent": "giit/1.0" }))
+        response = conn.getresponse()
+        if response.status != 200:
+            raise Exception(f"HTTP {response.status} {response.reason} for {self.path + path}")
+        return response
+
+    def advertisement(self):
+        response = self.request("GET", "/info/refs?service=git-upload-pack")
+        with response:
+            first = pkt_read(response)
+            if first != b'# service=git-upload-pack' or pkt_read(response) is not None:
+                raise Exception("Not a smart HTTP server")
+            return remote_read_advertisement(response)
+
+    def post(self, body):
+        return self.request("POST", "/git-upload-pack", body,
+                            { "Content-Type": "application/x-git-upload-pack-request",
+                              "Accept": "application/x-git-upload-pack-result" })
+
+    def negotiate(self, wants, haves, caps):
+        head = remote_wants(wants, caps)
+        lines = list()
+        acked = False
+        for sha in haves:
+            lines.append(pkt_line(b'have %s\n' % sha.encode("ascii")))
+            if len(lines) % HAVE_BATCH == 0:
+                with self.post(head + b''.join(lines) + b'0000') as response:
+                    acked = pkt_read(response).startswith(b'ACK ')
+                if acked or len(lines) >= HAVE_MAX:
+                    break
+
+        # One more round, ending with done, which the pack answers
+        self.response = self.post(head + b''.join(lines) + pkt_line(b'done\n'))
+        return self.response, remote_pack_start(self.response)
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+
+
+def remote_transport(url, upload_pack = None):
+    """The transport for url: http(s)://, file:// or a local path."""
+    if url.startswith("http://") or url.startswith("https://"):
+        return GitHttpTransport(url)
+    if url.startswith("file://"):
+        url = url[7:]
+    if not os.path.isdir(url):
+        raise Exception("No such repository: " + url)
+    return GitPipeTransport(os.path.abspath(url), upload_pack)
+
+def remote_haves(repo):
+    """The commits we have, newest first, from our branches, the remote
+ones and HEAD."""
+    refs = ref_snapshot(repo)
+    tips = set(sha for prefix in ("refs/heads/", "refs/remotes/") for _, sha in refs.items(prefix))
+    head = ref_resolve(repo, "HEAD")
+    if head:
+        tips.add(head)
+    return commit_walk(repo, [sha for sha in tips if object_exists(repo, sha)])
+
+def remote_fetch(repo, remote, url, upload_pack = None):
+    """Fetch the branches and tags of url into refs/remotes/<remote>/ and
+refs/tags/, in one pack.  Tags we already have aren't moved.
+
+Returns (updates, objects, head): updates lists (local ref, old SHA or
+None, new SHA) for every ref that changed, objects is how many the pack
+held, head is the (branch ref, SHA) the server's HEAD points to, if any."""
+    transport = remote_transport(url, upload_pack)
+    try:
+        refs, caps = transport.advertisement()
+
+        wants = list()
+        for name, sha in refs:
+            if (name.startswith("refs/heads/") or name.startswith("refs/tags/")) \
+               and sha not in wants and not object_exists(repo, sha):
+                wants.append(sha)
+
+        objects = 0
+        if wants:
+            stream, data = transport.negotiate(wants, remote_haves(repo), caps)
+            objects, _ = pack_receive(repo, stream, data)
+        elif isinstance(transport, GitPipeTransport):
+            pkt_flush(transport.process.stdin)
+    finally:
+        transport.close()
+
+    current = ref_snapshot(repo)
+    updates = list()
+    for name, sha in refs:
+        if name.startswith("refs/heads/"):
+            local = f"refs/remotes/{remote}/" + name[11:]
+        elif name.startswith("refs/tags/"):
+            local = name
+            if current.get(local):
+                continue
+        else:
+            continue
+        old = current.get(local)
+        if old != sha:
+            ref_write(repo, local, sha)
+            updates.append((local, old, sha))
+
+    return updates, objects, remote_head(refs, caps)
+
+def remote_head(refs, caps):
+    """The branch the server's HEAD is on, as (ref, SHA), or None.  The
+symref capability says; older servers only give HEAD's SHA, which we
+match against the branches, master and main first."""
+    found = dict(refs)
+    for cap in caps:
+        if cap.startswith("symref=HEAD:"):
+            ref = cap[12:]
+            if ref in found:
+                return ref, found[ref]
+    head = found.get("HEAD")
+    if head is None:
+        return None
+    names = ["refs/heads/master", "refs/heads/main"] + sorted(found)
+    for name in names:
+        if name.startswith("refs/heads/") and found.get(name) == head:
+            return name, head
+    return None
+
+def remote_clone(url, path, upload_pack = None, jobs = None):
+    """Clone url into path, a new directory: fetch everything as remote
+origin, then check out the branch the server's HEAD is on.  Returns
+(repository, objects, branch or None when the remote is empty)."""
+    from worktree.checkout_utils import checkout_switch
+
+    # A local path is kept absolute: later fetches run from the clone
+    if url.startswith("file://"):
+        url = "file://" + os.path.abspath(url[7:])
+    elif not (url.startswith("http://") or url.startswith("https://")):
+        url = os.path.abspath(url)
+
+    repo_create(path)
+    repo = GitRepository(path)
+    section = 'remote "origin"'
+    repo.conf.add_section(section)
+    repo.conf.set(section, "url", url)
+    repo.conf.set(section, "fetch", "+refs/heads/*:refs/remotes/origin/*")
+
+    updates, objects, head = remote_fetch(repo, "origin", url, upload_pack)
+    branch = None
+    if head is not None:
+        ref, sha = head
+        branch = ref[11:]
+        section = f'branch "{branch}"'
+        repo.conf.add_section(section)
+        repo.conf.set(section, "remote", "origin")
+        repo.conf.set(section, "merge", ref)
+        with open(repo_file(repo, "HEAD"), "w") as f:
+            f.write(f"ref: {ref}\n")
+        # HEAD points to nothing yet, so the whole tree is written
+        checkout_switch(repo, sha, jobs=jobs)
+        ref_write(repo, ref, sha)
+
+    with open(repo_file(repo, "config"), "w") as f:
+        repo.conf.write(f)
+    return repo, objects, branch
@@ -0,0 +1,94 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from object.object_utils import object_find, object_read
+from repository.git_repository import GitRepository
+from repository.repo_utils import repo_find
+
+
+class AsyncGitRepository (object):
+    """A GitRepository for asyncio code: reads run on a thread pool of at
+most workers threads (one per CPU by default) instead of blocking the
+event loop.
+
+zlib releases the GIL while inflating, so the pool reads several objects
+at once.  Objects already in the repository's cache are returned right
+away, and concurrent reads of the same SHA share one read: only the
+first caller goes to the pool.  The objects returned are shared, and
+must not be modified."""
+
+    repo = None
+    executor = None
+    # SHA -> future of the read in progress
+    pending = None
+
+    def __init__(self, repo, workers = None):
+        if type(repo) == str:
+            repo = GitRepository(repo)
+        self.repo = repo
+        # Inflating is CPU work: more threads than CPUs only add waiting
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                           thread_name_prefix="giit")
+        self.pending = dict()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def read_object(self, sha):
+        """The object sha (see object_read), or None if there is none."""
+        if sha in self.repo.objects:
+            # Parsing is cheap next to inflating, do it here
+            return object_read(self.repo, sha)
+
+        future = self.pending.get(sha)
+        if future is None:
+            future = asyncio.ensure_future(self.run(object_read, self.repo, sha))
+            self.pending[sha] = future
+            future.add_done_callback(lambda f: self.pending.pop(sha, None))
+        # A caller giving up must not cancel the read for the others
+        return await asyncio.shield(future)
+
+    async def resolve(self, name, format = None):
+        """The SHA name refers to, see object_find."""
+        if format is None and len(name) == 40 and name.lower() in self.repo.objects:
+            # Nothing to look up
+            return name.lower()
+        return await self.run(object_find, self.repo, name, format)
+
+    async def read_path(self, rev, path):
+        """The object at path in the tree of rev: rev:path in git's words.
+Raises if there is no such path."""
+        sha = await self.resolve(rev)
+        obj = await self.read_object(sha)
+        # Peel tags and commits down to a tree
+        while obj is not None and obj.format in (b'tag', b'commit'):
+            sha = obj.kvlm[b'object' if obj.format == b'tag' else b'tree'].decode("ascii")
+            obj = await self.read_object(sha)
+
+        for part in path.strip("/").split("/"):
+            if not part:
+                continue
+            if obj is None:
+                raise Exception(f"Missing object {sha}")
+            leaf = obj.find(part) if obj.format == b'tree' else None
+            if leaf is None:
+                raise Exception(f"Path {path} does not exist in {rev}")
+            sha = leaf.sha
+            obj = await self.read_object(sha)
+        if obj is None:
+            raise Exception(f"Missing object {sha}")
+        return obj
+
+async def async_repo_find(path = ".", workers = None):
+    """repo_find, without blocking the event loop, as an AsyncGitRepository."""
+    repo = await asyncio.get_running_loop().run_in_executor(None, repo_find, path)
+    return AsyncGitRepository(repo, workers)
@@ -1,6 +1,7 @@
 import configparser
 import os
-from repository.repo_utils import repo_file
+from object.object_cache import GitObjectCache
+from object.pack.pack_store import GitPackStore
 
 
 class GitRepository (object):
@@ -9,6 +10,16 @@ class GitRepository (object):
     worktree = None
     gitdir = None
     conf = None
+    packs = None
+    objects = None
+    # What commit_info found in the commits it parsed
+    commits = None
+    # The commit-graph, opened on first use (False if there is none)
+    graph = None
+    # Snapshot of the refs, see ref_snapshot
+    refs = None
+    # Every object SHA, to resolve abbreviations, see object_match
+    prefixes = None
 
     def __init__(self, path, force = False):
         self.worktree = path
@@ -17,6 +28,9 @@ class GitRepository (object):
         if not(force or os.path.isdir(self.gitdir)):
             raise Exception("Not a git repository: " + path)
         
+        # repo_utils imports this module, so import it late
+        from repository.repo_utils import repo_config_size, repo_file
+
         #As there is  a config file in the .git directory, we can assume that this is a git repository
         self.conf = configparser.ConfigParser()
         cf = repo_file(self, "config")
@@ -30,3 +44,16 @@ class GitRepository (object):
             vers = int(self.conf.get("core", "repositoryformatversion", fallback=0))
             if vers != 0:
                 raise Exception("Unsupported repository format version: " + str(vers))
+
+        # Inflated objects are kept around, since history walks and tree
+        # traversals read the same commits and trees over and over.
+        # Both limits are in bytes and can be set in .git/config:
+        #   [core]
+        #       objectCacheLimit = 64m
+        #       deltaBaseCacheLimit = 16m
+        self.objects = GitObjectCache(repo_config_size(self, "objectcachelimit", 64 << 20))
+        self.commits = GitObjectCache(16 << 20)
+
+        # Packs are mapped once per repository and shared by every read
+        self.packs = GitPackStore(os.path.join(self.gitdir, "objects", "pack"),
+                                  GitObjectCache(repo_config_size(self, "deltabasecachelimit", 16 << 20)))
@@ -52,6 +52,20 @@ example, repo_file(r, \"refs\", \"remotes\", \"origin\", \"HEAD\") will create
     if repo_dir(repo, *path[:-1], mkdir = mkdir):
         return repo_path(repo, *path)
 
+def repo_config_size(repo, key, default):
+    """Read a size from the [core] section of the repository config.
+
+Like git, accept a plain number of bytes or one with a k, m or g suffix."""
+    value = repo.conf.get("core", key, fallback=None)
+    if value is None:
+        return default
+
+    value = value.strip().lower()
+    units = { "k": 1 << 10, "m": 1 << 20, "g": 1 << 30 }
+    if value and value[-1] in units:
+        return int(value[:-1]) * units[value[-1]]
+    return int(value)
+
 def repo_create(path):
     """Create a new git repository in the given path."""
 
@@ -66,6 +80,27 @@ def repo_create(path):
     else:
         os.makedirs(repo.worktree)
 
+    #Creating the .git directory
+    assert repo_dir(repo, "branches", mkdir = True)
+    assert repo_dir(repo, "objects", mkdir = True)
+    assert repo_dir(repo, "refs", "tags", mkdir = True)
+    assert repo_dir(repo, "refs", "heads", mkdir = True)
+
+    # .git/description
+    with open(repo_file(repo, "description"), "w") as f:
+        f.write("Unnamed repository; edit this file 'description' to name the repository.\n")
+    
+    # .git/HEAD 
+    with open(repo_file(repo, "HEAD"), "w") as f:
+        f.write("ref: refs/heads/master\n")
+            
+    # And lastly for .git/config
+    with open(repo_file(repo, "config"), "w") as f:
+        config = repo_default_config()
+        config.write(f)
+
+    return repo
+
 
 def repo_default_config():
     """Return the default configuration for a git repository."""
@@ -80,7 +115,7 @@ def repo_default_config():
 def repo_find(path = ".", required = True):
     path = os.path.realpath(path) #get the path uptill the root directory of the project
                                   #E.g. /home/user/project
-    if os.path.isdir(path):
+    if os.path.isdir(os.path.join(path, ".git")):
         return GitRepository(path)
     
     #If the path is not a directory, we need to check the parent directory 
@@ -0,0 +1,221 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import stat
+import time
+from index.index_utils import (index_entry_from_stat, index_entry_stat_changed,
+                               index_hash_path, index_mtime, index_read, index_write)
+from object.object_utils import object_read
+from object.refs.refs_utils import ref_resolve
+from object.tree.tree_diff import tree_diff, tree_items, tree_leaf_is_tree
+
+
+# Blobs at least this big get their space reserved before being written,
+# so the filesystem can lay them out in one extent
+CHECKOUT_PREALLOCATE = 1 << 20
+
+def checkout_flatten(repo, sha):
+    """List what tree (or commit) sha holds, without recursion.
+
+Returns (dirs, files): every directory path, parents before children, and
+(path, mode, sha) for every other entry.  Paths are relative to the tree,
+with / separators."""
+    dirs = list()
+    files = list()
+    stack = [("", sha)]
+    while stack:
+        prefix, sha = stack.pop()
+        for leaf in tree_items(repo, sha):
+            path = prefix + leaf.path
+            if tree_leaf_is_tree(leaf):
+                dirs.append(path)
+                stack.append((path + "/", leaf.sha))
+            else:
+                files.append((path, leaf.mode, leaf.sha))
+    return dirs, files
+
+def checkout_write(repo, path, mode, sha):
+    """Write blob sha to path, as mode says: a regular or executable file,
+a symlink (whose blob is the target), or for a submodule an empty
+directory."""
+    if mode == b'160000':
+        os.makedirs(path, exist_ok=True)
+        return 0
+
+    obj = object_read(repo, sha)
+    if obj is None:
+        raise Exception("Missing object: " + sha)
+    data = obj.blobdata
+
+    if mode == b'120000':
+        os.symlink(os.fsdecode(data), path)
+        return len(data)
+
+    # The umask applies, like for git
+    perms = 0o777 if mode == b'100755' else 0o666
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), perms)
+    try:
+        if len(data) >= CHECKOUT_PREALLOCATE and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, len(data))
+            except OSError:
+                # Not supported by this filesystem, no harm done
+                pass
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    finally:
+        os.close(fd)
+    return len(data)
+
+def checkout_tree(repo, sha, path, jobs = None):
+    """Check out tree (or commit) sha into directory path, which should be
+empty.
+
+The tree is first flattened, then every directory created, then blobs
+are read and written by a pool of jobs threads.  Inflating (zlib) and
+writing both release the GIL, so this runs on several cores and keeps
+several writes in flight.
+
+Returns (files, bytes, seconds)."""
+    start = time.perf_counter()
+    dirs, files = checkout_flatten(repo, sha)
+
+    for d in dirs:
+        os.mkdir(os.path.join(path, d))
+
+    total = 0
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        futures = [ex.submit(checkout_write, repo, os.path.join(path, name), mode, blob)
+                   for name, mode, blob in files]
+        for f in futures:
+            total += f.result()
+
+    return len(files), total, time.perf_counter() - start
+
+def checkout_untracked(repo, index, name):
+    """Whether directory name holds files the index doesn't track."""
+    for root, dirs, files in os.walk(os.path.join(repo.worktree, name)):
+        prefix = os.path.relpath(root, repo.worktree).replace(os.sep, "/") + "/"
+        for f in files:
+            if index.find(prefix + f) is None:
+                return True
+    return False
+
+def checkout_conflicts(repo, index, changes):
+    """The paths among changes that hold work a switch would destroy.
+
+A tracked path conflicts if its index entry differs from the tree we're
+leaving (a staged change), or if the file differs from its entry.  The
+file is only rehashed when its stat() data doesn't match the entry.  A
+path the switch adds conflicts if an untracked file is already there
+with other content."""
+    racy = index_mtime(repo)
+    ret = list()
+    for status, name, old, new in changes:
+        path = os.path.join(repo.worktree, name)
+        entry = index.find(name)
+        try:
+            st = os.lstat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+
+        if old is None:
+            if entry is not None and entry.sha != new.sha:
+                ret.append(name)
+            elif entry is None and st is not None:
+                if stat.S_ISDIR(st.st_mode):
+                    # A directory the tree we're leaving had, which the
+                    # switch empties, unless it holds untracked files
+                    if checkout_untracked(repo, index, name):
+                        ret.append(name)
+                elif index_hash_path(path, st) != new.sha:
+                    ret.append(name)
+            continue
+
+        if entry is None or entry.sha != old.sha:
+            ret.append(name)
+        elif (st is not None and old.mode != b'160000'
+              and index_entry_stat_changed(entry, st, racy)
+              and index_hash_path(path, st) != entry.sha):
+            ret.append(name)
+    return ret
+
+def checkout_remove(repo, name):
+    """Delete name from the worktree, then its parent directories as long
+as they're empty, stopping at the worktree."""
+    path = os.path.join(repo.worktree, name)
+    if os.path.isdir(path) and not os.path.islink(path):
+        # A submodule: only an empty one goes, like git we leave a
+        # checked out one (and its parents) alone
+        try:
+            os.rmdir(path)
+        except OSError:
+            return
+    else:
+        try:
+            os.unlink(path)
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+
+    parent = os.path.dirname(name)
+    while parent:
+        try:
+            os.rmdir(os.path.join(repo.worktree, parent))
+        except OSError:
+            # Not empty
+            break
+        parent = os.path.dirname(parent)
+
+def checkout_switch(repo, sha, force = False, jobs = None):
+    """Move the worktree and index from HEAD to commit sha, in place.
+
+Only the paths tree_diff reports are touched: subtrees that are the same
+in both commits are never read, so switching between two close commits
+costs time in proportion to what changed, not to the size of the tree.
+
+Unless force is set, nothing is written if a change would overwrite local
+work, see checkout_conflicts.  HEAD itself is left to the caller.
+
+Returns (written, removed, seconds)."""
+    start = time.perf_counter()
+    index = index_read(repo)
+    head = ref_resolve(repo, "HEAD")
+    changes = list(tree_diff(repo, head, sha))
+
+    if not force:
+        conflicts = checkout_conflicts(repo, index, changes)
+        if conflicts:
+            raise Exception("Your local changes would be overwritten by checkout:\n  "
+                            + "\n  ".join(conflicts))
+
+    # Removals first: a file may be replaced by a directory of the same
+    # name, or the other way around.
+    writes = list()
+    removed = 0
+    for status, name, old, new in changes:
+        if old is not None:
+            checkout_remove(repo, name)
+        if new is None:
+            index.remove(name)
+            removed += 1
+        else:
+            writes.append((name, new))
+
+    for name, new in writes:
+        os.makedirs(os.path.join(repo.worktree, os.path.dirname(name)), exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        futures = [ex.submit(checkout_write, repo, os.path.join(repo.worktree, name), new.mode, new.sha)
+                   for name, new in writes]
+        for f in futures:
+            f.result()
+
+    for name, new in writes:
+        entry = index_entry_from_stat(name, new.sha, os.lstat(os.path.join(repo.worktree, name)))
+        if new.mode == b'160000':
+            entry.mode = 0o160000
+        index.add(entry)
+    index_write(repo, index)
+
+    return len(writes), removed, time.perf_counter() - start
@@ -0,0 +1,234 @@
+"""The .gitignore engine.
+
+Ignore rules come from, by increasing precedence:
+    - the global excludes file (core.excludesFile, by default
+      ~/.config/git/ignore)
+    - .git/info/exclude
+    - the .gitignore of each directory, deeper ones first
+
+and within a file, the last matching line wins.  Instead of calling fnmatch
+for every pattern on every path, each directory gets one compiled regex
+holding every rule that applies to it, highest precedence first, so a
+single fullmatch() tells us the winning rule.
+"""
+
+import os
+import re
+
+
+def ignore_translate(pattern):
+    """Translate a gitignore glob into a regex source string.
+
+* and ? never match a /, ** matches across directories when it makes up
+a whole path component."""
+    i = 0
+    n = len(pattern)
+    out = list()
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern[i:i+2] == '**' and (i == 0 or pattern[i-1] == '/') and (i+2 == n or pattern[i+2] == '/'):
+                if i+2 == n:
+                    # Trailing /**: everything inside
+                    out.append('.*')
+                    i += 2
+                else:
+                    # Leading or inner **/: zero or more directories
+                    out.append('(?:.*/)?')
+                    i += 3
+                continue
+            while i < n and pattern[i] == '*':
+                i += 1
+            out.append('[^/]*')
+            continue
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i+1:j]
+                negate = body[0] in '!^'
+                if negate:
+                    body = body[1:]
+                # Escape what re would read as escapes or set operations
+                body = re.sub(r'([\\\[&~|^])', r'\\\1', body)
+                if negate:
+                    body = '^' + body
+                out.append('(?!/)[' + body + ']')
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+def ignore_parse_line(line, base):
+    """Parse one line of an ignore file that lives in directory base
+(relative to the worktree, "" or ending with a /).
+
+Returns (regex, negated, dir_only), the regex matching paths relative to
+the worktree, or None for blank lines and comments."""
+    line = line.rstrip("\n").rstrip("\r")
+    if not line or line.startswith("#"):
+        return None
+
+    # Trailing spaces are ignored, unless escaped
+    stripped = line.rstrip(" ")
+    if stripped.endswith("\\") and len(stripped) < len(line):
+        stripped += " "
+    line = stripped
+    if not line:
+        return None
+
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    elif line.startswith("\\!") or line.startswith("\\#"):
+        line = line[1:]
+
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+
+    # A slash anywhere but at the end anchors the pattern to base;
+    # otherwise it matches a name at any depth below base.
+    if "/" in line:
+        regex = re.escape(base) + ignore_translate(line.lstrip("/"))
+    else:
+        regex = re.escape(base) + '(?:.*/)?' + ignore_translate(line)
+
+    return regex, negated, dir_only
+
+def ignore_read_file(path, base):
+    """Parse the ignore file at path, returning its rules with the
+highest precedence (the last line) first."""
+    try:
+        with open(path, "r", encoding="utf8", errors="surrogateescape") as f:
+            lines = f.readlines()
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return []
+
+    rules = [ignore_parse_line(line, base) for line in lines]
+    return [r for r in reversed(rules) if r]
+
+
+class GitIgnoreRules (object):
+    """Every rule that applies inside one directory, highest precedence
+first, compiled into two regexes: one for files, and one for directories
+which also holds the rules ending in /."""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.compiled = None
+
+    def compile(self):
+        file_rules = [r for r in self.rules if not r[2]]
+        self.compiled = (
+            self.compile_rules(file_rules),
+            [r[1] for r in file_rules],
+            self.compile_rules(self.rules),
+            [r[1] for r in self.rules],
+        )
+
+    @staticmethod
+    def compile_rules(rules):
+        if not rules:
+            return None
+        # fullmatch tries the alternatives in order, so the first one to
+        # match is the winning rule, and it's the only group that matched.
+        return re.compile("|".join("(" + r[0] + ")" for r in rules), re.DOTALL)
+
+    def match(self, path, is_dir):
+        """Return True if path is ignored, False if a negated rule
+re-includes it, None if no rule matches."""
+        if self.compiled is None:
+            self.compile()
+        file_re, file_negated, dir_re, dir_negated = self.compiled
+        regex, negated = (dir_re, dir_negated) if is_dir else (file_re, file_negated)
+        if regex is None:
+            return None
+        m = regex.fullmatch(path)
+        if m is None:
+            return None
+        return not negated[m.lastindex - 1]
+
+
+class GitIgnore (object):
+    """Answer "is this path ignored?" for a repository.
+
+Rules are loaded, and results cached, per directory: checking a path
+costs one regex match against its directory's rules, plus one per parent
+directory the first time that directory is seen (a path below an ignored
+directory is ignored, whatever its own rules say).
+
+Instances can be passed directly as worktree_scan's ignore callback."""
+
+    def __init__(self, repo):
+        self.worktree = os.path.realpath(repo.worktree)
+
+        excludes = repo.conf.get("core", "excludesfile", fallback=None)
+        if excludes:
+            excludes = os.path.expanduser(excludes)
+        else:
+            config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+            excludes = os.path.join(config_home, "git", "ignore")
+
+        base = ignore_read_file(os.path.join(repo.gitdir, "info", "exclude"), "")
+        base += ignore_read_file(excludes, "")
+
+        self.base = GitIgnoreRules(base)
+        # directory ("" for the root, else "a/b") -> GitIgnoreRules
+        self.dirs = dict()
+        # directory -> whether it is ignored
+        self.ignored_dirs = { "": False }
+
+    def rules(self, dirname):
+        """The rules applying to entries of directory dirname."""
+        ret = self.dirs.get(dirname)
+        if ret is not None:
+            return ret
+
+        if dirname:
+            parent = self.rules(os.path.dirname(dirname))
+            base = dirname + "/"
+        else:
+            parent = self.base
+            base = ""
+
+        own = ignore_read_file(os.path.join(self.worktree, dirname, ".gitignore"), base)
+        # Directories without a .gitignore share their parent's regex
+        ret = GitIgnoreRules(own + parent.rules) if own else parent
+        self.dirs[dirname] = ret
+        return ret
+
+    def dir_ignored(self, dirname):
+        ret = self.ignored_dirs.get(dirname)
+        if ret is None:
+            parent = os.path.dirname(dirname)
+            ret = self.dir_ignored(parent) or bool(self.rules(parent).match(dirname, True))
+            self.ignored_dirs[dirname] = ret
+        return ret
+
+    def check(self, path, is_dir = False):
+        """Whether path, relative to the worktree with / separators, is
+ignored."""
+        path = path.rstrip("/")
+        if is_dir:
+            return self.dir_ignored(path)
+        parent = os.path.dirname(path)
+        if self.dir_ignored(parent):
+            return True
+        return bool(self.rules(parent).match(path, False))
+
+    def __call__(self, path, is_dir):
+        return self.check(path, is_dir)
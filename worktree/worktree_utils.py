@@ -0,0 +1,108 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+import stat
+from index.index_utils import index_entry_stat_changed, index_mtime
+
+
+def worktree_is_gitlink(entry):
+    """Whether index entry is a submodule: its directory belongs to
+another repository, and is never looked into."""
+    return entry.mode & 0o170000 == 0o160000
+
+def worktree_scan_dir(worktree, prefix, entries, racy, ignore):
+    """Scan one directory of the worktree.
+
+prefix is the directory's path relative to the worktree, with a trailing
+/ (or "" for the root).  Returns (dirs, changed, untracked, seen): the
+subdirectories to scan next, the (entry, stat) pairs of tracked files
+whose stat() doesn't match the index, the untracked file names, and the
+names of every tracked file we met."""
+    dirs = list()
+    changed = list()
+    untracked = list()
+    seen = list()
+
+    with os.scandir(os.path.join(worktree, prefix)) as it:
+        for d in it:
+            name = prefix + d.name
+            if d.is_dir(follow_symlinks=False):
+                if d.name == ".git":
+                    continue
+                entry = entries.get(name)
+                if entry is not None and worktree_is_gitlink(entry):
+                    seen.append(name)
+                    continue
+                # Tracked files below an ignored directory are still
+                # checked, by worktree_scan, once the walk is done.
+                if ignore and ignore(name, True):
+                    continue
+                dirs.append(name + "/")
+                continue
+
+            entry = entries.get(name)
+            if entry is None:
+                if not (ignore and ignore(name, False)):
+                    untracked.append(name)
+                continue
+
+            # Only tracked files pay for a stat()
+            seen.append(name)
+            st = d.stat(follow_symlinks=False)
+            if index_entry_stat_changed(entry, st, racy):
+                changed.append((entry, st))
+
+    return dirs, changed, untracked, seen
+
+def worktree_scan(repo, index, ignore = None, jobs = None):
+    """Walk the worktree and compare it with index, without hashing
+anything.
+
+Directories are scanned concurrently by a pool of jobs threads: scandir()
+and stat() release the GIL, so on a big tree (or a cold cache) the
+syscalls overlap.  ignore, if given, is called as ignore(name, is_dir)
+and lets us prune whole ignored directories instead of walking them.
+
+Returns (changed, deleted, untracked).  changed holds (entry, stat) pairs
+for the files that may have changed, the only ones worth rehashing."""
+    worktree = os.path.realpath(repo.worktree)
+    racy = index_mtime(repo)
+    entries = { e.name: e for e in index }
+
+    changed = list()
+    deleted = list()
+    untracked = list()
+    seen = set()
+
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        pending = { ex.submit(worktree_scan_dir, worktree, "", entries, racy, ignore) }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                dirs, c, u, s = f.result()
+                changed.extend(c)
+                untracked.extend(u)
+                seen.update(s)
+                for d in dirs:
+                    pending.add(ex.submit(worktree_scan_dir, worktree, d, entries, racy, ignore))
+
+    # Whatever the walk didn't meet was either deleted, replaced by a
+    # directory, or lives in a pruned directory: look at those directly.
+    for name, entry in entries.items():
+        if name in seen:
+            continue
+        try:
+            st = os.lstat(os.path.join(worktree, name))
+        except (FileNotFoundError, NotADirectoryError):
+            deleted.append(name)
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            # A submodule in an ignored directory is still there
+            if not worktree_is_gitlink(entry):
+                deleted.append(name)
+        elif index_entry_stat_changed(entry, st, racy):
+            changed.append((entry, st))
+
+    changed.sort(key=lambda c: c[0].name)
+    deleted.sort()
+    untracked.sort()
+    return changed, deleted, untracked